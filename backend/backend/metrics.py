@@ -0,0 +1,296 @@
+"""
+In-process request metrics with a Prometheus text export.
+
+MetricsMiddleware records, per route (URL name) and method: a latency histogram, the number
+and total time of SQL queries, the time spent in serializers and the response size. Every
+observation is a few additions under one lock, cheap enough to stay on in production.
+GET /metrics/ renders the aggregates in the Prometheus text exposition format.
+
+Aggregates live in the memory of each worker process: scrape every worker (or run one worker
+per scrape target). Counters restart from zero when a worker restarts, which Prometheus'
+rate() functions expect.
+"""
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+# Upper bounds of the histogram buckets; +Inf is implied
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+RESPONSE_SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+METRIC_PREFIX = 'eshop'
+
+# Requests that resolve to no URL pattern share one label, so random paths cannot add series
+UNMATCHED_ROUTE = 'unmatched'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class RequestStats:
+    """Measurements of the request being handled, filled in by the SQL and serializer hooks."""
+    __slots__ = ('sql_queries', 'sql_time', 'serializer_time', 'serializing')
+
+    def __init__(self):
+        self.sql_queries = 0
+        self.sql_time = 0.0
+        self.serializer_time = 0.0
+        self.serializing = False
+
+
+# Context variables follow the request into sync_to_async threads, so queries made by async
+# views are attributed to their request too
+_current = contextvars.ContextVar('request_stats', default=None)
+
+
+def current_stats():
+    """The RequestStats of the request being handled, or None outside a request."""
+    return _current.get()
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'total', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class Summary:
+    """Sum and count only (no quantiles): enough for averages and rates."""
+    __slots__ = ('total', 'count')
+
+    def __init__(self):
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.total += value
+        self.count += 1
+
+
+class RouteSeries:
+    """Everything recorded for one (route, method) pair."""
+    __slots__ = ('statuses', 'latency', 'sql_queries', 'sql_time', 'serializer_time', 'response_size')
+
+    def __init__(self):
+        self.statuses = {}
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.sql_queries = Histogram(QUERY_COUNT_BUCKETS)
+        self.sql_time = Summary()
+        self.serializer_time = Summary()
+        self.response_size = Histogram(RESPONSE_SIZE_BUCKETS)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def record(self, route, method, status, duration, stats, response_size=None):
+        with self._lock:
+            series = self._series.get((route, method))
+            if series is None:
+                series = self._series[(route, method)] = RouteSeries()
+            series.statuses[status] = series.statuses.get(status, 0) + 1
+            series.latency.observe(duration)
+            series.sql_queries.observe(stats.sql_queries)
+            series.sql_time.observe(stats.sql_time)
+            series.serializer_time.observe(stats.serializer_time)
+            if response_size is not None:
+                series.response_size.observe(response_size)
+
+    def reset(self):
+        with self._lock:
+            self._series = {}
+
+    def render(self):
+        """Returns the aggregates in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            series = sorted(self._series.items())
+            lines = []
+
+            def header(name, kind, help_text):
+                lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+                lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+
+            header('http_requests_total', 'counter', "Requests handled, by route, method and status code.")
+            for (route, method), data in series:
+                for status, count in sorted(data.statuses.items()):
+                    lines.append(_sample('http_requests_total', _labels(route, method, status=status), count))
+
+            for name, attribute, help_text in (
+                ('http_request_duration_seconds', 'latency', "Time from the request reaching the middleware to the response leaving it."),
+                ('http_request_sql_queries', 'sql_queries', "SQL queries executed per request."),
+                ('http_response_size_bytes', 'response_size', "Response body size (streaming responses excluded)."),
+            ):
+                header(name, 'histogram', help_text)
+                for (route, method), data in series:
+                    _render_histogram(lines, name, _labels(route, method), getattr(data, attribute))
+
+            for name, attribute, help_text in (
+                ('http_request_sql_duration_seconds', 'sql_time', "Time spent executing SQL per request."),
+                ('http_request_serializer_duration_seconds', 'serializer_time', "Time spent in serializers' to_representation per request."),
+            ):
+                header(name, 'summary', help_text)
+                for (route, method), data in series:
+                    summary = getattr(data, attribute)
+                    lines.append(_sample(f'{name}_sum', _labels(route, method), summary.total))
+                    lines.append(_sample(f'{name}_count', _labels(route, method), summary.count))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(route, method, **extra):
+    labels = {'route': route, 'method': method, **extra}
+    return ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+
+
+def _sample(name, labels, value):
+    return f"{METRIC_PREFIX}_{name}{{{labels}}} {value}"
+
+
+def _render_histogram(lines, name, labels, histogram):
+    cumulative = 0
+    for bound, count in zip((*histogram.bounds, '+Inf'), histogram.counts):
+        cumulative += count
+        lines.append(_sample(f'{name}_bucket', f'{labels},le="{bound}"', cumulative))
+    lines.append(_sample(f'{name}_sum', labels, float(histogram.total)))
+    lines.append(_sample(f'{name}_count', labels, histogram.count))
+
+
+registry = MetricsRegistry()
+
+
+# --- SQL instrumentation ---
+
+def record_sql(execute, sql, params, many, context):
+    """Database execute wrapper adding each query's count and time to the current request."""
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.sql_queries += 1
+        stats.sql_time += time.perf_counter() - start
+
+
+def install_sql_wrapper(connection):
+    """Adds record_sql to a connection's execute wrappers (once)."""
+    if record_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_sql)
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    install_sql_wrapper(connection)
+
+
+connection_created.connect(_on_connection_created)
+
+
+# --- Serializer instrumentation ---
+
+class TimedSerializerMixin:
+    """
+    Adds the serializer's to_representation time to the current request's serializer time.
+    Only the outermost call is timed, so nested serializers are not counted twice.
+    """
+
+    def to_representation(self, instance):
+        stats = _current.get()
+        if stats is None or stats.serializing:
+            return super().to_representation(instance)
+        stats.serializing = True
+        start = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            stats.serializer_time += time.perf_counter() - start
+            stats.serializing = False
+
+
+# --- Middleware and endpoint ---
+
+class MetricsMiddleware:
+    """
+    Records the metrics of every request. Keep it first in MIDDLEWARE so the latency covers
+    the whole middleware stack. Works under both WSGI and ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats, token, start = self._start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._finish(request, response, stats, start)
+        return response
+
+    async def __acall__(self, request):
+        stats, token, start = self._start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._finish(request, response, stats, start)
+        return response
+
+    def _start(self):
+        # Connections opened before this module was imported never fired connection_created
+        for alias in connections:
+            install_sql_wrapper(connections[alias])
+        stats = RequestStats()
+        return stats, _current.set(stats), time.perf_counter()
+
+    def _finish(self, request, response, stats, start):
+        duration = time.perf_counter() - start
+        match = getattr(request, 'resolver_match', None)
+        route = match.view_name if match is not None else UNMATCHED_ROUTE
+        size = None if response.streaming else len(response.content)
+        registry.record(route, request.method, response.status_code, duration, stats, size)
+
+
+def metrics_view(request):
+    """
+    GET /metrics/ - Prometheus scrape endpoint. When METRICS_TOKEN is set, scrapers must send
+    'Authorization: Bearer <token>'; without a token only staff signed in to the admin may read
+    it, since the metrics expose routes and traffic.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token:
+        allowed = constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    else:
+        allowed = request.user.is_active and request.user.is_staff
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
@@ -31,6 +31,7 @@ import os
 from pathlib import Path
 from dotenv import load_dotenv
 from datetime import timedelta # Used for JWT configuration
+from corsheaders.defaults import default_headers
 
 # Load environment variables from .env file
 load_dotenv()
@@ -91,6 +92,8 @@ if 'corsheaders' not in INSTALLED_APPS:
     INSTALLED_APPS.insert(0, 'corsheaders')
 
 MIDDLEWARE = [
+    # First, so request latency covers the whole stack (exported on /metrics/)
+    'backend.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
         'corsheaders.middleware.CorsMiddleware', # Ensure corsheaders middleware is here
@@ -186,6 +189,23 @@ STATIC_URL = '/static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media' # Where user-uploaded files (like product images) are stored locally
 
+# How saved product images get their thumbnails (WebP/AVIF/JPEG): 'command' leaves them to
+# `manage.py generate_image_derivatives` (run it periodically, e.g. from cron); 'pool' renders
+# them in a process pool forked inside each web worker (PRODUCT_IMAGE_WORKERS processes, None
+# uses one per CPU), which multiplies memory by the web workers and is unsafe to fork from
+# threaded servers, so keep it to single-threaded setups; 'inline' renders them in the saving
+# request (development and tests). Use 'command' in production.
+PRODUCT_IMAGE_DERIVATIVES = os.environ.get('PRODUCT_IMAGE_DERIVATIVES', 'command')
+PRODUCT_IMAGE_WORKERS = int(os.environ['PRODUCT_IMAGE_WORKERS']) if os.environ.get('PRODUCT_IMAGE_WORKERS') else None
+
+# Largest catalog file (bytes) the admin upload endpoint imports within the request;
+# bigger files go through `manage.py import_products`
+PRODUCT_IMPORT_MAX_UPLOAD_SIZE = 5 * 1024 * 1024
+
+# When set, /metrics/ requires 'Authorization: Bearer <METRICS_TOKEN>'; unset, only staff
+# signed in to the admin can read it
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 CORS_ALLOW_ALL_ORIGINS = True  # Only for development
 CORS_ALLOW_CREDENTIALS = True
@@ -197,6 +217,10 @@ CORS_ALLOWED_ORIGINS = [
     "http://127.0.0.1:3000",
 ]
 
+# Anonymous carts are addressed by this header (see cart/session.py); browsers may send and read it
+CORS_ALLOW_HEADERS = (*default_headers, 'x-cart-token')
+CORS_EXPOSE_HEADERS = ['X-Cart-Token']
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -225,7 +249,8 @@ ALLOWED_HOSTS = os.environ.get('DJANGO_ALLOWED_HOSTS', '127.0.0.1,localhost').sp
 REST_FRAMEWORK = {
     # JWT is now the default authentication for all endpoints
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # simplejwt's JWTAuthentication with the token's user resolved from the cache
+        'users.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication', # Keep for Browsable API access
     ),
     
@@ -262,4 +287,62 @@ SIMPLE_JWT = {
     # The user model field used to look up the user in the database
     "USER_ID_FIELD": "id", 
     "USER_ID_CLAIM": "user_id",
+    # Checks the blacklist through an in-process filter instead of a table lookup per refresh
+    "TOKEN_REFRESH_SERIALIZER": "users.serializers.TokenRefreshSerializer",
+    # Merges the anonymous cart sent in X-Cart-Token into the user's cart at sign-in
+    "TOKEN_OBTAIN_SERIALIZER": "users.serializers.TokenObtainPairSerializer",
+}
+
+# Seconds between refreshes of each process's revoked-token filter (see users/tokens.py).
+# The filter only spares table lookups when the cache below is shared by every process.
+# Prune the token tables with `manage.py compact_tokens`.
+TOKEN_BLACKLIST_FILTER_REFRESH = 60
+
+# ----------------------------------------------------------------------
+# CACHE SETTINGS
+# ----------------------------------------------------------------------
+
+# Local-memory cache by default; point DJANGO_CACHE_BACKEND/DJANGO_CACHE_LOCATION at a
+# shared backend (e.g. Redis or Memcached) in production so all workers see the same cache.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', 'wooden-eshop'),
+    }
 }
+
+# How long (seconds) a cached product listing count may live; product writes invalidate it earlier.
+PRODUCT_COUNT_CACHE_TIMEOUT = 300
+
+# Seconds a rendered product detail stays cached (writes invalidate it earlier via signals)
+PRODUCT_DETAIL_CACHE_TIMEOUT = 3600
+
+# Serve product list and detail reads from the pre-rendered ProductDocument table.
+# Documents are always maintained; run `manage.py rebuild_product_documents` once before enabling.
+PRODUCT_READ_MODEL = os.environ.get('PRODUCT_READ_MODEL', '').lower() in ('1', 'true')
+
+# Seconds the user (and cart id) of a JWT-authenticated request stays in the shared cache, and
+# in each process's own layer in front of it. User and cart writes invalidate the shared entry;
+# other processes may see a changed user for up to the local timeout.
+AUTH_USER_CACHE_TIMEOUT = 60
+AUTH_USER_LOCAL_CACHE_TIMEOUT = 5
+
+# Serve GET requests of views marked `token_claims_suffice` (the cart) from the token's claims
+# without loading the user: a deactivated user can read them until their access token expires.
+AUTH_TRUST_TOKEN_CLAIMS = os.environ.get('AUTH_TRUST_TOKEN_CLAIMS', '').lower() in ('1', 'true')
+
+# Bulk (partner) registration: rows accepted per API request, whose passwords are hashed within
+# the request (a few hundred ms each), and the processes `manage.py register_users` hashes with
+# (default: one per CPU). Larger batches go through that command.
+BULK_REGISTRATION_MAX_ROWS = 100
+BULK_REGISTRATION_WORKERS = None
+
+# ----------------------------------------------------------------------
+# CART SETTINGS
+# ----------------------------------------------------------------------
+
+# How long stock added to a cart stays reserved before release_expired_reservations returns it
+CART_RESERVATION_TTL = timedelta(minutes=15)
+
+# How long an anonymous visitor's cart (kept in the default cache) lives after its last write
+ANONYMOUS_CART_TIMEOUT = timedelta(days=7)
@@ -0,0 +1,106 @@
+import re
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from products.models import Product
+
+from .metrics import registry
+
+
+def sample(text, name, **labels):
+    """Returns the value of one sample of the exposition `text`, or None."""
+    wanted = {f'{key}="{value}"' for key, value in labels.items()}
+    for line in text.splitlines():
+        match = re.fullmatch(r'(\w+)\{(.*)\} (\S+)', line)
+        if match and match[1] == name and wanted <= set(match[2].split(',')):
+            return float(match[3])
+    return None
+
+
+class MetricsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(3):
+            Product.objects.create(
+                name=f"Stacking Ring {i}", slug=f"stacking-ring-{i}", price=Decimal('20.00'),
+                short_description="s", long_description="l",
+            )
+
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        self.client = APIClient()
+
+    def scrape(self, **headers):
+        response = self.client.get('/metrics/', headers=headers)
+        return response, response.content.decode()
+
+    def sign_in_staff(self):
+        self.client.force_login(User.objects.create_user(username='ops', password='pass12345', is_staff=True))
+
+    def test_records_latency_sql_serializer_and_size_per_route(self):
+        # COUNT, page, images and features
+        with self.assertNumQueries(4):
+            listing = self.client.get('/api/v1/products/list/')
+        self.client.get('/api/v1/products/list/', {'page': 'x'})
+
+        self.sign_in_staff()
+        response, text = self.scrape()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+
+        route = {'route': 'product-list-products', 'method': 'GET'}
+        self.assertEqual(sample(text, 'eshop_http_requests_total', status=200, **route), 1)
+        self.assertEqual(sample(text, 'eshop_http_requests_total', status=400, **route), 1)
+        self.assertEqual(sample(text, 'eshop_http_request_duration_seconds_count', **route), 2)
+        self.assertEqual(sample(text, 'eshop_http_request_duration_seconds_bucket', le='+Inf', **route), 2)
+        self.assertEqual(sample(text, 'eshop_http_request_sql_queries_sum', **route), 4)
+        self.assertGreater(sample(text, 'eshop_http_request_sql_duration_seconds_sum', **route), 0)
+        self.assertGreater(sample(text, 'eshop_http_request_serializer_duration_seconds_sum', **route), 0)
+        self.assertGreaterEqual(sample(text, 'eshop_http_response_size_bytes_sum', **route), len(listing.content))
+
+    def test_histogram_buckets_are_cumulative(self):
+        for _ in range(3):
+            self.client.get('/api/v1/products/stacking-ring-0/')
+        self.sign_in_staff()
+        _, text = self.scrape()
+        route = {'route': 'product-detail', 'method': 'GET'}
+        buckets = [
+            float(line.rsplit(' ', 1)[1]) for line in text.splitlines()
+            if line.startswith('eshop_http_request_sql_queries_bucket{route="product-detail"')
+        ]
+        self.assertEqual(buckets, sorted(buckets))
+        self.assertEqual(buckets[-1], 3)
+        # Cached after the first request: two of the three ran no SQL
+        self.assertEqual(sample(text, 'eshop_http_request_sql_queries_bucket', le=0, **route), 2)
+
+    def test_unknown_paths_share_one_series(self):
+        self.client.get('/no/such/page/')
+        self.client.get('/another/missing/page/')
+        self.sign_in_staff()
+        _, text = self.scrape()
+        self.assertEqual(sample(text, 'eshop_http_requests_total', route='unmatched', method='GET', status=404), 2)
+
+    async def test_async_views_record_their_queries(self):
+        await self.async_client.get('/api/v1/async/products/', {'fields': 'id'})
+        text = registry.render()
+        route = {'route': 'async-product-list', 'method': 'GET'}
+        self.assertEqual(sample(text, 'eshop_http_requests_total', status=200, **route), 1)
+        self.assertEqual(sample(text, 'eshop_http_request_sql_queries_sum', **route), 2)
+
+    def test_only_staff_can_read_without_a_token(self):
+        self.assertEqual(self.scrape()[0].status_code, 403)
+        self.client.force_login(User.objects.create_user(username='shopper', password='pass12345'))
+        self.assertEqual(self.scrape()[0].status_code, 403)
+        self.sign_in_staff()
+        self.assertEqual(self.scrape()[0].status_code, 200)
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_token_protects_the_endpoint(self):
+        self.assertEqual(self.scrape()[0].status_code, 403)
+        self.assertEqual(self.scrape(Authorization='Bearer scrape-secret')[0].status_code, 200)
@@ -18,6 +18,7 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from cart.views import CartViewSet # <-- NEW IMPORT
+from backend.metrics import metrics_view
 
 # Import the ViewSets from your apps
 from products.views import ProductViewSet
@@ -53,8 +54,13 @@ urlpatterns = [
     path('api/v1/', include(router.urls)),
     # Backwards-compatible unversioned API root (keeps existing clients working)
     path('api/', include(router.urls)),
+    # Async (ASGI-native) catalog reads: list, detail and search
+    path('api/v1/async/products/', include('products.urls')),
     # Include users/me endpoints under the requested prefix
     path('api/users/v1/', include('users.urls')),
+
+    # Prometheus scrape endpoint (per-route latency, SQL and serializer metrics)
+    path('metrics/', metrics_view, name='metrics'),
 ]
 
 # Note: In a real-world project, you would also need to configure serving MEDIA_URL 
@@ -0,0 +1,24 @@
+"""
+Reproducible API benchmarks.
+
+Seeds a deterministic dataset (products with images and features, users with profiles and
+carts), drives the product, cart, token and users/me endpoints at fixed concurrency levels and
+writes throughput and p50/p95/p99 latencies to a JSON file that can be compared across commits.
+
+Run from the backend directory, e.g. against a throwaway SQLite database:
+
+    python -m benchmarks --sqlite /tmp/bench.sqlite3 --seed --products 5000 --concurrency 1,8,32 \\
+        --output bench-results.json --baseline previous-results.json
+
+The dataset is the one `manage.py seed` generates (users/seeding.py), with every product
+stocked for the cart scenarios; a seeded database can also be benchmarked without --seed.
+Without --sqlite the configured database is used (point DB_NAME at a dedicated MySQL schema);
+only seeded rows (prefixed 'seed-') are written or deleted. --url benchmarks a running server over HTTP
+instead of calling Django in process.
+
+The async_product_list scenario hits the ASGI-native list (products/async_views.py) with the
+pages product_list requests from the sync ProductViewSet. Compare the two under --asgi, which
+calls Django's ASGI handler the way uvicorn would (workers are tasks on one event loop):
+
+    python -m benchmarks --sqlite /tmp/bench.sqlite3 --asgi --scenarios product_list,async_product_list
+"""
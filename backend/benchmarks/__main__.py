@@ -0,0 +1,107 @@
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timezone
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description="Benchmark the API endpoints.")
+    parser.add_argument('--sqlite', metavar='PATH', help="Use (and recreate when seeding) this SQLite file instead of the configured database.")
+    parser.add_argument('--seed', action='store_true', help="Replace the benchmark dataset before running.")
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--images', type=int, default=2, help="Images per product.")
+    parser.add_argument('--features', type=int, default=3, help="Features per product.")
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--cart-items', type=int, default=3, help="Maximum items in each seeded cart.")
+    parser.add_argument('--random-seed', type=int, default=42)
+    parser.add_argument('--seed-workers', type=int, default=None, help="Processes seeding the dataset (default: one per CPU; one on SQLite).")
+    parser.add_argument('--concurrency', default='1,8,32', help="Comma separated thread counts.")
+    parser.add_argument('--requests', type=int, default=200, help="Timed requests per scenario and concurrency level.")
+    parser.add_argument('--warmup', type=int, default=20, help="Untimed requests before each measurement.")
+    parser.add_argument('--scenarios', help="Comma separated subset of the scenarios (default: all).")
+    parser.add_argument('--url', help="Benchmark a running server at this base URL instead of in process.")
+    parser.add_argument(
+        '--asgi', action='store_true',
+        help="Call Django's ASGI handler in process, the concurrency being tasks on one event loop instead of threads.",
+    )
+    parser.add_argument('--output', default='bench-results.json', help="Where to write the JSON results.")
+    parser.add_argument('--baseline', help="Earlier results file to compare with.")
+    parser.add_argument('--max-regression', type=float, default=0.2, help="Allowed p95 increase over the baseline (fraction).")
+    return parser.parse_args(argv)
+
+
+def setup_django(sqlite_path=None):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+    from django.conf import settings
+
+    if sqlite_path:
+        # Before django.setup(): connections read DATABASES on first use. IMMEDIATE transactions make
+        # concurrent writers wait for the lock instead of failing with "database is locked"
+        settings.DATABASES = {'default': {
+            'ENGINE': 'django.db.backends.sqlite3', 'NAME': sqlite_path,
+            'OPTIONS': {'timeout': 30, 'transaction_mode': 'IMMEDIATE'},
+        }}
+    import django
+    django.setup()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.asgi and args.url:
+        sys.exit("--asgi and --url are exclusive (point --url at an ASGI server instead).")
+    setup_django(args.sqlite)
+
+    from django.core.management import call_command
+    from .runner import SCENARIOS, InProcessTransport, AsgiTransport, HttpTransport, make_workers, run_scenario, environment, compare, format_table
+    from .seed import seed_dataset, clear_dataset
+
+    scenarios = args.scenarios.split(',') if args.scenarios else list(SCENARIOS)
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(sorted(unknown))} (available: {', '.join(SCENARIOS)})")
+    levels = [int(level) for level in args.concurrency.split(',')]
+
+    dataset = None
+    if args.seed:
+        if args.sqlite and os.path.exists(args.sqlite):
+            os.remove(args.sqlite)
+        call_command('migrate', verbosity=0)
+        clear_dataset()
+        dataset = seed_dataset(args.products, args.images, args.features, args.users, args.cart_items, args.random_seed, args.seed_workers)
+        print(f"Seeded {dataset}")
+
+    if args.url:
+        transport = HttpTransport(args.url)
+    else:
+        transport = AsgiTransport() if args.asgi else InProcessTransport()
+    results = []
+    for level in levels:
+        workers = make_workers(level, args.random_seed)
+        for name in scenarios:
+            result = run_scenario(name, transport, workers, args.requests, args.warmup)
+            results.append(result)
+            print(f"{name} x{level}: {result['throughput_rps']} req/s, p95 {result['latency_ms']['p95']} ms, {result['errors']} errors")
+
+    report = {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'environment': environment(transport),
+        'dataset': dataset,
+        'options': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'results': results,
+    }
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2)
+    print(format_table(results))
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            lines, regressions = compare(results, json.load(baseline), args.max_regression)
+        print('\n'.join(lines))
+        if regressions:
+            sys.exit(f"p95 regressed by more than {args.max_regression:.0%}: {', '.join(regressions)}")
+
+
+if __name__ == '__main__':
+    main()
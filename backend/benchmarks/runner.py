@@ -0,0 +1,381 @@
+import asyncio
+import json
+import math
+import platform
+import random
+import subprocess
+import threading
+import time
+from itertools import count
+from pathlib import Path
+
+import django
+from asgiref.sync import async_to_sync, sync_to_async
+from django.db import connection, connections
+
+from .seed import PASSWORD
+
+API = '/api/v1'
+
+
+def allowed_host():
+    from django.conf import settings
+
+    # The test client's default 'testserver' host is not in ALLOWED_HOSTS outside tests
+    return next((host for host in settings.ALLOWED_HOSTS if host and host[0] not in '*.'), 'localhost')
+
+
+class InProcessTransport:
+    """Sends requests through Django's full handler and middleware stack in this process (no network)."""
+    name = 'in-process'
+    is_async = False
+
+    def __init__(self):
+        self._local = threading.local()
+        self.host = allowed_host()
+
+    def request(self, method, path, body=None, token=None):
+        from django.test import Client
+
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = Client(raise_request_exception=False, HTTP_HOST=self.host)
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        if body is None:
+            response = client.generic(method, path, headers=headers)
+        else:
+            response = client.generic(method, path, json.dumps(body), content_type='application/json', headers=headers)
+        return response.status_code, response.content
+
+    def close_thread(self):
+        # Each worker thread opened its own database connections
+        connections.close_all()
+
+
+class AsgiTransport:
+    """
+    Sends requests through Django's ASGI handler in this process (no network), the way an ASGI
+    server such as uvicorn calls it: workers run as tasks on one event loop instead of threads, so
+    async views overlap their waits while sync views queue for the handler's one sync thread.
+    """
+    name = 'asgi'
+    is_async = True
+
+    def __init__(self):
+        from django.test import AsyncClient
+
+        host = allowed_host().encode()
+
+        class Client(AsyncClient):
+            def request(self, **request):
+                # The async client always sends 'Host: testserver'; an extra Host header would be joined to it
+                request['headers'] = [(b'host', host)] + [header for header in request['headers'] if header[0] != b'host']
+                return super().request(**request)
+
+        self.client = Client(raise_request_exception=False)
+
+    async def arequest(self, method, path, body=None, token=None):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        if body is None:
+            response = await self.client.generic(method, path, headers=headers)
+        else:
+            response = await self.client.generic(method, path, json.dumps(body), content_type='application/json', headers=headers)
+        return response.status_code, response.content
+
+    def request(self, method, path, body=None, token=None):
+        # For the untimed `prepare` steps, which run in the sync thread of the event loop
+        return async_to_sync(self.arequest)(method, path, body, token)
+
+    def close_thread(self):
+        pass
+
+
+class HttpTransport:
+    """Sends requests to a running server (e.g. gunicorn or uvicorn) over HTTP, one session per thread."""
+    name = 'http'
+    is_async = False
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self._local = threading.local()
+
+    def request(self, method, path, body=None, token=None):
+        import requests
+
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        response = session.request(method, self.base_url + path, json=body, headers=headers, timeout=60)
+        return response.status_code, response.content
+
+    def close_thread(self):
+        session = getattr(self._local, 'session', None)
+        if session is not None:
+            session.close()
+
+
+class Worker:
+    """One simulated client: a seeded user with an access token and its own random stream."""
+
+    def __init__(self, index, user, token, catalog, seed):
+        self.index = index
+        self.user = user
+        self.token = token
+        self.catalog = catalog
+        self.rng = random.Random(seed * 1000 + index)
+        # Cart line used by the update and remove scenarios
+        self.item_id = self.item_product = None
+
+    def random_product(self):
+        return self.rng.choice(self.catalog)
+
+    def add_item(self, transport, quantity=1):
+        product_id, _ = self.random_product()
+        status, content = transport.request('POST', f'{API}/cart/items/add/', {'product_id': product_id, 'quantity': quantity}, self.token)
+        if status != 201:
+            raise RuntimeError(f"Cannot add a cart item (HTTP {status}): {content[:200]!r}")
+        return json.loads(content)['id'], product_id
+
+
+# --- Scenarios ---
+# Each scenario returns (method, path, body, token) for one timed request; `prepare` (optional)
+# runs untimed before every request.
+
+def _product_list(worker):
+    page = worker.rng.randint(1, max(1, len(worker.catalog) // 20))
+    return 'GET', f'{API}/products/list/?page={page}&size=20', None, None
+
+
+def _async_product_list(worker):
+    # The ASGI-native twin of _product_list (products/async_views.py), same pages
+    page = worker.rng.randint(1, max(1, len(worker.catalog) // 20))
+    return 'GET', f'{API}/async/products/?page={page}&size=20', None, None
+
+
+def _product_list_cursor(worker):
+    sort = worker.rng.choice(('name', '-final_price', '-created_at'))
+    return 'GET', f'{API}/products/list/?cursor=&size=20&sort={sort}', None, None
+
+
+def _product_detail(worker):
+    _, slug = worker.random_product()
+    return 'GET', f'{API}/products/{slug}/', None, None
+
+
+def _cart_read(worker):
+    return 'GET', f'{API}/cart/', None, worker.token
+
+
+def _cart_add(worker):
+    product_id, _ = worker.random_product()
+    return 'POST', f'{API}/cart/items/add/', {'product_id': product_id, 'quantity': worker.rng.randint(1, 3)}, worker.token
+
+
+def _prepare_cart_update(worker, transport):
+    if worker.item_id is None:
+        worker.item_id, worker.item_product = worker.add_item(transport)
+
+
+def _cart_update(worker):
+    body = {'product_id': worker.item_product, 'quantity': worker.rng.randint(1, 5)}
+    return 'PUT', f'{API}/cart/items/{worker.item_id}/', body, worker.token
+
+
+def _prepare_cart_remove(worker, transport):
+    worker.item_id, worker.item_product = worker.add_item(transport)
+
+
+def _cart_remove(worker):
+    return 'DELETE', f'{API}/cart/items/{worker.item_id}/', None, worker.token
+
+
+def _token(worker):
+    return 'POST', f'{API}/token/', {'username': worker.user.username, 'password': PASSWORD}, None
+
+
+def _users_me(worker):
+    return 'GET', '/api/users/v1/users/me/', None, worker.token
+
+
+# name -> (build request, prepare, expected status)
+SCENARIOS = {
+    'product_list': (_product_list, None, 200),
+    'async_product_list': (_async_product_list, None, 200),
+    'product_list_cursor': (_product_list_cursor, None, 200),
+    'product_detail': (_product_detail, None, 200),
+    'cart_read': (_cart_read, None, 200),
+    'cart_add': (_cart_add, None, 201),
+    'cart_update': (_cart_update, _prepare_cart_update, 200),
+    'cart_remove': (_cart_remove, _prepare_cart_remove, 200),
+    'token': (_token, None, 200),
+    'users_me': (_users_me, None, 200),
+}
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def run_scenario(name, transport, workers, requests, warmup=0):
+    """
+    Sends `warmup` untimed and then `requests` timed requests of one scenario, spread over the
+    workers (one thread each, or one task each on an async transport). Returns the result record.
+    """
+    build, prepare, expected = SCENARIOS[name]
+
+    def record(method, path, status, content, elapsed, latencies, errors):
+        if status == expected:
+            latencies.append(elapsed)
+        else:
+            errors.append(f"HTTP {status} for {method} {path}: {content[:200]!r}")
+
+    def drive_threads(total, latencies, errors):
+        counter = count()
+
+        def loop(worker):
+            try:
+                while next(counter) < total:
+                    if prepare is not None:
+                        prepare(worker, transport)
+                    method, path, body, token = build(worker)
+                    start = time.perf_counter()
+                    status, content = transport.request(method, path, body, token)
+                    record(method, path, status, content, time.perf_counter() - start, latencies, errors)
+            except Exception as e:
+                errors.append(repr(e))
+            finally:
+                transport.close_thread()
+
+        threads = [threading.Thread(target=loop, args=(worker,)) for worker in workers]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+    async def drive_tasks(total, latencies, errors):
+        counter = count()
+
+        async def loop(worker):
+            try:
+                while next(counter) < total:
+                    if prepare is not None:
+                        await sync_to_async(prepare)(worker, transport)
+                    method, path, body, token = build(worker)
+                    start = time.perf_counter()
+                    status, content = await transport.arequest(method, path, body, token)
+                    record(method, path, status, content, time.perf_counter() - start, latencies, errors)
+            except Exception as e:
+                errors.append(repr(e))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(loop(worker) for worker in workers))
+        return time.perf_counter() - started
+
+    def drive(total, latencies, errors):
+        if transport.is_async:
+            # Sync code (sync views, the ORM under async views) then runs in this thread, as under an ASGI server
+            return async_to_sync(drive_tasks)(total, latencies, errors)
+        return drive_threads(total, latencies, errors)
+
+    drive(warmup, [], [])
+    latencies, errors = [], []
+    duration = drive(requests, latencies, errors)
+    latencies.sort()
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 3)
+
+    return {
+        'scenario': name,
+        'concurrency': len(workers),
+        'requests': requests,
+        'ok': len(latencies),
+        'errors': len(errors),
+        'error_samples': errors[:3],
+        'duration_s': round(duration, 4),
+        'throughput_rps': round(len(latencies) / duration, 2) if duration else None,
+        'latency_ms': {
+            'mean': ms(sum(latencies) / len(latencies)) if latencies else None,
+            'p50': ms(percentile(latencies, 50)),
+            'p95': ms(percentile(latencies, 95)),
+            'p99': ms(percentile(latencies, 99)),
+            'max': ms(latencies[-1]) if latencies else None,
+        },
+    }
+
+
+def make_workers(concurrency, seed):
+    """One worker per thread, each bound to its own seeded user (users are reused if there are too few)."""
+    from django.contrib.auth.models import User
+    from rest_framework_simplejwt.tokens import RefreshToken
+
+    from products.models import Product
+    from users.seeding import PRODUCT_PREFIX, USER_PREFIX
+
+    catalog = list(Product.objects.filter(slug__startswith=PRODUCT_PREFIX).order_by('pk').values_list('id', 'slug'))
+    # A few seeded users are inactive and could not authenticate
+    users = list(User.objects.filter(username__startswith=USER_PREFIX, is_active=True).order_by('username'))
+    if not catalog or not users:
+        raise RuntimeError("No benchmark dataset found; run with --seed first.")
+    # Issued directly: the token scenario measures the login endpoint itself
+    tokens = {user.pk: str(RefreshToken.for_user(user).access_token) for user in users[:concurrency]}
+    return [
+        Worker(index, users[index % len(users)], tokens[users[index % len(users)].pk], catalog, seed)
+        for index in range(concurrency)
+    ]
+
+
+def environment(transport):
+    """What a result file needs to be compared with another run."""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=Path(__file__).resolve().parent,
+            capture_output=True, text=True, timeout=10,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'transport': transport.name,
+        'platform': platform.platform(),
+    }
+
+
+def compare(results, baseline, max_regression):
+    """
+    Compares results with a baseline run: returns (report lines, regressions) where a regression
+    is a p95 latency more than `max_regression` (a fraction) above the baseline's.
+    """
+    previous = {(r['scenario'], r['concurrency']): r for r in baseline['results']}
+    lines, regressions = [], []
+    for result in results:
+        before = previous.get((result['scenario'], result['concurrency']))
+        if before is None or not before['latency_ms']['p95'] or not result['latency_ms']['p95']:
+            continue
+        change = result['latency_ms']['p95'] / before['latency_ms']['p95'] - 1
+        throughput = (result['throughput_rps'] or 0) / (before['throughput_rps'] or 1) - 1
+        label = f"{result['scenario']} x{result['concurrency']}"
+        lines.append(f"{label:<32} p95 {change:+7.1%}  throughput {throughput:+7.1%}")
+        if change > max_regression:
+            regressions.append(label)
+    return lines, regressions
+
+
+def format_table(results):
+    lines = [f"{'scenario':<22}{'conc':>5}{'ok':>7}{'err':>5}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"]
+    for r in results:
+        latency = r['latency_ms']
+        lines.append(
+            f"{r['scenario']:<22}{r['concurrency']:>5}{r['ok']:>7}{r['errors']:>5}{r['throughput_rps'] or 0:>10.1f}"
+            f"{latency['p50'] or 0:>10.2f}{latency['p95'] or 0:>10.2f}{latency['p99'] or 0:>10.2f}"
+        )
+    return '\n'.join(lines)
@@ -0,0 +1,38 @@
+from django.contrib.auth.hashers import make_password
+
+from products.cache import bump_catalog_version
+from products.models import Product
+from users import seeding
+from users.seeding import PRODUCT_PREFIX
+
+PASSWORD = 'bench-password'
+
+# Large enough that cart scenarios never run out of stock
+STOCK = 1_000_000
+
+
+def clear_dataset():
+    """Deletes every seeded product and user (with their carts, images and features)."""
+    seeding.clear_seed_data()
+
+
+def seed_dataset(products=1000, images=2, features=3, users=50, cart_items=3, seed=42, workers=None):
+    """
+    Seeds the dataset of `manage.py seed` (see users/seeding.py), then stocks every product
+    so cart scenarios never fail for lack of stock, and rebuilds the derived data bulk inserts
+    bypass (search indexes, facet summary, product documents). Returns the dataset sizes.
+    """
+    # Hashed once: every seeded user shares the password, and hashing per user would dominate the run
+    password = make_password(PASSWORD)
+    seeding.seed_dataset(
+        products, users, password, images=images, features=features, cart_items=cart_items,
+        seed=seed, workers=seeding.default_workers(workers),
+    )
+    Product.objects.filter(slug__startswith=PRODUCT_PREFIX).update(stock_quantity=STOCK, is_available=True)
+
+    seeding.rebuild_derived()
+    bump_catalog_version()
+    return {
+        'products': products, 'images_per_product': images, 'features_per_product': features,
+        'users': users, 'cart_items_per_user': cart_items, 'seed': seed,
+    }
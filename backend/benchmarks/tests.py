@@ -0,0 +1,62 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from cart.models import Cart
+from products.models import Product, ProductDocument
+
+from .runner import SCENARIOS, AsgiTransport, compare, make_workers, percentile, run_scenario
+from users.seeding import PRODUCT_PREFIX, USER_PREFIX
+from .seed import STOCK, clear_dataset, seed_dataset
+
+
+def result(scenario, p95, rps=100.0):
+    return {'scenario': scenario, 'concurrency': 1, 'throughput_rps': rps, 'latency_ms': {'p95': p95}}
+
+
+class BenchmarkTests(TestCase):
+
+    def test_seed_is_deterministic_and_complete(self):
+        seed_dataset(products=5, images=2, features=1, users=2, cart_items=2, seed=7)
+        first = list(Product.objects.filter(slug__startswith=PRODUCT_PREFIX).order_by('slug').values_list('price', 'brand'))
+
+        self.assertEqual(len(first), 5)
+        self.assertEqual(ProductDocument.objects.filter(slug__startswith=PRODUCT_PREFIX).count(), 5)
+        self.assertFalse(Product.objects.filter(slug__startswith=PRODUCT_PREFIX).exclude(stock_quantity=STOCK).exists())
+        self.assertEqual(Cart.objects.filter(user__username__startswith=USER_PREFIX).count(), 2)
+
+        clear_dataset()
+        self.assertFalse(User.objects.filter(username__startswith=USER_PREFIX).exists())
+        seed_dataset(products=5, images=2, features=1, users=2, cart_items=2, seed=7)
+        again = list(Product.objects.filter(slug__startswith=PRODUCT_PREFIX).order_by('slug').values_list('price', 'brand'))
+        self.assertEqual(again, first)
+
+    def test_workers_build_requests_for_every_scenario(self):
+        seed_dataset(products=3, images=1, features=1, users=1, cart_items=1)
+        workers = make_workers(2, seed=1)
+        # Fewer users than workers: users are shared
+        self.assertEqual(workers[0].user, workers[1].user)
+        workers[0].item_id, workers[0].item_product = 1, workers[0].catalog[0][0]
+        for name, (build, _, _) in SCENARIOS.items():
+            method, path, _, _ = build(workers[0])
+            self.assertIn(method, ('GET', 'POST', 'PUT', 'DELETE'), name)
+            self.assertTrue(path.startswith('/api/'), name)
+
+    def test_percentile_and_baseline_comparison(self):
+        values = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+        self.assertEqual(percentile(values, 50), 5)
+        self.assertEqual(percentile(values, 95), 10)
+        self.assertIsNone(percentile([], 50))
+
+        baseline = {'results': [result('cart_read', 10.0), result('token', 100.0)]}
+        lines, regressions = compare([result('cart_read', 13.0), result('token', 105.0), result('new', 1.0)], baseline, 0.2)
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(regressions, ['cart_read x1'])
+
+    def test_asgi_transport_runs_sync_and_async_lists(self):
+        seed_dataset(products=3, images=1, features=1, users=1, cart_items=1)
+        workers = make_workers(4, seed=1)
+        transport = AsgiTransport()
+        for name in ('product_list', 'async_product_list', 'cart_update'):
+            record = run_scenario(name, transport, workers, requests=8, warmup=2)
+            self.assertEqual((record['ok'], record['errors']), (8, 0), record['error_samples'])
+            self.assertEqual(record['concurrency'], 4)
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from cart.reservations import release_expired_reservations
+
+
+class Command(BaseCommand):
+    help = "Returns the stock of expired cart reservations (schedule this every minute or so)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Reservations released per transaction.")
+
+    def handle(self, *args, **options):
+        released = release_expired_reservations(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Released {released} expired reservations."))
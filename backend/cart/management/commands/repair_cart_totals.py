@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from cart.models import Cart
+
+
+class Command(BaseCommand):
+    help = "Finds carts whose denormalized totals drifted from their items and repairs them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Carts checked per batch.")
+        parser.add_argument('--dry-run', action='store_true', help="Only report drifted carts, do not fix them.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        expected_items, expected_price = Cart.totals_expressions()
+
+        checked = repaired = 0
+        last_id = 0
+        while True:
+            # Walk the cart table by primary key so every batch is an index range scan
+            batch = list(Cart.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1]
+            checked += len(batch)
+
+            drifted = list(
+                Cart.objects.filter(pk__in=batch)
+                .annotate(expected_items=expected_items, expected_price=expected_price)
+                .filter(~Q(total_items=expected_items) | ~Q(total_price=expected_price))
+                .values_list('pk', flat=True)
+            )
+            if drifted and not options['dry_run']:
+                Cart.objects.filter(pk__in=drifted).update(total_items=expected_items, total_price=expected_price)
+            repaired += len(drifted)
+
+        action = "Found" if options['dry_run'] else "Repaired"
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked} carts. {action} {repaired} with drifted totals."))
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:17
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import F, Sum, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_totals(apps, schema_editor):
+    """Computes the new counters for every existing cart in one UPDATE."""
+    Cart = apps.get_model('cart', 'Cart')
+    CartItem = apps.get_model('cart', 'CartItem')
+    price_field = models.DecimalField(max_digits=12, decimal_places=2)
+
+    items = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+    Cart.objects.update(
+        total_items=Coalesce(Subquery(items.annotate(total=Sum('quantity')).values('total')), Value(0)),
+        total_price=Coalesce(
+            Subquery(items.annotate(total=Sum(F('price_at_addition') * F('quantity'), output_field=price_field)).values('total')),
+            Value(Decimal('0.00')),
+            output_field=price_field,
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='total_items',
+            field=models.PositiveIntegerField(default=0, help_text='Total quantity of all items in the cart.'),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='total_price',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), help_text='Sum of all item subtotals.', max_digits=12),
+        ),
+        migrations.RunPython(populate_totals, migrations.RunPython.noop),
+    ]
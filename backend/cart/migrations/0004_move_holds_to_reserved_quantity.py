@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:09
+
+from django.db import migrations
+from django.db.models import Sum
+
+
+def move_holds_to_reserved_quantity(apps, schema_editor):
+    """
+    Holds used to be taken out of stock_quantity: give them back to it and count them in
+    reserved_quantity instead, then bring the stored product documents to the new shape
+    (on-hand stock_quantity plus available_quantity).
+    """
+    Product = apps.get_model('products', 'Product')
+    ProductDocument = apps.get_model('products', 'ProductDocument')
+    StockReservation = apps.get_model('cart', 'StockReservation')
+
+    held = dict(StockReservation.objects.values('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total'))
+    products = list(Product.objects.filter(pk__in=held).only('stock_quantity'))
+    for product in products:
+        product.stock_quantity += held[product.pk]
+        product.reserved_quantity = held[product.pk]
+    Product.objects.bulk_update(products, ['stock_quantity', 'reserved_quantity'], batch_size=1000)
+
+    documents = []
+    for document in ProductDocument.objects.only('data').iterator(chunk_size=1000):
+        available = document.data.get('stock_quantity')
+        document.data['available_quantity'] = available
+        if available is not None:
+            document.data['stock_quantity'] = available + held.get(document.product_id, 0)
+        documents.append(document)
+        if len(documents) == 1000:
+            ProductDocument.objects.bulk_update(documents, ['data'])
+            documents = []
+    ProductDocument.objects.bulk_update(documents, ['data'])
+
+
+def move_reserved_quantity_to_holds(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    products = list(Product.objects.filter(reserved_quantity__gt=0).only('stock_quantity', 'reserved_quantity'))
+    for product in products:
+        product.stock_quantity -= product.reserved_quantity
+    Product.objects.bulk_update(products, ['stock_quantity'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0003_stock_reservation'),
+        ('products', '0008_product_reserved_quantity'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_holds_to_reserved_quantity, move_reserved_quantity_to_holds),
+    ]
@@ -1,29 +1,55 @@
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
 from django.db import models
+from django.db.models import F, Sum, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver
 from products.models import Product
 
 class Cart(models.Model):
     """
-    Represents a user's shopping cart. Every authenticated user gets one cart.
+    Represents a user's shopping cart. A user has at most one, created by their first cart
+    write (or by merging their anonymous cart at sign-in, see cart/session.py).
     """
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='cart')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Denormalized counters, refreshed by one UPDATE after every CartItem write
+    # (see refresh_totals). Repair drift with `manage.py repair_cart_totals`.
+    total_items = models.PositiveIntegerField(default=0, help_text="Total quantity of all items in the cart.")
+    total_price = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'), help_text="Sum of all item subtotals.")
+
     def __str__(self):
         return f"Cart of {self.user.username}"
-    
-    @property
-    def total_items(self):
-        """Calculates the total number of items (quantity) in the cart."""
-        return sum(item.quantity for item in self.items.all())
 
-    @property
-    def total_price(self):
-        """Calculates the total price of all items in the cart."""
-        return sum(item.subtotal for item in self.items.all())
+    @staticmethod
+    def totals_expressions():
+        """
+        Returns correlated subqueries computing (total_items, total_price) for the
+        cart referenced by OuterRef('pk'), with one aggregate over its items each.
+        """
+        items = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+        total_items = items.annotate(total=Sum('quantity')).values('total')
+        total_price = items.annotate(
+            total=Sum(F('price_at_addition') * F('quantity'), output_field=models.DecimalField(max_digits=12, decimal_places=2))
+        ).values('total')
+        return (
+            Coalesce(Subquery(total_items), Value(0)),
+            Coalesce(Subquery(total_price), Value(Decimal('0.00')), output_field=models.DecimalField(max_digits=12, decimal_places=2)),
+        )
+
+    @classmethod
+    def refresh_totals(cls, cart_id):
+        """
+        Recomputes the denormalized totals of one cart in a single UPDATE ... SET = (SELECT SUM ...),
+        so the counters are always consistent with the items at the time of the write.
+        """
+        total_items, total_price = cls.totals_expressions()
+        cls.objects.filter(pk=cart_id).update(total_items=total_items, total_price=total_price)
 
 class CartItem(models.Model):
     """
@@ -49,14 +75,64 @@ class CartItem(models.Model):
         """Calculates the subtotal for this item (price * quantity)."""
         return self.price_at_addition * self.quantity
 
-# --- Signals to automatically create a Cart for a new User ---
-@receiver(post_save, sender=User)
-def create_user_cart(sender, instance, created, **kwargs):
+class StockReservation(models.Model):
+    """
+    Stock held for a cart line. Holding stock increments Product.reserved_quantity atomically
+    (see cart/reservations.py); expired holds are returned in bulk by
+    `manage.py release_expired_reservations`.
+    """
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # A cart holds one reservation per product, sized to its cart line
+        unique_together = ('cart', 'product')
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} held for cart {self.cart_id} until {self.expires_at}"
+
+# --- Signals to keep the denormalized cart totals in sync with its items ---
+_totals_refresh = threading.local()
+
+@contextmanager
+def deferred_totals_refresh(cart_id):
+    """
+    Suspends the per-item totals refresh while a bulk cart write runs in this thread,
+    then refreshes the cart's totals once at the end.
+    """
+    _totals_refresh.suspended = True
+    try:
+        yield
+    finally:
+        _totals_refresh.suspended = False
+    Cart.refresh_totals(cart_id)
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def refresh_cart_totals(sender, instance, **kwargs):
+    """
+    Signal receiver to refresh the cart counters whenever a CartItem is added, changed or removed.
+    Bulk operations bypass signals and must run inside deferred_totals_refresh() (or call
+    Cart.refresh_totals() themselves).
+    """
+    if getattr(_totals_refresh, 'suspended', False):
+        return
+    origin = kwargs.get('origin')
+    if isinstance(origin, Cart) or getattr(origin, 'model', None) is Cart:
+        # The whole cart is being deleted
+        return
+    Cart.refresh_totals(instance.cart_id)
+
+@receiver(pre_delete, sender=Cart)
+def release_cart_reservations(sender, instance, **kwargs):
     """
-    Signal receiver to automatically create a Cart instance when a new User is created.
+    Signal receiver to return the stock held by a cart before it is deleted
+    (its reservations would otherwise disappear with the cascade).
     """
-    if created:
-        # Only create a cart if the user object was just created
-        Cart.objects.create(user=instance)
+    from .reservations import set_reserved_quantities
 
-# Ensure the signal is connected when the app is ready (handled by Django)
+    held = instance.reservations.values_list('product_id', flat=True)
+    set_reserved_quantities(instance, {product_id: 0 for product_id in held})
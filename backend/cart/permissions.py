@@ -7,8 +7,9 @@ class IsCartOwner(permissions.BasePermission):
     """
     def has_object_permission(self, request, view, obj):
         # The object (obj) here is the Cart instance
+        # Compare ids so the check never loads the related User row
         if isinstance(obj, Cart):
-            return obj.user == request.user
+            return obj.user_id == request.user.id
         
         # The object (obj) here is the CartItem instance
         if isinstance(obj, CartItem):
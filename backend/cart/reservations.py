@@ -0,0 +1,186 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, When, Value, F, IntegerField, Sum
+from django.utils import timezone
+
+from products.cache import invalidate_product_details
+from products.read_model import refresh_documents
+from products.models import Product
+
+
+class InsufficientStock(Exception):
+    """Raised when a reservation cannot be satisfied. `shortages` maps product id -> units still available."""
+
+    def __init__(self, shortages):
+        self.shortages = shortages
+        super().__init__(f"Insufficient stock for products {sorted(shortages)}")
+
+
+def reservation_ttl():
+    return getattr(settings, 'CART_RESERVATION_TTL', timedelta(minutes=15))
+
+
+def _delta_case(deltas):
+    """CASE expression mapping each product id to its stock delta."""
+    return Case(*[When(pk=product_id, then=Value(delta)) for product_id, delta in deltas.items()], output_field=IntegerField())
+
+
+def set_reserved_quantities(cart, quantities):
+    """
+    Makes the stock held by `cart` match `quantities` ({product_id: units}, 0 releases the hold).
+
+    Only the difference to what the cart already holds moves. Holds are counted in
+    Product.reserved_quantity, so stock_quantity stays the on-hand stock staff and imports set.
+    All increases are taken with one conditional UPDATE ... SET reserved_quantity =
+    reserved_quantity + n WHERE stock_quantity - reserved_quantity >= n; if any product cannot
+    cover its increase nothing is taken and InsufficientStock is raised. Decreases are returned
+    with one UPDATE. Holds are (re)armed to expire after the TTL.
+    """
+    from .models import StockReservation
+
+    if not quantities:
+        return
+
+    expires_at = timezone.now() + reservation_ttl()
+    with transaction.atomic():
+        # Lock this cart's holds on the touched products so concurrent writes to the same cart serialize
+        held = {
+            reservation.product_id: reservation
+            for reservation in StockReservation.objects.select_for_update().filter(cart=cart, product_id__in=quantities)
+        }
+
+        increases, decreases = {}, {}
+        for product_id, quantity in quantities.items():
+            delta = quantity - (held[product_id].quantity if product_id in held else 0)
+            if delta > 0:
+                increases[product_id] = delta
+            elif delta < 0:
+                decreases[product_id] = -delta
+
+        if increases:
+            _take_stock(increases)
+        if decreases:
+            delta = _delta_case(decreases)
+            Product.objects.filter(pk__in=decreases).update(reserved_quantity=F('reserved_quantity') - delta, updated_at=timezone.now())
+        if increases or decreases:
+            _stock_changed([*increases, *decreases])
+
+        to_create, to_update, to_delete = [], [], []
+        for product_id, quantity in quantities.items():
+            reservation = held.get(product_id)
+            if quantity == 0:
+                if reservation is not None:
+                    to_delete.append(reservation.pk)
+            elif reservation is None:
+                to_create.append(StockReservation(cart=cart, product_id=product_id, quantity=quantity, expires_at=expires_at))
+            else:
+                reservation.quantity = quantity
+                reservation.expires_at = expires_at
+                to_update.append(reservation)
+
+        if to_delete:
+            StockReservation.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            StockReservation.objects.bulk_update(to_update, ['quantity', 'expires_at'])
+        if to_create:
+            StockReservation.objects.bulk_create(to_create)
+
+
+def _take_stock(increases):
+    """Reserves available stock for every product in one conditional UPDATE, all or nothing."""
+    delta = _delta_case(increases)
+    with transaction.atomic():
+        taken = Product.objects.filter(pk__in=increases, stock_quantity__gte=F('reserved_quantity') + delta).update(
+            reserved_quantity=F('reserved_quantity') + delta, updated_at=timezone.now()
+        )
+        if taken == len(increases):
+            return
+        # Undo the products that did have enough stock (savepoint rollback) and report the others
+        transaction.set_rollback(True)
+
+    available = dict(
+        Product.objects.filter(pk__in=increases)
+        .annotate(available=F('stock_quantity') - F('reserved_quantity')).values_list('pk', 'available')
+    )
+    shortages = {
+        product_id: max(available.get(product_id, 0), 0)
+        for product_id, delta in increases.items()
+        if available.get(product_id, 0) < delta
+    }
+    raise InsufficientStock(shortages)
+
+
+def _stock_changed(product_ids):
+    """
+    Stock moves bypass the product signals; re-render the product documents and drop the
+    cached details that show the old available quantity. (The UPDATEs set updated_at themselves, so the
+    `updated_since` export feed carries stock moves.)
+    """
+    refresh_documents(product_ids)
+    slugs = list(Product.objects.filter(pk__in=product_ids).values_list('slug', flat=True))
+    invalidate_product_details(slugs)
+    transaction.on_commit(lambda: invalidate_product_details(slugs))
+
+
+def reserve(cart, product_id, quantity):
+    """Holds `quantity` units of one product for `cart` (see set_reserved_quantities)."""
+    set_reserved_quantities(cart, {product_id: quantity})
+
+
+def release(cart, product_id):
+    """Returns whatever `cart` holds of one product to the available stock."""
+    set_reserved_quantities(cart, {product_id: 0})
+
+
+def release_expired_reservations(batch_size=1000, now=None):
+    """
+    Returns the stock of expired holds in bounded batches: per batch one locking SELECT,
+    one UPDATE over all affected products and one DELETE. Returns the number of released holds.
+    """
+    from .models import StockReservation
+
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            expired = StockReservation.objects.filter(expires_at__lte=now).order_by('expires_at')
+            if connection.features.has_select_for_update_skip_locked:
+                # Holds being renewed by a cart right now are skipped, not waited on
+                expired = expired.select_for_update(skip_locked=True)
+            batch = list(expired.values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                break
+
+            _return_stock(StockReservation.objects.filter(pk__in=batch))
+        released += len(batch)
+        if len(batch) < batch_size:
+            break
+    return released
+
+
+def release_cart_holds(carts):
+    """
+    Returns the stock held by every cart of the `carts` queryset and deletes their holds, with
+    one UPDATE over all affected products and one DELETE. For bulk cart deletes, which skip the
+    per-cart pre_delete release.
+    """
+    from .models import StockReservation
+
+    with transaction.atomic():
+        _return_stock(StockReservation.objects.filter(cart__in=carts))
+
+
+def _return_stock(reservations):
+    """Gives the units held by the `reservations` queryset back to their products and deletes the holds."""
+    per_product = dict(
+        reservations.values('product_id').annotate(total=Sum('quantity')).order_by().values_list('product_id', 'total')
+    )
+    if not per_product:
+        return
+    Product.objects.filter(pk__in=per_product).update(
+        reserved_quantity=F('reserved_quantity') - _delta_case(per_product), updated_at=timezone.now()
+    )
+    _stock_changed(per_product)
+    reservations.delete()
@@ -1,14 +1,26 @@
 from rest_framework import serializers
-from .models import Cart, CartItem
-from products.serializers import ProductSerializer 
+from backend.metrics import TimedSerializerMixin
+from django.db import transaction
+from .models import Cart, CartItem, deferred_totals_refresh
+from .reservations import set_reserved_quantities, reserve, InsufficientStock
+from .session import MAX_LINES
+from products.serializers import ProductSerializer, ProductSummarySerializer
 
-class CartItemReadSerializer(serializers.ModelSerializer):
+def lock_cart(cart):
+    """
+    Locks the row of `cart` until the end of the transaction, so writes to its lines
+    (which read the existing lines first) serialize instead of racing on the
+    one-line-per-product constraint.
+    """
+    list(Cart.objects.select_for_update().filter(pk=cart.pk).values_list('pk', flat=True))
+
+class CartItemReadSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Serializer for viewing CartItem details (READ-ONLY).
-    Includes nested product details and calculates the subtotal.
+    Includes a compact product summary and calculates the subtotal.
     """
-    # Use the existing ProductSerializer to include full product details
-    product = ProductSerializer(read_only=True)
+    # Only the product fields a cart line needs (name, slug, main image, final price)
+    product = ProductSummarySerializer(read_only=True)
     
     # Calculate subtotal using the model property
     subtotal = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
@@ -19,6 +31,13 @@ class CartItemReadSerializer(serializers.ModelSerializer):
             'id', 'product', 'quantity', 'price_at_addition', 'subtotal'
         ]
 
+class CartItemDetailReadSerializer(CartItemReadSerializer):
+    """
+    CartItemReadSerializer variant with the full nested product (opt-in via ?expand=product).
+    """
+    # Use the existing ProductSerializer to include full product details
+    product = ProductSerializer(read_only=True)
+
 class CartItemWriteSerializer(serializers.ModelSerializer):
     """
     Serializer for creating and updating CartItems (WRITE-ONLY).
@@ -26,6 +45,8 @@ class CartItemWriteSerializer(serializers.ModelSerializer):
     """
     # Requires only the product's primary key (ID) for input
     product_id = serializers.IntegerField(write_only=True)
+    # Required and positive: a line always holds at least one unit (remove the line instead)
+    quantity = serializers.IntegerField(min_value=1)
 
     class Meta:
         model = CartItem
@@ -34,37 +55,61 @@ class CartItemWriteSerializer(serializers.ModelSerializer):
         
     def validate(self, data):
         """
-        Validates product ID exists and checks stock level.
+        Validates product ID exists. Stock is checked atomically when it is reserved on save.
         """
         from products.models import Product # Import locally to avoid circular dependency
         
+        # On updates the product comes from the existing cart line
+        product_id = data.get('product_id', self.instance.product_id if self.instance else None)
+
         # Check if the product exists
         try:
-            product = Product.objects.get(id=data['product_id'])
+            product = Product.objects.get(id=product_id)
         except Product.DoesNotExist:
             raise serializers.ValidationError({"product_id": "Product with this ID does not exist."})
-
-        # Check if the product is in stock
-        if product.in_stock_quantity < data['quantity']:
-            raise serializers.ValidationError({
-                "quantity": f"Only {product.in_stock_quantity} units of this product are in stock."
-            })
             
         data['product'] = product # Pass the product object to the create/update methods
         return data
+
+    def reserve_stock(self, cart, product, quantity):
+        """Holds `quantity` units for the cart line, turning a shortage into a validation error."""
+        try:
+            reserve(cart, product.pk, quantity)
+        except InsufficientStock as e:
+            raise serializers.ValidationError({
+                "quantity": f"Only {e.shortages[product.pk]} more units of this product are in stock."
+            })
         
+    def save_session_line(self, cart):
+        """
+        Sets the line in an anonymous (cached) cart instead: no stock is held until the cart is
+        merged at sign-in, but the quantity must be in stock now. Returns the unsaved CartItem.
+        """
+        product = self.validated_data['product']
+        quantity = self.validated_data.get('quantity', cart.lines.get(product.pk))
+        if quantity > product.available_quantity:
+            raise serializers.ValidationError({"quantity": f"Only {product.available_quantity} more units of this product are in stock."})
+        if product.pk not in cart.lines and len(cart.lines) >= MAX_LINES:
+            raise serializers.ValidationError({"product_id": f"A cart holds at most {MAX_LINES} products before signing in."})
+        cart.lines[product.pk] = quantity
+        cart.save()
+        return CartItem(id=product.pk, product=product, quantity=quantity, price_at_addition=product.get_discounted_price())
+
+    @transaction.atomic
     def create(self, validated_data):
         """
         Custom create method handles updating the cart item if it already exists, 
-        or creating a new one otherwise.
+        or creating a new one otherwise. The quantity is reserved from stock first.
         """
         # Get the Cart instance from the context set in the ViewSet
         cart = self.context.get('cart')
         product = validated_data['product']
         quantity = validated_data['quantity']
+        lock_cart(cart)
+        self.reserve_stock(cart, product, quantity)
         
         # Store the current price for order integrity
-        price_at_addition = product.current_price 
+        price_at_addition = product.get_discounted_price()
 
         # Check if the item already exists in the cart
         cart_item, created = CartItem.objects.get_or_create(
@@ -84,16 +129,170 @@ class CartItemWriteSerializer(serializers.ModelSerializer):
             
         return cart_item
 
-class CartSerializer(serializers.ModelSerializer):
+class CartBatchOperationSerializer(serializers.Serializer):
+    """
+    One operation of a batch cart mutation:
+    - add:    set the quantity of a product, creating the line if needed
+    - update: set the quantity of a line that exists (or is added earlier in the batch)
+    - remove: delete the line of a product, if present
+    """
+    op = serializers.ChoiceField(choices=['add', 'update', 'remove'])
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, required=False)
+
+    def validate(self, data):
+        if data['op'] != 'remove' and 'quantity' not in data:
+            raise serializers.ValidationError({"quantity": "This field is required for add and update operations."})
+        return data
+
+class CartBatchSerializer(serializers.Serializer):
+    """
+    Validates and applies a list of add/update/remove operations to one cart in a single
+    transaction. Products and the cart's existing lines are loaded with one query each, stock
+    for every touched product is reserved with one conditional UPDATE, and the changes are
+    written with one bulk insert, one bulk update and one delete.
+    Operations apply in order, so later operations on the same product win. The cart row is
+    locked while writing and its lines re-read under the lock, so a concurrent batch adding
+    the same product is applied after this one instead of failing on the unique line.
+    """
+    MAX_OPERATIONS = 500
+
+    operations = CartBatchOperationSerializer(many=True, allow_empty=False, max_length=MAX_OPERATIONS)
+
+    def validate(self, data):
+        from products.models import Product # Import locally to avoid circular dependency
+
+        cart = self.context['cart']
+        operations = data['operations']
+        product_ids = {operation['product_id'] for operation in operations}
+
+        # One query for every referenced product, one for the existing lines
+        products = Product.objects.only('id', 'price', 'discount_percent', 'stock_quantity', 'reserved_quantity').in_bulk(product_ids)
+        existing = self.existing_items(cart, product_ids)
+
+        # Replay the operations in memory to get the final quantity of every touched product
+        final_quantities = {product_id: item.quantity for product_id, item in existing.items()}
+        errors = {}
+        for index, operation in enumerate(operations):
+            product_id = operation['product_id']
+            if product_id not in products:
+                errors[index] = {"product_id": "Product with this ID does not exist."}
+            elif operation['op'] == 'remove':
+                final_quantities[product_id] = None
+            elif operation['op'] == 'update' and final_quantities.get(product_id) is None:
+                errors[index] = {"product_id": "This product is not in the cart."}
+            else:
+                final_quantities[product_id] = operation['quantity']
+
+        if errors:
+            raise serializers.ValidationError({"operations": errors})
+
+        data['products'] = products
+        data['final_quantities'] = final_quantities
+        return data
+
+    def existing_items(self, cart, product_ids):
+        """The cart's lines for `product_ids`, as {product_id: CartItem}."""
+        return {item.product_id: item for item in CartItem.objects.filter(cart=cart, product_id__in=product_ids)}
+
+    def last_operations(self):
+        """Index of the last operation touching each product (where its errors are reported)."""
+        return {operation['product_id']: index for index, operation in enumerate(self.validated_data['operations'])}
+
+    def save(self):
+        cart = self.context['cart']
+        products = self.validated_data['products']
+        final_quantities = self.validated_data['final_quantities']
+
+        with transaction.atomic(), deferred_totals_refresh(cart.pk):
+            # Another request may have written the lines since validation: read them again under the lock
+            lock_cart(cart)
+            existing = self.existing_items(cart, final_quantities)
+
+            to_create, to_update, to_delete = [], [], []
+            for product_id, quantity in final_quantities.items():
+                item = existing.get(product_id)
+                if quantity is None:
+                    if item is not None:
+                        to_delete.append(item.pk)
+                    continue
+
+                # Store the current price for order integrity
+                price_at_addition = products[product_id].get_discounted_price()
+                if item is None:
+                    to_create.append(CartItem(cart=cart, product_id=product_id, quantity=quantity, price_at_addition=price_at_addition))
+                elif item.quantity != quantity or item.price_at_addition != price_at_addition:
+                    item.quantity = quantity
+                    item.price_at_addition = price_at_addition
+                    to_update.append(item)
+
+            try:
+                set_reserved_quantities(cart, {
+                    product_id: quantity or 0 for product_id, quantity in final_quantities.items()
+                })
+            except InsufficientStock as e:
+                # Report the shortage on the last operation touching each product
+                last_operation = self.last_operations()
+                raise serializers.ValidationError({"operations": {
+                    last_operation[product_id]: {"quantity": f"Only {available} more units of this product are in stock."}
+                    for product_id, available in e.shortages.items()
+                }})
+            if to_delete:
+                CartItem.objects.filter(pk__in=to_delete).delete()
+            if to_update:
+                CartItem.objects.bulk_update(to_update, ['quantity', 'price_at_addition'])
+            if to_create:
+                CartItem.objects.bulk_create(to_create)
+        return cart
+
+class SessionCartBatchSerializer(CartBatchSerializer):
+    """
+    CartBatchSerializer for an anonymous cart (a SessionCart in the 'cart' context): the
+    operations are applied to its cached lines. No stock is held, but the final quantities
+    must be in stock.
+    """
+
+    def existing_items(self, cart, product_ids):
+        return {
+            product_id: CartItem(product_id=product_id, quantity=quantity)
+            for product_id, quantity in cart.lines.items() if product_id in product_ids
+        }
+
+    def save(self):
+        cart = self.context['cart']
+        products = self.validated_data['products']
+        last_operation = self.last_operations()
+
+        lines = dict(cart.lines)
+        errors = {}
+        for product_id, quantity in self.validated_data['final_quantities'].items():
+            if quantity is None:
+                lines.pop(product_id, None)
+            elif quantity > products[product_id].available_quantity:
+                errors[last_operation[product_id]] = {
+                    "quantity": f"Only {products[product_id].available_quantity} more units of this product are in stock."
+                }
+            else:
+                lines[product_id] = quantity
+        if errors:
+            raise serializers.ValidationError({"operations": errors})
+        if len(lines) > MAX_LINES:
+            raise serializers.ValidationError({"operations": f"A cart holds at most {MAX_LINES} products before signing in."})
+
+        cart.lines = lines
+        cart.save()
+        return cart
+
+class CartSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Main serializer for the entire Cart object.
     """
     # Nested serializer to show all items in the cart (Read-Only)
     items = CartItemReadSerializer(many=True, read_only=True) 
     
-    # Expose calculated properties from the Cart model
+    # Expose the denormalized totals from the Cart model
     total_items = serializers.IntegerField(read_only=True)
-    total_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    total_price = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
 
     class Meta:
         model = Cart
@@ -102,4 +301,28 @@ class CartSerializer(serializers.ModelSerializer):
             'total_items', 'total_price'
         ]
         read_only_fields = ['user']
-    
\ No newline at end of file
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.context.get('expand_product'):
+            # Opt-in: render the full product (description, all images and features) per line
+            fields['items'] = CartItemDetailReadSerializer(many=True, read_only=True)
+        return fields
+    
+
+class SessionCartSerializer(CartSerializer):
+    """
+    Renders a SessionCart (an anonymous cart, or the empty cart of a user who has none yet) in
+    the shape of CartSerializer, plus `cart_token`: the X-Cart-Token of an anonymous cart.
+    """
+    cart_token = serializers.CharField(source='token', read_only=True)
+
+    class Meta(CartSerializer.Meta):
+        fields = CartSerializer.Meta.fields + ['cart_token']
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # A SessionCart has no row behind these
+        for name in ('id', 'user', 'created_at', 'updated_at'):
+            fields[name] = serializers.ReadOnlyField()
+        return fields
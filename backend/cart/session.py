@@ -0,0 +1,132 @@
+import re
+import secrets
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+
+# Lines ({product_id: quantity}) of an anonymous cart, in the default cache
+ANONYMOUS_CART_KEY = 'cart:anonymous:{token}'
+
+# Clients send the token of their anonymous cart in this header; responses return it
+CART_TOKEN_HEADER = 'X-Cart-Token'
+CART_TOKEN_RE = re.compile(r'[A-Za-z0-9_-]{32}')
+
+# Bounds the cached value: an anonymous cart holds at most this many products
+MAX_LINES = 100
+
+
+def anonymous_cart_timeout():
+    """Seconds an anonymous cart lives after its last write (ANONYMOUS_CART_TIMEOUT)."""
+    timeout = getattr(settings, 'ANONYMOUS_CART_TIMEOUT', timedelta(days=7))
+    return int(timeout.total_seconds())
+
+
+def request_cart_token(request):
+    """The well-formed cart token sent with `request`, or None."""
+    token = request.headers.get(CART_TOKEN_HEADER, '')
+    return token if CART_TOKEN_RE.fullmatch(token) else None
+
+
+class SessionCart:
+    """
+    A cart that has no row: the anonymous cart behind a cart token (kept in the cache, so
+    browsing-stage cart churn never reaches the database), or the still empty cart of a user
+    whose Cart is created by their first write. Rendered by SessionCartSerializer in the
+    shape of a Cart; lines are priced at the current price and their id is the product id.
+    """
+    id = None
+    created_at = updated_at = None
+
+    def __init__(self, token=None, lines=None, user=None):
+        self.token = token
+        self.lines = lines or {}
+        self.user = user
+        self.items = []
+
+    @classmethod
+    def load(cls, token):
+        """The anonymous cart of `token`; an empty one if it has expired or there is no token."""
+        lines = cache.get(ANONYMOUS_CART_KEY.format(token=token)) if token else None
+        return cls(token=token, lines=lines)
+
+    def save(self):
+        if self.token is None:
+            # Issued by the first write; 24 random bytes make 32 url-safe characters
+            self.token = secrets.token_urlsafe(24)
+        cache.set(ANONYMOUS_CART_KEY.format(token=self.token), self.lines, anonymous_cart_timeout())
+
+    def delete(self):
+        cache.delete(ANONYMOUS_CART_KEY.format(token=self.token))
+
+    def load_items(self, products):
+        """
+        Builds the (unsaved) CartItems of the lines from `products`, a Product queryset that
+        decides the loaded columns and prefetches. One query (plus its prefetches).
+        """
+        from .models import CartItem
+
+        by_id = products.in_bulk(self.lines)
+        self.items = [
+            CartItem(id=product_id, product=by_id[product_id], quantity=quantity, price_at_addition=by_id[product_id].get_discounted_price())
+            for product_id, quantity in self.lines.items() if product_id in by_id
+        ]
+        return self.items
+
+    @property
+    def total_items(self):
+        return sum(item.quantity for item in self.items)
+
+    @property
+    def total_price(self):
+        return sum((item.subtotal for item in self.items), Decimal('0.00'))
+
+
+def merge_anonymous_cart(token, user):
+    """
+    Folds the anonymous cart of `token` into the user's cart (created if needed) at sign-in,
+    with one batch write: one stock reservation UPDATE, one bulk insert and one bulk update.
+    For products in both carts the anonymous quantity wins, so merging again is harmless.
+    Products that are gone or short of stock are left out (the anonymous cart never held
+    stock). The anonymous cart is deleted once the merge commits.
+
+    Returns (merged, skipped) product ids; both empty when there was nothing to merge.
+    """
+    from .models import Cart
+    from .serializers import CartBatchSerializer
+
+    anonymous = SessionCart.load(token)
+    if not anonymous.lines:
+        return [], []
+
+    operations = [{'op': 'add', 'product_id': product_id, 'quantity': quantity} for product_id, quantity in anonymous.lines.items()]
+    skipped = []
+    with transaction.atomic():
+        cart, _ = Cart.objects.get_or_create(user=user)
+        while operations:
+            serializer = CartBatchSerializer(data={'operations': operations}, context={'cart': cart})
+            try:
+                serializer.is_valid(raise_exception=True)
+                serializer.save()
+                break
+            except ValidationError as e:
+                failed = _failed_operations(e.detail)
+                if not failed:
+                    raise
+            # Leave out the products that are gone or short of stock, and retry with the others
+            skipped.extend(operations[index]['product_id'] for index in failed)
+            operations = [operation for index, operation in enumerate(operations) if index not in failed]
+        transaction.on_commit(anonymous.delete)
+    return [operation['product_id'] for operation in operations], skipped
+
+
+def _failed_operations(detail):
+    """Indexes of the failed operations in CartBatchSerializer errors (keyed by index, or a list of per-operation errors)."""
+    errors = detail.get('operations', {}) if isinstance(detail, dict) else {}
+    if isinstance(errors, list):
+        return sorted(index for index, error in enumerate(errors) if error)
+    return sorted(int(index) for index in errors)
@@ -1,3 +1,513 @@
-from django.test import TestCase
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connection, connections
+from django.test import TestCase, TransactionTestCase
+from rest_framework.test import APIClient
+
+from products.models import Product, ProductImage, ProductFeature
+from django.utils import timezone
+
+from .models import Cart, CartItem, StockReservation
+from .reservations import InsufficientStock, reserve, release_expired_reservations, set_reserved_quantities
+from .serializers import CartBatchSerializer
+
+
+class CartTotalsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='shopper', password='pass12345')
+        cls.products = [
+            Product.objects.create(
+                name=f"Block Set {i}", slug=f"block-set-{i}", short_description="s", long_description="l",
+                price=Decimal('10.00') * (i + 1), stock_quantity=100,
+            )
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        self.cart = Cart.objects.get_or_create(user=self.user)[0]
+
+    def add(self, product, quantity):
+        return CartItem.objects.create(cart=self.cart, product=product, quantity=quantity, price_at_addition=product.price)
+
+    def test_totals_follow_item_writes(self):
+        first = self.add(self.products[0], 2)
+        self.add(self.products[1], 1)
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.total_items, self.cart.total_price), (3, Decimal('40.00')))
+
+        first.quantity = 5
+        first.save()
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.total_items, self.cart.total_price), (6, Decimal('70.00')))
+
+        first.delete()
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.total_items, self.cart.total_price), (1, Decimal('20.00')))
+
+    def test_reading_totals_does_not_load_items(self):
+        self.add(self.products[2], 4)
+        with self.assertNumQueries(1):
+            cart = Cart.objects.get(pk=self.cart.pk)
+            self.assertEqual((cart.total_items, cart.total_price), (4, Decimal('120.00')))
+
+    def test_repair_command_fixes_drifted_counters(self):
+        self.add(self.products[0], 2)
+        Cart.objects.filter(pk=self.cart.pk).update(total_items=99, total_price=Decimal('1.00'))
+
+        out = StringIO()
+        call_command('repair_cart_totals', stdout=out)
+        self.assertIn("Repaired 1", out.getvalue())
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.total_items, self.cart.total_price), (2, Decimal('20.00')))
+
+
+class CartReadTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='reader', password='pass12345')
+        cart = Cart.objects.create(user=cls.user)
+        for i in range(25):
+            product = Product.objects.create(
+                name=f"Puzzle {i}", slug=f"puzzle-{i}", short_description="s", long_description="long " * 100,
+                price=Decimal('20.00'), discount_percent=Decimal('25.00'), stock_quantity=10,
+            )
+            ProductImage.objects.create(product=product, image=f"product_images/puzzle-{i}-a.jpg", order=0)
+            ProductImage.objects.create(product=product, image=f"product_images/puzzle-{i}-b.jpg", order=1, is_main=True)
+            ProductFeature.objects.create(product=product, feature_name="Pieces", feature_value="100")
+            CartItem.objects.create(cart=cart, product=product, quantity=1, price_at_addition=product.price)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_compact_cart_lines_in_constant_queries(self):
+        # cart + items joined with products + images
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/v1/cart/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['items']), 25)
+
+        product = response.data['items'][0]['product']
+        self.assertEqual(set(product), {'id', 'name', 'slug', 'main_image', 'final_price'})
+        self.assertEqual(product['final_price'], '15.00')
+        self.assertTrue(product['main_image']['image'].endswith('puzzle-0-b.jpg'))
+
+    def test_full_product_is_opt_in(self):
+        # cart + items joined with products + images + features
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/v1/cart/', {'expand': 'product'})
+        product = response.data['items'][0]['product']
+        self.assertIn('long_description', product)
+        self.assertEqual(len(product['features']), 1)
+
+
+class CartBatchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='bulkbuyer', password='pass12345')
+        cls.products = [
+            Product.objects.create(
+                name=f"Crate {i}", slug=f"crate-{i}", short_description="s", long_description="l",
+                price=Decimal('10.00'), stock_quantity=20,
+            )
+            for i in range(60)
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.cart = Cart.objects.get_or_create(user=self.user)[0]
+
+    def batch(self, operations):
+        return self.client.post('/api/v1/cart/items/batch/', {'operations': operations}, format='json')
+
+    def test_many_operations_in_constant_queries(self):
+        CartItem.objects.create(cart=self.cart, product=self.products[0], quantity=1, price_at_addition=Decimal('10.00'))
+        CartItem.objects.create(cart=self.cart, product=self.products[1], quantity=1, price_at_addition=Decimal('10.00'))
+        operations = [{'op': 'add', 'product_id': p.id, 'quantity': 2} for p in self.products[2:]]
+        operations += [
+            {'op': 'update', 'product_id': self.products[0].id, 'quantity': 3},
+            {'op': 'remove', 'product_id': self.products[1].id},
+        ]
+
+        # The query count must not grow with the number of operations
+        with self.assertNumQueries(27):
+            response = self.batch(operations)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['items']), 59)
+        self.assertEqual(response.data['total_items'], 3 + 58 * 2)
+        self.assertEqual(response.data['total_price'], '1190.00')
+
+    def test_operations_apply_in_order(self):
+        product = self.products[0]
+        response = self.batch([
+            {'op': 'add', 'product_id': product.id, 'quantity': 1},
+            {'op': 'update', 'product_id': product.id, 'quantity': 4},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(CartItem.objects.get(cart=self.cart, product=product).quantity, 4)
+
+    def test_invalid_batch_writes_nothing(self):
+        response = self.batch([
+            {'op': 'add', 'product_id': self.products[0].id, 'quantity': 1},
+            {'op': 'update', 'product_id': self.products[2].id, 'quantity': 1},
+            {'op': 'add', 'product_id': 999999, 'quantity': 1},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data['operations']), {1, 2})
+        self.assertFalse(CartItem.objects.filter(cart=self.cart).exists())
+
+    def test_stock_shortage_writes_nothing(self):
+        response = self.batch([
+            {'op': 'add', 'product_id': self.products[0].id, 'quantity': 1},
+            {'op': 'add', 'product_id': self.products[1].id, 'quantity': 5},
+            {'op': 'update', 'product_id': self.products[1].id, 'quantity': 21},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data['operations']), {2})
+        self.assertFalse(CartItem.objects.filter(cart=self.cart).exists())
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).available_quantity, 20)
+
+    def test_line_added_after_validation_is_updated_not_inserted_again(self):
+        product = self.products[0]
+        serializer = CartBatchSerializer(
+            data={'operations': [{'op': 'add', 'product_id': product.id, 'quantity': 3}]}, context={'cart': self.cart},
+        )
+        self.assertTrue(serializer.is_valid())
+        # A concurrent batch adds the same product between validation and save
+        self.batch([{'op': 'add', 'product_id': product.id, 'quantity': 1}])
+
+        serializer.save()
+        self.assertEqual(CartItem.objects.get(cart=self.cart, product=product).quantity, 3)
+        self.assertEqual(StockReservation.objects.get(cart=self.cart, product=product).quantity, 3)
+
+
+class StockReservationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='reserver', password='pass12345')
+        cls.product = Product.objects.create(
+            name="Rocking Horse", slug="rocking-horse", short_description="s", long_description="l",
+            price=Decimal('80.00'), stock_quantity=5,
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.cart = Cart.objects.get_or_create(user=self.user)[0]
+
+    def stock(self):
+        return Product.objects.get(pk=self.product.pk).available_quantity
+
+    def test_cart_writes_move_stock(self):
+        response = self.client.post('/api/v1/cart/items/add/', {'product_id': self.product.id, 'quantity': 3}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.stock(), 2)
+
+        # Re-adding sets the quantity, so only the difference is taken
+        self.client.post('/api/v1/cart/items/add/', {'product_id': self.product.id, 'quantity': 4}, format='json')
+        self.assertEqual(self.stock(), 1)
+
+        response = self.client.post('/api/v1/cart/items/add/', {'product_id': self.product.id, 'quantity': 6}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.stock(), 1)
+
+        item = CartItem.objects.get(cart=self.cart, product=self.product)
+        self.client.delete(f'/api/v1/cart/items/{item.pk}/')
+        self.assertEqual(self.stock(), 5)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_add_requires_a_positive_quantity(self):
+        for body in ({'product_id': self.product.id}, {'product_id': self.product.id, 'quantity': 0}):
+            response = self.client.post('/api/v1/cart/items/add/', body, format='json')
+            self.assertEqual(response.status_code, 400, body)
+            self.assertIn('quantity', response.data)
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(self.stock(), 5)
+
+    def test_update_item_resizes_the_hold(self):
+        self.client.post('/api/v1/cart/items/add/', {'product_id': self.product.id, 'quantity': 1}, format='json')
+        item = CartItem.objects.get(cart=self.cart, product=self.product)
+        # Shares its URL with the DELETE route
+        response = self.client.put(f'/api/v1/cart/items/{item.pk}/', {'product_id': self.product.id, 'quantity': 4}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stock(), 1)
+        response = self.client.patch(f'/api/v1/cart/items/{item.pk}/', {'quantity': 2}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stock(), 3)
+
+    def test_reservations_refresh_cached_product_detail(self):
+        cache.clear()
+        url = f'/api/v1/products/{self.product.slug}/'
+        self.assertEqual(self.client.get(url).data['available_quantity'], 5)
+        reserve(self.cart, self.product.pk, 2)
+        self.assertEqual(self.client.get(url).data['available_quantity'], 3)
+
+    def test_shortage_takes_nothing(self):
+        other = Product.objects.create(
+            name="Toy Chest", slug="toy-chest", short_description="s", long_description="l",
+            price=Decimal('60.00'), stock_quantity=1,
+        )
+        with self.assertRaises(InsufficientStock) as raised:
+            set_reserved_quantities(self.cart, {self.product.pk: 2, other.pk: 3})
+        self.assertEqual(raised.exception.shortages, {other.pk: 1})
+        self.assertEqual(self.stock(), 5)
+
+    def test_expired_reservations_are_released(self):
+        reserve(self.cart, self.product.pk, 4)
+        self.assertEqual(release_expired_reservations(), 0)
+
+        later = timezone.now() + timedelta(hours=1)
+        self.assertEqual(release_expired_reservations(batch_size=1, now=later), 1)
+        self.assertEqual(self.stock(), 5)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_stock_edits_keep_the_held_units_apart(self):
+        reserve(self.cart, self.product.pk, 3)
+        self.client.force_authenticate(User.objects.create_user(username='stockkeeper', password='pw', is_staff=True))
+        # Staff (and imports) write the on-hand stock, from an instance loaded before the holds moved
+        product = Product.objects.get(pk=self.product.pk)
+        reserve(self.cart, self.product.pk, 4)
+        product.name = "Rocking Horse XL"
+        product.save()
+        response = self.client.patch(f'/api/v1/products/{self.product.slug}/', {'stock_quantity': 10}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stock(), 6)
+
+        # Released holds go back to the available stock, not on top of the new on-hand value
+        release_expired_reservations(now=timezone.now() + timedelta(hours=1))
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual((product.stock_quantity, product.reserved_quantity, product.available_quantity), (10, 0, 10))
+
+    def test_deleting_cart_returns_stock(self):
+        reserve(self.cart, self.product.pk, 5)
+        self.assertEqual(self.stock(), 0)
+        self.cart.delete()
+        self.assertEqual(self.stock(), 5)
+
+
+class SessionCartTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='browser', password='pass12345')
+        cls.products = [
+            Product.objects.create(
+                name=f"Marble Run {i}", slug=f"marble-run-{i}", short_description="s", long_description="l",
+                price=Decimal('20.00'), stock_quantity=5,
+            )
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def add(self, product, quantity, token=None):
+        headers = {'HTTP_X_CART_TOKEN': token} if token else {}
+        return self.client.post('/api/v1/cart/items/add/', {'product_id': product.pk, 'quantity': quantity}, format='json', **headers)
+
+    def test_carts_are_created_by_the_first_write(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/api/v1/cart/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['items'], response.data['total_items'], response.data['user']), ([], 0, self.user.pk))
+        self.assertFalse(Cart.objects.exists())
+        self.assertEqual(self.client.delete('/api/v1/cart/items/1/').status_code, 404)
+        self.assertFalse(Cart.objects.exists())
+
+        self.assertEqual(self.add(self.products[0], 2).status_code, 201)
+        self.assertEqual(Cart.objects.get(user=self.user).total_items, 2)
+
+    def test_anonymous_add_requires_a_quantity(self):
+        response = self.client.post('/api/v1/cart/items/add/', {'product_id': self.products[0].pk}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('quantity', response.data)
+
+    def test_anonymous_cart_stays_off_the_database(self):
+        response = self.add(self.products[0], 2)
+        self.assertEqual(response.status_code, 201)
+        token = response['X-Cart-Token']
+        self.assertEqual(self.add(self.products[1], 1, token)['X-Cart-Token'], token)
+        self.assertEqual(self.add(self.products[2], 6, token).status_code, 400)
+
+        with self.assertNumQueries(2):
+            # Products and their images
+            response = self.client.get('/api/v1/cart/', HTTP_X_CART_TOKEN=token)
+        self.assertEqual(response.data['cart_token'], token)
+        self.assertEqual([item['id'] for item in response.data['items']], [self.products[0].pk, self.products[1].pk])
+        self.assertEqual((response.data['total_items'], response.data['total_price']), (3, '60.00'))
+
+        # Item ids of an anonymous cart are product ids
+        response = self.client.patch(f'/api/v1/cart/items/{self.products[1].pk}/', {'quantity': 4}, format='json', HTTP_X_CART_TOKEN=token)
+        self.assertEqual((response.status_code, response.data['quantity']), (200, 4))
+        response = self.client.delete(f'/api/v1/cart/items/{self.products[0].pk}/', HTTP_X_CART_TOKEN=token)
+        self.assertEqual(response.data['total_items'], 4)
+        response = self.client.post('/api/v1/cart/items/batch/', {'operations': [
+            {'op': 'add', 'product_id': self.products[2].pk, 'quantity': 1},
+            {'op': 'remove', 'product_id': self.products[1].pk},
+        ]}, format='json', HTTP_X_CART_TOKEN=token)
+        self.assertEqual([item['id'] for item in response.data['items']], [self.products[2].pk])
+
+        self.assertFalse(Cart.objects.exists())
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.products[2].pk).available_quantity, 5)
+        # Another visitor (or an expired token) starts from an empty cart; tokens come with the first write
+        response = self.client.get('/api/v1/cart/')
+        self.assertEqual((response.data['items'], response.data['cart_token']), ([], None))
+        self.assertNotIn('X-Cart-Token', response)
+
+    def test_sign_in_merges_the_anonymous_cart(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.products[0], quantity=1, price_at_addition=Decimal('20.00'))
+        token = self.add(self.products[0], 3)['X-Cart-Token']
+        self.add(self.products[1], 2, token)
+        self.add(self.products[2], 4, token)
+        # Sold out while the visitor was browsing
+        Product.objects.filter(pk=self.products[2].pk).update(stock_quantity=1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/token/', {'username': 'browser', 'password': 'pass12345'}, format='json', HTTP_X_CART_TOKEN=token)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.data)
+        self.assertEqual(response.data['cart_merge'], {'merged': [self.products[0].pk, self.products[1].pk], 'skipped': [self.products[2].pk]})
+        self.assertEqual(
+            dict(CartItem.objects.filter(cart=cart).values_list('product_id', 'quantity')),
+            {self.products[0].pk: 3, self.products[1].pk: 2},
+        )
+        cart.refresh_from_db()
+        self.assertEqual(cart.total_items, 5)
+        self.assertEqual(dict(StockReservation.objects.values_list('product_id', 'quantity')), {self.products[0].pk: 3, self.products[1].pk: 2})
+
+        # The anonymous cart is gone, so signing in again merges nothing
+        response = self.client.post('/api/v1/token/', {'username': 'browser', 'password': 'pass12345'}, format='json', HTTP_X_CART_TOKEN=token)
+        self.assertEqual(response.data['cart_merge'], {'merged': [], 'skipped': []})
+
+
+class StockReservationConcurrencyTests(TransactionTestCase):
+    """Many shoppers racing for the last units of one SKU must never oversell it."""
+
+    STOCK = 10
+    SHOPPERS = 25
+    MAX_ATTEMPTS = 500
+
+    @contextmanager
+    def shoppers_database(self):
+        """
+        Points the connections the shoppers' threads open at a file copy of an in-memory SQLite
+        test database: shared-cache memory databases livelock concurrent writers, while a file
+        makes them wait for the write lock. Other databases are used as they are.
+        """
+        if not (connection.vendor == 'sqlite' and connection.is_in_memory_db()):
+            yield
+            return
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'shoppers.sqlite3')
+        connection.ensure_connection()
+        with sqlite3.connect(path) as copy:
+            connection.connection.backup(copy)
+        settings_dict = connections.settings[DEFAULT_DB_ALIAS]
+        # Writers take the lock when their transaction begins, and wait up to `timeout` seconds for it
+        options = {**settings_dict.get('OPTIONS', {}), 'timeout': 20, 'transaction_mode': 'IMMEDIATE'}
+        try:
+            with mock.patch.dict(settings_dict, {'NAME': path, 'OPTIONS': options}):
+                yield
+        finally:
+            shutil.rmtree(directory)
+
+    def in_thread(self, function):
+        """Runs `function` in a thread of its own (so on the shoppers' database) and returns its result."""
+        result = []
+
+        def run():
+            try:
+                result.append(function())
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        return result[0]
+
+    def test_hot_sku_is_never_oversold(self):
+        product = Product.objects.create(
+            name="Limited Dollhouse", slug="limited-dollhouse", short_description="s", long_description="l",
+            price=Decimal('150.00'), stock_quantity=self.STOCK,
+        )
+        carts = [
+            Cart.objects.create(user=User.objects.create_user(username=f'racer{i}', password='pass12345'))
+            for i in range(self.SHOPPERS)
+        ]
+
+        outcomes = []
+        start = threading.Barrier(self.SHOPPERS)
+        # Reservations started and not yet finished, and the most seen at once
+        in_flight = {'now': 0, 'peak': 0}
+        in_flight_lock = threading.Lock()
+
+        def attempt(cart):
+            with in_flight_lock:
+                in_flight['now'] += 1
+                in_flight['peak'] = max(in_flight['peak'], in_flight['now'])
+            try:
+                reserve(cart, product.pk, 1)
+            finally:
+                with in_flight_lock:
+                    in_flight['now'] -= 1
+
+        def shop(cart):
+            start.wait()
+            try:
+                for _ in range(self.MAX_ATTEMPTS):
+                    try:
+                        attempt(cart)
+                        outcomes.append(True)
+                        return
+                    except InsufficientStock:
+                        outcomes.append(False)
+                        return
+                    except OperationalError:
+                        # SQLite allows one writer at a time; drop the (possibly half rolled back)
+                        # connection, back off and retry when the database is locked
+                        connection.close()
+                        time.sleep(random.uniform(0, 0.01))
+            finally:
+                connection.close()
+
+        with self.shoppers_database():
+            threads = [threading.Thread(target=shop, args=(cart,)) for cart in carts]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            stock, held = self.in_thread(
+                lambda: (Product.objects.get(pk=product.pk).available_quantity, StockReservation.objects.count())
+            )
+
+        # The shoppers did race: reservations overlapped
+        self.assertGreater(in_flight['peak'], 1)
+        self.assertEqual(len(outcomes), self.SHOPPERS)
+        self.assertEqual(outcomes.count(True), self.STOCK)
+        self.assertEqual((stock, held), (0, self.STOCK))
 
-# Create your tests here.
@@ -1,10 +1,20 @@
-from rest_framework import viewsets, permissions, status
+from rest_framework import viewsets, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from django.db import router, transaction
+from django.db.models import Prefetch
 from django.shortcuts import get_object_or_404
+from django.http import Http404
+from products.models import Product, ProductImage
+from products.serializers import ProductSummarySerializer, ProductImageSerializer
 from .models import Cart, CartItem
-from .serializers import CartSerializer, CartItemReadSerializer, CartItemWriteSerializer
+from .serializers import (
+    CartSerializer, CartItemReadSerializer, CartItemWriteSerializer, CartBatchSerializer,
+    SessionCartBatchSerializer, SessionCartSerializer,
+)
 from .permissions import IsCartOwner
+from .reservations import release
+from .session import CART_TOKEN_HEADER, SessionCart, request_cart_token
 
 class CartViewSet(viewsets.GenericViewSet):
     """
@@ -13,19 +23,88 @@ class CartViewSet(viewsets.GenericViewSet):
     
     Primary Route: /api/v1/cart/ (retrieves the user's current cart)
     Item Management: /api/v1/cart/items/ (for adding, updating, removing items)
+
+    Cart lines carry a compact product summary; add ?expand=product for the full product.
+
+    A user's Cart row is created by their first write. Anonymous visitors get a cart kept in
+    the cache (see cart/session.py): its token comes back in the X-Cart-Token header (and as
+    `cart_token`) and is sent with their later requests; their item ids are product ids. The
+    anonymous cart is merged into the user's cart when they obtain a token (sign in).
     """
     # The initial queryset is for the Cart model
     queryset = Cart.objects.all()
     
-    # Require authentication for all actions
-    permission_classes = [permissions.IsAuthenticated, IsCartOwner]
+    # Anonymous visitors use a cached cart; users only ever reach their own
+    permission_classes = [IsCartOwner]
+
+    # Reads only need the user's id, which the token carries (see AUTH_TRUST_TOKEN_CLAIMS)
+    token_claims_suffice = True
+
+    def expand_product(self):
+        """True when the client asked for the full nested product on every cart line."""
+        return 'product' in self.request.query_params.get('expand', '').split(',')
 
-    def get_object(self):
+    def get_object(self, create=True):
         """
         Custom method to ensure the user only interacts with their own cart.
+        The cart is created by the first write (`create`); otherwise a missing cart is a 404.
+        """
+        cart_id = getattr(self.request.user, 'cached_cart_id', None)
+        if cart_id is not None:
+            # Resolved with the user at authentication. The writes only use the cart's key, so
+            # the other columns stay deferred (and load on first access)
+            return Cart.from_db(router.db_for_read(Cart), ['id', 'user_id'], [cart_id, self.request.user.id])
+        if not create:
+            return get_object_or_404(Cart, user_id=self.request.user.id)
+        cart, _ = Cart.objects.get_or_create(user_id=self.request.user.id)
+        return cart
+
+    def get_session_cart(self):
+        """The anonymous visitor's cached cart (a new one without a valid X-Cart-Token)."""
+        return SessionCart.load(request_cart_token(self.request))
+
+    def session_cart_response(self, cart):
+        """Renders a SessionCart like a Cart, with the same product columns and prefetches."""
+        if self.expand_product():
+            products = Product.objects.prefetch_related('images', 'features')
+        else:
+            products = Product.objects.only(*ProductSummarySerializer.COLUMNS).prefetch_related(
+                Prefetch('images', queryset=ProductImage.objects.only(*ProductImageSerializer.COLUMNS))
+            )
+        cart.load_items(products)
+        serializer = SessionCartSerializer(cart, context={**self.get_serializer_context(), 'expand_product': self.expand_product()})
+        return self.with_cart_token(Response(serializer.data), cart)
+
+    def with_cart_token(self, response, cart):
+        if cart.token:
+            response[CART_TOKEN_HEADER] = cart.token
+        return response
+
+    def get_cart_with_items(self):
         """
-        # The cart model signal ensures every authenticated user has a cart
-        return get_object_or_404(Cart, user=self.request.user)
+        Loads the user's cart for rendering: its items, their products and the product images
+        come in a fixed number of queries (cart, items joined with products, images)
+        whatever the cart size.
+        """
+        if self.expand_product():
+            items = CartItem.objects.select_related('product').prefetch_related('product__images', 'product__features')
+        else:
+            product_columns = [f'product__{column}' for column in ProductSummarySerializer.COLUMNS]
+            items = (
+                CartItem.objects.select_related('product')
+                .only('id', 'cart_id', 'product_id', 'quantity', 'price_at_addition', *product_columns)
+                .prefetch_related(Prefetch('product__images', queryset=ProductImage.objects.only(
+                    *ProductImageSerializer.COLUMNS
+                )))
+            )
+        queryset = Cart.objects.prefetch_related(Prefetch('items', queryset=items.order_by('id')))
+        # By id: with trusted token claims the user is a TokenUser, not a model instance.
+        # None for a user whose cart has not been created yet
+        return queryset.filter(user_id=self.request.user.id).first()
+
+    def get_cart_serializer(self, instance):
+        """Serializes the whole cart, honouring ?expand=product."""
+        return CartSerializer(instance, context={**self.get_serializer_context(), 'expand_product': self.expand_product()})
 
     def get_serializer_class(self):
         """
@@ -45,10 +124,14 @@ class CartViewSet(viewsets.GenericViewSet):
         specific cart IDs, which is not typically needed in this design.
         We'll use list() for the main 'my cart' view.
         """
-        instance = self.get_object()
+        if not request.user.is_authenticated:
+            return self.session_cart_response(self.get_session_cart())
+        instance = self.get_cart_with_items()
+        if instance is None:
+            return self.session_cart_response(SessionCart(user=request.user.id))
         # Perform object-level permission check
         self.check_object_permissions(request, instance)
-        serializer = CartSerializer(instance)
+        serializer = self.get_cart_serializer(instance)
         return Response(serializer.data)
 
     def list(self, request):
@@ -56,14 +139,29 @@ class CartViewSet(viewsets.GenericViewSet):
         Retrieve the currently logged-in user's cart (GET /api/v1/cart/)
         We override list to return only the user's cart instance.
         """
+        if not request.user.is_authenticated:
+            return self.session_cart_response(self.get_session_cart())
         # This will fetch the unique cart associated with the logged-in user
-        instance = self.get_object() 
+        instance = self.get_cart_with_items()
+        if instance is None:
+            # No write yet, so no cart row: an empty cart
+            return self.session_cart_response(SessionCart(user=request.user.id))
         # No need for check_object_permissions here as get_object already limits the query
-        serializer = CartSerializer(instance)
+        serializer = self.get_cart_serializer(instance)
         return Response(serializer.data)
         
     # --- Custom Actions for Item Management ---
 
+    def session_line_id(self, cart, item_pk):
+        """The product id of an anonymous cart line (its item id); 404 if the cart has no such line."""
+        try:
+            product_id = int(item_pk)
+        except ValueError:
+            raise Http404
+        if product_id not in cart.lines:
+            raise Http404
+        return product_id
+
     @action(detail=False, methods=['post'], url_path='items/add')
     def add_item(self, request):
         """
@@ -71,6 +169,13 @@ class CartViewSet(viewsets.GenericViewSet):
         POST /api/v1/cart/items/add/
         Body: {"product_id": 1, "quantity": 2}
         """
+        if not request.user.is_authenticated:
+            cart = self.get_session_cart()
+            serializer = self.get_serializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            item = serializer.save_session_line(cart)
+            return self.with_cart_token(Response(CartItemReadSerializer(item).data, status=status.HTTP_201_CREATED), cart)
+
         cart = self.get_object()
         serializer = self.get_serializer(data=request.data, context={'cart': cart})
         serializer.is_valid(raise_exception=True)
@@ -85,35 +190,85 @@ class CartViewSet(viewsets.GenericViewSet):
             status=status.HTTP_201_CREATED
         )
 
+    @action(detail=False, methods=['post'], url_path='items/batch')
+    def batch_items(self, request):
+        """
+        Apply many add/update/remove operations to the cart in one request and one transaction.
+        POST /api/v1/cart/items/batch/
+        Body: {"operations": [{"op": "add", "product_id": 1, "quantity": 2},
+                              {"op": "update", "product_id": 2, "quantity": 5},
+                              {"op": "remove", "product_id": 3}]}
+        Returns the final cart. Nothing is written if any operation is invalid; errors are keyed
+        by the operation's index.
+        """
+        if not request.user.is_authenticated:
+            cart = self.get_session_cart()
+            serializer = SessionCartBatchSerializer(data=request.data, context={'cart': cart})
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+            return self.session_cart_response(cart)
+
+        cart = self.get_object()
+        serializer = CartBatchSerializer(data=request.data, context={'cart': cart})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        return Response(
+            self.get_cart_serializer(self.get_cart_with_items()).data,
+            status=status.HTTP_200_OK
+        )
+
     @action(detail=False, methods=['delete'], url_path=r'items/(?P<item_pk>[^/.]+)')
     def remove_item(self, request, item_pk=None):
         """
         Remove a specific CartItem from the cart.
         DELETE /api/v1/cart/items/{item_pk}/
         """
-        cart = self.get_object()
+        if not request.user.is_authenticated:
+            cart = self.get_session_cart()
+            del cart.lines[self.session_line_id(cart, item_pk)]
+            cart.save()
+            return self.session_cart_response(cart)
+
+        cart = self.get_object(create=False)
         
         # Find the cart item within the user's cart
         cart_item = get_object_or_404(CartItem, pk=item_pk, cart=cart)
         
-        # Perform the deletion
-        cart_item.delete()
+        # Return the held stock and perform the deletion together
+        with transaction.atomic():
+            release(cart, cart_item.product_id)
+            cart_item.delete()
         
         # Return the updated cart summary
-        updated_cart = self.get_object()
+        updated_cart = self.get_cart_with_items()
         return Response(
-            CartSerializer(updated_cart).data, 
+            self.get_cart_serializer(updated_cart).data, 
             status=status.HTTP_200_OK
         )
 
-    @action(detail=False, methods=['put', 'patch'], url_path=r'items/(?P<item_pk>[^/.]+)')
+    # Same URL as remove_item: a second @action would register a duplicate route that is never reached
+    @remove_item.mapping.put
+    @remove_item.mapping.patch
     def update_item(self, request, item_pk=None):
         """
         Update the quantity of a specific CartItem.
         PUT/PATCH /api/v1/cart/items/{item_pk}/
         Body: {"quantity": 5}
         """
-        cart = self.get_object()
+        if not request.user.is_authenticated:
+            cart = self.get_session_cart()
+            product_id = self.session_line_id(cart, item_pk)
+            serializer = self.get_serializer(
+                CartItem(product_id=product_id, quantity=cart.lines[product_id]),
+                data=request.data,
+                partial=request.method == 'PATCH',
+            )
+            serializer.is_valid(raise_exception=True)
+            item = serializer.save_session_line(cart)
+            return self.with_cart_token(Response(CartItemReadSerializer(item).data, status=status.HTTP_200_OK), cart)
+
+        cart = self.get_object(create=False)
         cart_item = get_object_or_404(CartItem, pk=item_pk, cart=cart)
         
         # We use the WriteSerializer here to validate stock and product constraints
@@ -125,11 +280,13 @@ class CartViewSet(viewsets.GenericViewSet):
         )
         serializer.is_valid(raise_exception=True)
         
-        # Update only the quantity field directly
+        # Update only the quantity field directly, resizing the stock hold in the same transaction
         new_quantity = serializer.validated_data.get('quantity')
         if new_quantity is not None:
-            cart_item.quantity = new_quantity
-            cart_item.save()
+            with transaction.atomic():
+                serializer.reserve_stock(cart, cart_item.product, new_quantity)
+                cart_item.quantity = new_quantity
+                cart_item.save()
 
         # Return the updated cart item details
         return Response(
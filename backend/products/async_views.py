@@ -0,0 +1,203 @@
+"""
+Async (ASGI-native) twins of the catalog read endpoints, mounted under /api/v1/async/products/.
+
+Under an ASGI server (e.g. `uvicorn backend.asgi:application`) these views wait on the
+database and the cache with the async ORM and async cache API instead of holding a worker
+thread per request, so one worker can keep many more bursty, I/O-bound catalog reads in
+flight than the sync ProductViewSet. They accept the same parameters, return the same JSON
+and share the same cache entries (counts, product details, ETags) as their sync versions.
+Only reads live here; writes stay on ProductViewSet. With PRODUCT_READ_MODEL enabled, list and
+detail read the pre-rendered ProductDocument rows like the sync endpoints do.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse, HttpResponseNotModified
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.encoders import JSONEncoder
+
+from .cache import (
+    aget_cached_count, aget_product_version, detail_variant, detail_cache_key, make_etag, etag_matches, estimate_table_count,
+)
+from .facets import get_facet_counts
+from .filters import parse_product_filters, apply_product_filters
+from .models import Product, ProductDocument
+from .pagination import KeysetPaginator, InvalidCursor
+from .read_model import read_model_enabled, present_document
+from .search import search_products
+from .serializers import ProductSerializer
+from .views import requested_fieldset, load_for_fieldset
+
+
+def json_response(data, status=200, **kwargs):
+    # DRF's encoder, so decimals, dates and lazy strings render exactly like the sync API
+    return JsonResponse(data, status=status, encoder=JSONEncoder, safe=False, **kwargs)
+
+
+def page_params(params, max_size=None):
+    """Returns (page, size) from the query string or raises ValidationError (defaults 1 and 10)."""
+    try:
+        page_number = int(params.get('page', 1))
+        page_size = int(params.get('size', 10))
+    except (ValueError, TypeError):
+        raise ValidationError({"detail": "Both 'page' and 'size' must be valid integers."})
+    if page_number < 1 or page_size < 1:
+        raise ValidationError({"detail": "Both 'page' and 'size' must be integers greater than or equal to 1."})
+    if max_size and page_size > max_size:
+        raise ValidationError({"detail": f"'size' must be at most {max_size}."})
+    return page_number, page_size
+
+
+def render_page(objects, fields, request):
+    """Renders a listing page of products, or of product documents when the read model is enabled."""
+    if read_model_enabled():
+        return [present_document(document.data, fields, request) for document in objects]
+    return render(objects, fields, request)
+
+
+def render(products, fields, request, many=True):
+    # Everything the serializer touches was loaded up front, so rendering does no I/O
+    return ProductSerializer(products, many=many, fields=fields, context={'request': request}).data
+
+
+@require_GET
+async def product_list(request):
+    """
+    GET /api/v1/async/products/ - async list_products: page/size, sort, storefront filters,
+    ?fields=/?expand=, cursor mode (?cursor= or ?pagination=cursor), count=approximate and facets.
+    """
+    params = request.GET
+    try:
+        fields = requested_fieldset(params)
+        filters = parse_product_filters(params)
+        page_number, page_size = page_params(params)
+    except ValidationError as e:
+        return json_response(e.detail, status=400)
+
+    sort = params.get('sort') or KeysetPaginator.DEFAULT_SORT
+    if sort.lstrip('-') not in KeysetPaginator.SORT_KEYS:
+        return json_response({
+            "detail": f"'sort' must be one of: {', '.join(KeysetPaginator.SORT_KEYS)} (prefix with '-' for descending)."
+        }, status=400)
+
+    if read_model_enabled():
+        queryset = apply_product_filters(ProductDocument.objects.all(), filters)
+    else:
+        queryset = load_for_fieldset(
+            apply_product_filters(Product.objects.all(), filters), fields, KeysetPaginator.SORT_KEYS.values()
+        )
+
+    if 'cursor' in params or params.get('pagination') == 'cursor':
+        paginator = KeysetPaginator(queryset, sort=sort, page_size=page_size)
+        try:
+            products, next_cursor, previous_cursor = await paginator.aget_page(params.get('cursor'))
+        except InvalidCursor as e:
+            return json_response({"detail": str(e)}, status=400)
+        return json_response(await with_facets({
+            "next": next_cursor,
+            "previous": previous_cursor,
+            "page_size": page_size,
+            "sort": paginator.sort,
+            "results": render_page(products, fields, request),
+        }, params, filters))
+
+    queryset = queryset.order_by(*KeysetPaginator.ordering(sort))
+    start = (page_number - 1) * page_size
+    total_count, count_exact = await aget_total_count(queryset, params.get('count') == 'approximate')
+    products = [product async for product in queryset[start:start + page_size]]
+    return json_response(await with_facets({
+        "count": total_count,
+        "count_exact": count_exact,
+        "current_page": page_number,
+        "page_size": page_size,
+        "results": render_page(products, fields, request),
+    }, params, filters))
+
+
+async def aget_total_count(queryset, approximate=False):
+    """Async ProductViewSet.get_total_count: (count, is_exact), estimated only for unfiltered listings."""
+    if approximate and not queryset.query.where:
+        # Table statistics are read with a raw cursor, which has no async API
+        estimate = await sync_to_async(estimate_table_count)(queryset.model)
+        if estimate is not None:
+            return estimate, False
+    return await aget_cached_count(queryset), True
+
+
+async def with_facets(data, params, filters):
+    """Adds the facet counts section to a listing page when 'facets' was requested (see ProductViewSet._with_facets)."""
+    if params.get('facets', '').lower() in ('1', 'true'):
+        data['facets'] = await sync_to_async(get_facet_counts)(filters)
+    return data
+
+
+@require_GET
+async def product_detail(request, slug):
+    """
+    GET /api/v1/async/products/<slug>/ - product detail with the same cache, ETag and
+    If-None-Match (304) handling as ProductViewSet.retrieve.
+    """
+    try:
+        fields = requested_fieldset(request.GET)
+    except ValidationError as e:
+        return json_response(e.detail, status=400)
+
+    # Version first, then the database (see ProductViewSet.retrieve)
+    key = detail_cache_key(slug, await aget_product_version(slug), detail_variant(request, fields))
+    cached = await cache.aget(key)
+    if cached is None:
+        if read_model_enabled():
+            document = await ProductDocument.objects.filter(slug=slug).values_list('data', flat=True).afirst()
+            data = None if document is None else present_document(document, fields, request)
+        else:
+            product = await load_for_fieldset(Product.objects.filter(slug=slug), fields).afirst()
+            data = None if product is None else render(product, fields, request, many=False)
+        if data is None:
+            return json_response({"detail": "No Product matches the given query."}, status=404)
+        cached = {'etag': make_etag(data), 'data': data}
+        await cache.aset(key, cached, getattr(settings, 'PRODUCT_DETAIL_CACHE_TIMEOUT', 3600))
+
+    if etag_matches(request.headers.get('If-None-Match'), cached['etag']):
+        response = HttpResponseNotModified()
+    else:
+        response = json_response(cached['data'])
+    response['ETag'] = cached['etag']
+    return response
+
+
+@require_GET
+async def product_search(request):
+    """GET /api/v1/async/products/search/?q= - async twin of ProductViewSet.search."""
+    params = request.GET
+    query = params.get('q', '').strip()
+    if not query:
+        return json_response({"detail": "The 'q' parameter is required."}, status=400)
+    try:
+        fields = requested_fieldset(params)
+        page_number, page_size = page_params(params, max_size=100)
+    except ValidationError as e:
+        return json_response(e.detail, status=400)
+
+    # The ranking runs on MySQL FULLTEXT or the in-process index; neither has an async API
+    total_count, matches = await sync_to_async(search_products)(
+        query, limit=page_size, offset=(page_number - 1) * page_size
+    )
+    scores = dict(matches)
+    products = {
+        product.pk: product
+        async for product in load_for_fieldset(Product.objects.filter(pk__in=scores), fields)
+    }
+    ranked = [products[product_id] for product_id, _ in matches if product_id in products]
+
+    results = render(ranked, fields, request)
+    for product, result in zip(ranked, results):
+        result['relevance'] = round(scores[product.pk], 4)
+
+    return json_response({
+        "query": query,
+        "count": total_count,
+        "current_page": page_number,
+        "page_size": page_size,
+        "results": results,
+    })
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.utils.http import parse_etags
+from rest_framework.utils.encoders import JSONEncoder
+
+# Bumped on every product write; every cached count embeds it in its key, so
+# bumping the version invalidates all cached counts at once without a key scan.
+CATALOG_VERSION_KEY = 'products:catalog-version'
+
+# Per-product counterpart for the rendered product detail (see ProductViewSet.retrieve).
+# Keyed by slug because that is all a detail request carries before touching the database.
+PRODUCT_VERSION_KEY = 'products:detail-version:{slug}'
+
+
+def get_catalog_version():
+    """Returns the current catalog version, initialising it if the cache was flushed."""
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # Start from a timestamp so a flushed/evicted version never reuses old keys
+        cache.add(CATALOG_VERSION_KEY, int(time.time() * 1000), None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+async def aget_catalog_version():
+    """Async variant of get_catalog_version() for the async views."""
+    version = await cache.aget(CATALOG_VERSION_KEY)
+    if version is None:
+        await cache.aadd(CATALOG_VERSION_KEY, int(time.time() * 1000), None)
+        version = await cache.aget(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    """Invalidates every cached catalog count. Called from the Product save/delete signals."""
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        # Key missing (never set or evicted): initialise it instead
+        get_catalog_version()
+
+
+def get_product_version(slug):
+    """Returns the current detail version of one product, initialising it if missing."""
+    key = PRODUCT_VERSION_KEY.format(slug=slug)
+    version = cache.get(key)
+    if version is None:
+        # Timestamp start, so an evicted or deleted version never resurrects old entries
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+async def aget_product_version(slug):
+    """Async variant of get_product_version() for the async views."""
+    key = PRODUCT_VERSION_KEY.format(slug=slug)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, int(time.time() * 1000), None)
+        version = await cache.aget(key)
+    return version
+
+
+def bump_product_version(*slugs):
+    """
+    Invalidates the cached detail representations of the given products.
+    Called from the Product, ProductImage and ProductFeature save/delete signals.
+    """
+    for slug in {slug for slug in slugs if slug}:
+        try:
+            cache.incr(PRODUCT_VERSION_KEY.format(slug=slug))
+        except ValueError:
+            # Nothing cached under this slug yet; the next read initialises it
+            pass
+
+
+def invalidate_product_details(slugs):
+    """Bulk variant of bump_product_version for loads that bypass signals (one cache round trip)."""
+    cache.delete_many([PRODUCT_VERSION_KEY.format(slug=slug) for slug in slugs])
+
+
+def detail_variant(request, fields):
+    """
+    Identifies one rendering of a product detail: image URLs are absolute, so it depends on
+    the host the client used, and on the requested sparse fieldset (None = full).
+    """
+    return f"{request.build_absolute_uri('/')}|{','.join(sorted(fields)) if fields is not None else '*'}"
+
+
+def detail_cache_key(slug, version, variant):
+    """Cache key for one rendering (`variant`: fieldset, host, ...) of a product detail."""
+    digest = hashlib.sha1(variant.encode()).hexdigest()
+    return f'products:detail:{slug}:{version}:{digest}'
+
+
+def make_etag(data):
+    """Strong ETag for serialized data: a hash of its canonical JSON encoding."""
+    encoded = json.dumps(data, cls=JSONEncoder, sort_keys=True, separators=(',', ':'))
+    return f'"{hashlib.sha1(encoded.encode()).hexdigest()}"'
+
+
+def etag_matches(if_none_match, etag):
+    """True when an If-None-Match header value matches `etag` (or is '*')."""
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == '*' or etag in parse_etags(if_none_match)
+
+
+def count_cache_key(queryset, version=None):
+    """
+    Builds the cache key for a filtered queryset's COUNT.
+    The key is derived from the compiled WHERE clause, so it is the same for every
+    request with the same effective filters regardless of ordering, paging or fieldsets.
+    """
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    digest = hashlib.sha1(f"{sql}|{params!r}".encode()).hexdigest()
+    if version is None:
+        version = get_catalog_version()
+    return f'products:count:{version}:{digest}'
+
+
+def get_cached_count(queryset):
+    """Returns queryset.count(), served from the cache until the next product write."""
+    key = count_cache_key(queryset)
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, getattr(settings, 'PRODUCT_COUNT_CACHE_TIMEOUT', 300))
+    return count
+
+
+async def aget_cached_count(queryset):
+    """Async variant of get_cached_count() (shares its cache entries)."""
+    key = count_cache_key(queryset, await aget_catalog_version())
+    count = await cache.aget(key)
+    if count is None:
+        count = await queryset.acount()
+        await cache.aset(key, count, getattr(settings, 'PRODUCT_COUNT_CACHE_TIMEOUT', 300))
+    return count
+
+
+def estimate_table_count(model):
+    """
+    Reads the database's table statistics for an estimated row count of `model`.
+    Returns None when the backend keeps no usable statistics (e.g. SQLite).
+    """
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute(
+                "SELECT TABLE_ROWS FROM information_schema.TABLES "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+                [table],
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [table])
+        else:
+            return None
+        row = cursor.fetchone()
+
+    # PostgreSQL reports -1 for tables that were never analyzed
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
@@ -0,0 +1,91 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+
+from .models import ProductImage
+
+# Columns of an exported product, in output order
+EXPORT_FIELDS = (
+    'id', 'name', 'slug', 'brand', 'short_description', 'long_description', 'theme', 'genre',
+    'price', 'discount_percent', 'final_price', 'stock_quantity', 'is_available',
+    'created_at', 'updated_at', 'main_image', 'features',
+)
+
+CONTENT_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+# Products loaded (and held in memory) per keyset chunk
+CHUNK_SIZE = 500
+
+
+def iter_products(queryset, chunk_size=None):
+    """
+    Yields every product of `queryset` with its features and images, one keyset chunk
+    (WHERE id > last ORDER BY id LIMIT n) at a time: three queries per chunk and only one
+    chunk in memory, however large the catalog is.
+    """
+    queryset = queryset.order_by('pk').prefetch_related(
+        'features', Prefetch('images', queryset=ProductImage.objects.order_by('-is_main', 'order', 'pk'))
+    )
+    chunk_size = chunk_size or CHUNK_SIZE
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=last_id)[:chunk_size])
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1].pk
+
+
+def export_record(product, build_url):
+    """Flat dict for one exported product; `build_url` turns a media URL into an absolute one."""
+    images = product.images.all()
+    main_image = images[0] if images else None
+    return {
+        'id': product.pk,
+        'name': product.name,
+        'slug': product.slug,
+        'brand': product.brand,
+        'short_description': product.short_description,
+        'long_description': product.long_description,
+        'theme': product.theme,
+        'genre': product.genre,
+        'price': product.price,
+        'discount_percent': product.discount_percent,
+        'final_price': product.final_price,
+        'stock_quantity': product.stock_quantity,
+        'is_available': product.is_available,
+        'created_at': product.created_at,
+        'updated_at': product.updated_at,
+        'main_image': build_url(main_image.image.url) if main_image else None,
+        'features': {feature.feature_name: feature.feature_value for feature in product.features.all()},
+    }
+
+
+def stream_ndjson(products, build_url):
+    for product in products:
+        yield json.dumps(export_record(product, build_url), cls=DjangoJSONEncoder) + '\n'
+
+
+class _Echo:
+    """File-like object whose write() hands the formatted line back to the csv writer's caller."""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(products, build_url):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for product in products:
+        record = export_record(product, build_url)
+        # Features go in one JSON cell (products/importer.py reads the same layout back)
+        record['features'] = json.dumps(record['features'])
+        yield writer.writerow([
+            value.isoformat() if hasattr(value, 'isoformat') else value
+            for value in (record[field] for field in EXPORT_FIELDS)
+        ])
+
+
+STREAMERS = {'ndjson': stream_ndjson, 'csv': stream_csv}
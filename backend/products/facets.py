@@ -0,0 +1,193 @@
+import hashlib
+import json
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Value, F, Sum, Count, DecimalField, ExpressionWrapper
+from django.db.models.functions import Round
+
+from .cache import get_catalog_version
+
+# Lower bounds of the price buckets (final, discounted price). Bucket i covers
+# [PRICE_BUCKETS[i], PRICE_BUCKETS[i + 1]); the last bucket is open ended.
+PRICE_BUCKETS = (Decimal('0'), Decimal('25'), Decimal('50'), Decimal('100'), Decimal('250'), Decimal('500'))
+
+# Facet dimensions stored on ProductFacetSummary, in key order
+FACET_FIELDS = ('brand', 'theme', 'genre', 'price_bucket')
+
+
+def price_bucket_for(price):
+    """Returns the index of the bucket a final price falls into."""
+    bucket = 0
+    for index, lower_bound in enumerate(PRICE_BUCKETS):
+        if price >= lower_bound:
+            bucket = index
+    return bucket
+
+
+def price_bucket_label(bucket):
+    lower = PRICE_BUCKETS[bucket]
+    if bucket + 1 < len(PRICE_BUCKETS):
+        return f"{lower}-{PRICE_BUCKETS[bucket + 1]}"
+    return f"{lower}+"
+
+
+def discounted_price(price, discount_percent):
+    """Final price after the discount, rounded half up to cents like the database column."""
+    return (price - price * (discount_percent / 100)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def discounted_price_expression():
+    """
+    Database expression for the final price: the definition of the generated
+    Product.final_price column (mirrors discounted_price()).
+    """
+    return Round(
+        ExpressionWrapper(
+            F('price') - F('price') * F('discount_percent') / Value(Decimal('100')),
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        ),
+        2,
+    )
+
+
+def facet_key(brand, theme, genre, price, discount_percent):
+    """Builds the ProductFacetSummary lookup for a product's attributes (None is stored as '')."""
+    # Unsaved instances may still hold the field defaults as floats
+    price, discount_percent = Decimal(str(price)), Decimal(str(discount_percent))
+    return summary_key(brand, theme, genre, discounted_price(price, discount_percent))
+
+
+def summary_key(brand, theme, genre, final_price):
+    """ProductFacetSummary lookup for products with these facet values and final price."""
+    return {
+        'brand': brand or '',
+        'theme': theme or '',
+        'genre': genre or '',
+        'final_price': final_price,
+        'price_bucket': price_bucket_for(final_price),
+    }
+
+
+def product_facet_key(product):
+    return facet_key(product.brand, product.theme, product.genre, product.price, product.discount_percent)
+
+
+def adjust_facet_count(key, delta):
+    """
+    Atomically adds `delta` to the product count of one facet combination,
+    creating the summary row on first use.
+    """
+    from .models import ProductFacetSummary
+
+    summaries = ProductFacetSummary.objects.filter(**key)
+    if delta < 0:
+        # Never drive a count below zero, even if the summary has drifted
+        summaries.filter(product_count__gte=-delta).update(product_count=F('product_count') + delta)
+        return
+    if summaries.update(product_count=F('product_count') + delta):
+        return
+    try:
+        with transaction.atomic():
+            ProductFacetSummary.objects.create(product_count=delta, **key)
+    except IntegrityError:
+        # Another writer created the row first; add to it instead
+        ProductFacetSummary.objects.filter(**key).update(product_count=F('product_count') + delta)
+
+
+def apply_facet_deltas(deltas):
+    """
+    Adds many count changes to the facet summary at once, for bulk writes that bypass the
+    product signals. `deltas` maps (brand, theme, genre, final_price) to a product count change.
+    The touched rows are locked with one read, then changed with one bulk update and one bulk
+    insert (an IntegrityError there means another writer created a row first).
+    """
+    from .models import ProductFacetSummary
+
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    with transaction.atomic():
+        # A superset of the touched rows, matched to the exact keys below
+        existing = {
+            (summary.brand, summary.theme, summary.genre, summary.final_price): summary
+            for summary in ProductFacetSummary.objects.select_for_update().filter(
+                brand__in={key[0] for key in deltas}, final_price__in={key[3] for key in deltas},
+            )
+        }
+        to_update, to_create = [], []
+        for key, delta in deltas.items():
+            summary = existing.get(key)
+            if summary is not None:
+                # Never drive a count below zero, even if the summary has drifted
+                summary.product_count = max(summary.product_count + delta, 0)
+                to_update.append(summary)
+            elif delta > 0:
+                to_create.append(ProductFacetSummary(product_count=delta, **summary_key(*key)))
+        ProductFacetSummary.objects.bulk_update(to_update, ['product_count'], batch_size=1000)
+        ProductFacetSummary.objects.bulk_create(to_create, batch_size=1000)
+
+
+def rebuild_facet_summary():
+    """
+    Recomputes the whole facet summary from the product table with one GROUP BY.
+    Used after bulk loads and to repair drift. Returns the number of summary rows.
+    """
+    from .models import Product, ProductFacetSummary
+
+    rows = Product.objects.values('brand', 'theme', 'genre', 'final_price').annotate(total=Count('id')).order_by()
+
+    summaries = {}
+    for row in rows:
+        key = (row['brand'] or '', row['theme'] or '', row['genre'] or '', row['final_price'])
+        summaries[key] = summaries.get(key, 0) + row['total']
+
+    with transaction.atomic():
+        ProductFacetSummary.objects.all().delete()
+        ProductFacetSummary.objects.bulk_create(
+            [ProductFacetSummary(product_count=count, **summary_key(*key)) for key, count in summaries.items()],
+            batch_size=1000,
+        )
+    return len(summaries)
+
+
+def get_facet_counts(filters):
+    """
+    Returns the facet counts for the current filter set:
+        {"brand": [{"value": ..., "count": ...}], ..., "price": [{"bucket": 0, "label": "0-25", "count": ...}]}
+    Each dimension is counted with every other active filter applied (but not its own), so the
+    sidebar can show how many products each additional choice would match. Results are cached
+    until the next product write.
+
+    Counts come from the facet summary only: it keeps the exact final price, so every price
+    filter (buckets and any min_price/max_price) applies to it as it does to the listing.
+    """
+    from .filters import apply_product_filters
+    from .models import ProductFacetSummary
+
+    normalized = json.dumps(filters, sort_keys=True, default=str)
+    key = f'products:facets:{get_catalog_version()}:{hashlib.sha1(normalized.encode()).hexdigest()}'
+    facets = cache.get(key)
+    if facets is not None:
+        return facets
+
+    facets = {}
+    for field in FACET_FIELDS:
+        # Every filter but the dimension's own
+        own = ('price_bucket', 'min_price', 'max_price') if field == 'price_bucket' else (field,)
+        summaries = apply_product_filters(
+            ProductFacetSummary.objects.filter(product_count__gt=0),
+            {key: value for key, value in filters.items() if key not in own},
+        )
+        rows = summaries.values(field).annotate(count=Sum('product_count')).order_by(field)
+        if field == 'price_bucket':
+            facets['price'] = [
+                {"bucket": row[field], "label": price_bucket_label(row[field]), "count": row['count']} for row in rows
+            ]
+        else:
+            facets[field] = [{"value": row[field], "count": row['count']} for row in rows if row[field]]
+
+    cache.set(key, facets, getattr(settings, 'PRODUCT_COUNT_CACHE_TIMEOUT', 300))
+    return facets
@@ -0,0 +1,93 @@
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from .facets import PRICE_BUCKETS
+
+
+def parse_product_filters(source):
+    """
+    Reads the storefront filters from query params (GET) or the request body (POST):
+        brand, theme, genre  - one or more values (comma separated or a JSON list)
+        price_bucket         - one or more price bucket indexes (see products/facets.py)
+        min_price, max_price - bounds on the final (discounted) price
+    Returns a normalized dict containing only the filters that were sent.
+    """
+    def values(key):
+        value = source.get(key)
+        if value in (None, ''):
+            return None
+        if isinstance(value, str):
+            value = value.split(',')
+        elif not isinstance(value, list) or not all(isinstance(v, (str, int)) and not isinstance(v, bool) for v in value):
+            raise ValidationError({"detail": f"'{key}' must be a comma separated string or a list of values."})
+        return sorted({str(v).strip() for v in value if str(v).strip()})
+
+    filters = {}
+    for field in ('brand', 'theme', 'genre'):
+        selected = values(field)
+        if selected:
+            filters[field] = selected
+
+    buckets = values('price_bucket')
+    if buckets:
+        try:
+            filters['price_bucket'] = sorted({int(b) for b in buckets})
+        except ValueError:
+            raise ValidationError({"detail": "'price_bucket' must be a list of integers."})
+        if any(not 0 <= b < len(PRICE_BUCKETS) for b in filters['price_bucket']):
+            raise ValidationError({"detail": f"'price_bucket' values must be between 0 and {len(PRICE_BUCKETS) - 1}."})
+
+    for bound in ('min_price', 'max_price'):
+        value = source.get(bound)
+        if value in (None, ''):
+            continue
+        try:
+            if not isinstance(value, (str, int, float)) or isinstance(value, bool):
+                raise InvalidOperation
+            filters[bound] = Decimal(str(value))
+            if not filters[bound].is_finite():
+                raise InvalidOperation
+        except InvalidOperation:
+            raise ValidationError({"detail": f"'{bound}' must be a number."})
+    return filters
+
+
+def apply_product_filters(queryset, filters):
+    """
+    Applies parsed storefront filters (see parse_product_filters) to a product (or product
+    document) queryset. Price filters use the indexed final (discounted) price column, not the
+    raw retail price.
+    """
+    for field in ('brand', 'theme', 'genre'):
+        if field in filters:
+            queryset = queryset.filter(**{f'{field}__in': filters[field]})
+
+    if 'price_bucket' in filters:
+        condition = Q()
+        for bucket in filters['price_bucket']:
+            bucket_q = Q(final_price__gte=PRICE_BUCKETS[bucket])
+            if bucket + 1 < len(PRICE_BUCKETS):
+                bucket_q &= Q(final_price__lt=PRICE_BUCKETS[bucket + 1])
+            condition |= bucket_q
+        queryset = queryset.filter(condition)
+    if 'min_price' in filters:
+        queryset = queryset.filter(final_price__gte=filters['min_price'])
+    if 'max_price' in filters:
+        queryset = queryset.filter(final_price__lte=filters['max_price'])
+    return queryset
+
+
+class ProductFilterBackend(BaseFilterBackend):
+    """
+    Applies the storefront facet filters (brand/theme/genre/price) to product listings: only to
+    the view's `product_filter_actions`, so an edit whose body sets e.g. brand still finds its product.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        if getattr(view, 'action', None) not in getattr(view, 'product_filter_actions', ()):
+            return queryset
+        source = request.query_params if request.method == 'GET' else request.data
+        return apply_product_filters(queryset, parse_product_filters(source))
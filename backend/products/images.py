@@ -0,0 +1,234 @@
+import io
+import logging
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+# Widths (px) of the generated thumbnails; originals are never upscaled
+DERIVATIVE_WIDTHS = (160, 320, 640, 1280)
+
+# Encoder settings per derivative format
+DERIVATIVE_FORMATS = {
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'avif': {'format': 'AVIF', 'quality': 60},
+}
+
+DERIVATIVE_ROOT = 'product_images/derived'
+
+
+def available_formats():
+    """Derivative formats the installed Pillow can encode (AVIF needs a recent build)."""
+    return [name for name in DERIVATIVE_FORMATS if name == 'jpeg' or features.check(name)]
+
+
+def render_derivatives(data, widths=DERIVATIVE_WIDTHS, formats=None):
+    """
+    Encodes the resized variants of one image. Pure CPU work on bytes, so it can run in a
+    worker process. Returns {format: {width: encoded bytes}}.
+    """
+    formats = formats or available_formats()
+    rendered = {name: {} for name in formats}
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        # Every width below the original, or the original width if it is smaller than all of them
+        targets = [width for width in widths if width < image.width] or [image.width]
+        for width in targets:
+            height = max(1, round(image.height * width / image.width))
+            resized = image.resize((width, height), Image.Resampling.LANCZOS)
+            for name in formats:
+                variant = resized
+                if name == 'jpeg' and variant.mode not in ('RGB', 'L'):
+                    variant = variant.convert('RGB')
+                buffer = io.BytesIO()
+                variant.save(buffer, **DERIVATIVE_FORMATS[name])
+                rendered[name][width] = buffer.getvalue()
+    return rendered
+
+
+def needs_derivatives(product_image):
+    """True when the image has no derivatives for its current file."""
+    return bool(product_image.image) and (product_image.derivatives or {}).get('source') != product_image.image.name
+
+
+def store_derivatives(product_image_id, source, rendered):
+    """
+    Saves rendered variants to storage and records them on the ProductImage, unless the image
+    file was replaced in the meantime. Returns True when the derivatives were recorded.
+    """
+    from .cache import invalidate_product_details
+    from .models import ProductImage
+    from .read_model import refresh_documents
+
+    stem = os.path.splitext(os.path.basename(source))[0]
+    variants = {}
+    for name, sizes in rendered.items():
+        extension = 'jpg' if name == 'jpeg' else name
+        variants[name] = {
+            str(width): default_storage.save(
+                f"{DERIVATIVE_ROOT}/{product_image_id}/{stem}-{width}w.{extension}", ContentFile(data)
+            )
+            for width, data in sizes.items()
+        }
+
+    # A queryset update: no signals, so recording derivatives does not schedule them again
+    previous = ProductImage.objects.filter(pk=product_image_id, image=source).values_list(
+        'derivatives', 'product__slug', 'product_id'
+    ).first()
+    updated = ProductImage.objects.filter(pk=product_image_id, image=source).update(
+        derivatives={'source': source, 'variants': variants}
+    )
+    if not updated:
+        delete_variants(variants)
+        return False
+
+    old_variants = (previous[0] or {}).get('variants', {})
+    delete_variants({
+        name: {width: path for width, path in sizes.items() if path not in variants.get(name, {}).values()}
+        for name, sizes in old_variants.items()
+    })
+    # Product documents and cached details embed the srcset
+    refresh_documents([previous[2]])
+    invalidate_product_details([previous[1]])
+    return True
+
+
+def delete_variants(variants):
+    """Deletes the stored files of `variants` ({format: {width: path}})."""
+    for sizes in variants.values():
+        for path in sizes.values():
+            default_storage.delete(path)
+
+
+def _read_source(product_image):
+    with product_image.image.open('rb') as source:
+        return source.read()
+
+
+def generate_derivatives(product_images, pool, in_flight):
+    """
+    Renders and stores the derivatives of many images in `pool`, a ProcessPoolExecutor the
+    caller keeps for its whole run. At most `in_flight` originals are held in memory: the next
+    image is only read once a rendering finished.
+    Returns (generated, failed) counts; failures are logged and skipped.
+    """
+    formats = available_formats()
+    generated = failed = 0
+    product_images = iter(product_images)
+    futures = {}
+
+    def submit_next():
+        nonlocal failed
+        for product_image in product_images:
+            try:
+                data = _read_source(product_image)
+            except (OSError, ValueError):
+                logger.exception("Cannot read image %s of ProductImage %s", product_image.image.name, product_image.pk)
+                failed += 1
+                continue
+            futures[pool.submit(render_derivatives, data, DERIVATIVE_WIDTHS, formats)] = product_image
+            return
+
+    for _ in range(in_flight):
+        submit_next()
+    while futures:
+        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+        for future in done:
+            product_image = futures.pop(future)
+            try:
+                stored = store_derivatives(product_image.pk, product_image.image.name, future.result())
+            except Exception:
+                logger.exception("Cannot render derivatives of ProductImage %s", product_image.pk)
+                failed += 1
+            else:
+                generated += stored
+            submit_next()
+    return generated, failed
+
+
+def rendering_mode():
+    """
+    How saved images get their derivatives (PRODUCT_IMAGE_DERIVATIVES): 'command' (default)
+    leaves them to `manage.py generate_image_derivatives`, 'pool' renders them in a process pool
+    of the saving process, 'inline' renders them right away (development and tests).
+
+    'pool' forks worker processes from each web worker: every web worker then carries its own
+    pool (PRODUCT_IMAGE_WORKERS processes each), and forking a threaded server process copies
+    whatever locks its other threads hold. Use it only with single-threaded web workers that
+    can spare the memory; production deployments should use 'command'.
+    """
+    return getattr(settings, 'PRODUCT_IMAGE_DERIVATIVES', 'command')
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Process-wide worker pool for the 'pool' mode (created on first use, sized by PRODUCT_IMAGE_WORKERS)."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(max_workers=getattr(settings, 'PRODUCT_IMAGE_WORKERS', None))
+    return _executor
+
+
+def schedule_derivatives(product_image_id):
+    """
+    Renders the derivatives of a newly saved image as rendering_mode() says: nothing happens in
+    the 'command' mode; in the 'pool' mode the encoding runs in the worker pool and the result
+    is stored from the pool's callback thread; in the 'inline' mode everything runs right away.
+    """
+    from .models import ProductImage
+
+    mode = rendering_mode()
+    if mode not in ('inline', 'pool'):
+        # Picked up by the next `manage.py generate_image_derivatives` run
+        return
+
+    product_image = ProductImage.objects.filter(pk=product_image_id).first()
+    if product_image is None or not needs_derivatives(product_image):
+        return
+    source = product_image.image.name
+    try:
+        data = _read_source(product_image)
+    except (OSError, ValueError):
+        logger.exception("Cannot read image %s of ProductImage %s", source, product_image_id)
+        return
+
+    if mode == 'inline':
+        store_derivatives(product_image_id, source, render_derivatives(data))
+        return
+
+    def store(future):
+        try:
+            store_derivatives(product_image_id, source, future.result())
+        except Exception:
+            logger.exception("Cannot render derivatives of ProductImage %s", product_image_id)
+        finally:
+            # Callbacks run on the pool's management thread, which has its own connection
+            connection.close()
+
+    get_executor().submit(render_derivatives, data).add_done_callback(store)
+
+
+def schedule_pending(product_images):
+    """
+    Schedules the derivatives of the images in `product_images` (a ProductImage queryset) that
+    have none for their current file, e.g. images bulk-loaded without the post_save signal.
+    """
+    if rendering_mode() not in ('inline', 'pool'):
+        return
+    pending = product_images.exclude(image='').values_list('pk', 'image', 'derivatives')
+    for product_image_id, source, derivatives in pending.iterator(chunk_size=1000):
+        if (derivatives or {}).get('source') != source:
+            schedule_derivatives(product_image_id)
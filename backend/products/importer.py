@@ -0,0 +1,285 @@
+import csv
+import json
+import os
+
+from django.db import DatabaseError, connection, transaction
+from django.utils.text import slugify
+from rest_framework.exceptions import ValidationError
+
+from . import images, read_model, search
+from .cache import bump_catalog_version, invalidate_product_details
+from .facets import apply_facet_deltas
+from .models import Product, ProductImage, ProductFeature, suspended_related_signals
+from .serializers import ProductImportRowSerializer
+
+# File extensions understood by detect_format()
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+
+# Product columns a row may set (slug is resolved separately)
+PRODUCT_FIELDS = (
+    'name', 'brand', 'short_description', 'long_description', 'theme', 'genre',
+    'price', 'discount_percent', 'stock_quantity', 'is_available',
+)
+
+
+def detect_format(filename):
+    """Returns 'csv' or 'jsonl' from a file name, or None if the extension is unknown."""
+    return FORMATS.get(os.path.splitext(filename or '')[1].lower())
+
+
+def _parse_csv_cell(value, separator=';'):
+    """
+    CSV cells cannot nest, so relation columns hold either JSON or a simple list:
+    features "Material=Beech;Age=3+", images "product_images/a.jpg;product_images/b.jpg".
+    """
+    value = value.strip()
+    if value[:1] in ('[', '{'):
+        return json.loads(value)
+    return [part.strip() for part in value.split(separator) if part.strip()]
+
+
+def read_rows(stream, file_format):
+    """
+    Lazily yields (line_number, row, error) from a CSV or JSONL text stream.
+    `row` is a dict of raw values; `error` is set instead when the line cannot be parsed.
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        for raw in reader:
+            # Empty cells mean "not given", so the field defaults apply
+            row = {key: value for key, value in raw.items() if key and value not in (None, '')}
+            try:
+                if 'features' in row:
+                    features = _parse_csv_cell(row['features'])
+                    if isinstance(features, list) and all(isinstance(item, str) for item in features):
+                        features = dict(item.partition('=')[::2] for item in features)
+                    row['features'] = features
+                if 'images' in row:
+                    row['images'] = _parse_csv_cell(row['images'])
+            except ValueError as e:
+                yield reader.line_num, raw, f"Invalid JSON in relation column: {e}"
+                continue
+            yield reader.line_num, row, None
+    elif file_format == 'jsonl':
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_number, line.strip(), f"Invalid JSON: {e}"
+                continue
+            if not isinstance(row, dict):
+                yield line_number, row, "Expected a JSON object."
+                continue
+            yield line_number, row, None
+    else:
+        raise ValueError(f"Unsupported import format: {file_format!r}")
+
+
+class ProductImporter:
+    """
+    Streams product rows into the catalog in chunked bulk upserts.
+
+    - Rows are validated one by one; invalid rows go to the reject file (one JSON object per
+      line: {"line", "errors", "row"}) and never abort the run.
+    - Slugs are resolved for the whole file in memory: a row with a slug updates the product
+      with that slug, a row without one updates the product of the same name or gets a new
+      de-duplicated slug generated from its name.
+    - Each chunk is one transaction: one INSERT ... ON CONFLICT for the products, one
+      DELETE + INSERT per relation given in the rows, one search index and one read model upsert,
+      and the chunk's facet summary changes (see apply_facet_deltas()). If a chunk hits a
+      database error its rows are retried one by one so only the bad rows are rejected.
+    - Cached counts and cached details are refreshed once at the end, and the thumbnails of
+      the imported images are scheduled.
+
+    An update writes only the columns given in its row; the others keep their current values
+    (new products get the model defaults). A row whose slug names an existing product may
+    therefore leave out the otherwise required columns, e.g. a price list of slug and price.
+    """
+    CHUNK_SIZE = 1000
+    MAX_REPORTED_REJECTS = 100
+
+    def __init__(self, chunk_size=None, reject_file=None):
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
+        self.reject_file = reject_file
+        self.stats = {'rows': 0, 'created': 0, 'updated': 0, 'rejected': 0}
+        # The first rejects, for callers that report them inline (e.g. the upload endpoint)
+        self.rejects = []
+
+        # One serializer validates every row: building its fields per row would dominate the run time
+        self._validator = ProductImportRowSerializer()
+        self._partial_validator = ProductImportRowSerializer(partial=True)
+        self._slug_by_name = {}
+        self._existing_slugs = set()
+        self._file_names = set()
+        self._file_slugs = set()
+        self._imported_slugs = []
+
+    def run(self, rows):
+        """Imports (line_number, row, error) tuples as produced by read_rows(). Returns the stats."""
+        self._load_existing()
+        chunk = []
+        with suspended_related_signals():
+            for line_number, row, error in rows:
+                self.stats['rows'] += 1
+                entry = self._prepare(line_number, row, error)
+                if entry is None:
+                    continue
+                chunk.append(entry)
+                if len(chunk) >= self.chunk_size:
+                    self._flush(chunk)
+                    chunk = []
+            if chunk:
+                self._flush(chunk)
+        self._finish()
+        return self.stats
+
+    def _load_existing(self):
+        """Loads every existing (name, slug) pair once, so slugs never need a per-row query."""
+        for name, slug in Product.objects.values_list('name', 'slug').iterator(chunk_size=5000):
+            self._slug_by_name[name] = slug
+            self._existing_slugs.add(slug)
+
+    def _unique_slug(self, name):
+        base = slugify(name)[:240]
+        if not base:
+            return None
+        slug, suffix = base, 2
+        while slug in self._existing_slugs or slug in self._file_slugs:
+            slug = f"{base}-{suffix}"
+            suffix += 1
+        return slug
+
+    def _prepare(self, line_number, row, error):
+        """Validates a row and resolves its slug. Returns the entry to write, or None if rejected."""
+        if error:
+            return self._reject(line_number, row, {"non_field_errors": [error]})
+
+        # Updates addressed by slug only need the columns they change
+        slug = row.get('slug') if isinstance(row, dict) else None
+        partial = isinstance(slug, str) and slug in self._existing_slugs
+        try:
+            data = (self._partial_validator if partial else self._validator).run_validation(row)
+        except ValidationError as e:
+            return self._reject(line_number, row, e.detail)
+
+        name = data.get('name')
+        owner = self._slug_by_name.get(name)
+        slug = data.get('slug')
+        if name is not None and name in self._file_names:
+            return self._reject(line_number, row, {"name": ["Duplicate product name in this file."]})
+        if slug:
+            if slug in self._file_slugs:
+                return self._reject(line_number, row, {"slug": ["Duplicate slug in this file."]})
+            if owner is not None and owner != slug:
+                return self._reject(line_number, row, {"name": [f"Name already used by product '{owner}'."]})
+        else:
+            slug = owner or self._unique_slug(name)
+            if slug is None:
+                return self._reject(line_number, row, {"name": ["Cannot derive a slug from this name."]})
+
+        if name is not None:
+            self._file_names.add(name)
+        self._file_slugs.add(slug)
+        return {'line': line_number, 'row': row, 'slug': slug, 'data': data}
+
+    def _reject(self, line_number, row, errors):
+        self.stats['rejected'] += 1
+        record = {"line": line_number, "errors": errors, "row": row}
+        if self.reject_file is not None:
+            self.reject_file.write(json.dumps(record, default=str) + '\n')
+        if len(self.rejects) < self.MAX_REPORTED_REJECTS:
+            self.rejects.append(record)
+        return None
+
+    def _flush(self, chunk):
+        try:
+            with transaction.atomic():
+                self._write(chunk)
+        except DatabaseError:
+            # Isolate the offending rows instead of losing the whole chunk
+            for entry in chunk:
+                try:
+                    with transaction.atomic():
+                        self._write([entry])
+                except DatabaseError as e:
+                    self._reject(entry['line'], entry['row'], {"non_field_errors": [str(e)]})
+                else:
+                    self._written([entry])
+        else:
+            self._written(chunk)
+
+    def _written(self, entries):
+        for entry in entries:
+            self.stats['updated' if entry['slug'] in self._existing_slugs else 'created'] += 1
+            self._imported_slugs.append(entry['slug'])
+
+    def _facet_keys(self, slugs):
+        """{slug: (brand, theme, genre, final price)} of the stored products, as counted by the facet summary."""
+        return {
+            slug: (brand or '', theme or '', genre or '', final_price)
+            for slug, brand, theme, genre, final_price in Product.objects.filter(slug__in=slugs).values_list(
+                'slug', 'brand', 'theme', 'genre', 'final_price'
+            )
+        }
+
+    def _write(self, entries):
+        slugs = [entry['slug'] for entry in entries]
+        previous = self._facet_keys(slugs)
+
+        # One upsert per set of given columns, so an update never resets the columns its row left out
+        by_fields = {}
+        for entry in entries:
+            fields = tuple(field for field in PRODUCT_FIELDS if field in entry['data'])
+            by_fields.setdefault(fields, []).append(entry)
+        for fields, group in by_fields.items():
+            upsert = {'update_conflicts': True, 'update_fields': [*fields, 'updated_at']}
+            if connection.features.supports_update_conflicts_with_target:
+                upsert['unique_fields'] = ['slug']
+            Product.objects.bulk_create(
+                [Product(slug=entry['slug'], **{field: entry['data'][field] for field in fields}) for entry in group], **upsert
+            )
+
+        # Upserts do not return ids on every backend; one lookup covers the chunk
+        ids = dict(Product.objects.filter(slug__in=slugs).values_list('slug', 'id'))
+
+        # Move the products between facet summary rows as the product signals would
+        deltas = {}
+        for key in previous.values():
+            deltas[key] = deltas.get(key, 0) - 1
+        for key in self._facet_keys(slugs).values():
+            deltas[key] = deltas.get(key, 0) + 1
+        apply_facet_deltas(deltas)
+
+        with_features = [entry for entry in entries if 'features' in entry['data']]
+        if with_features:
+            ProductFeature.objects.filter(product_id__in=[ids[entry['slug']] for entry in with_features]).delete()
+            ProductFeature.objects.bulk_create([
+                ProductFeature(product_id=ids[entry['slug']], feature_name=name, feature_value=value)
+                for entry in with_features
+                for name, value in entry['data']['features']
+            ])
+
+        with_images = [entry for entry in entries if 'images' in entry['data']]
+        if with_images:
+            ProductImage.objects.filter(product_id__in=[ids[entry['slug']] for entry in with_images]).delete()
+            ProductImage.objects.bulk_create([
+                ProductImage(product_id=ids[entry['slug']], **image)
+                for entry in with_images
+                for image in entry['data']['images']
+            ])
+
+        search.index_products(ids.values())
+        read_model.refresh_documents(ids.values())
+
+    def _finish(self):
+        """Refreshes the derived catalog data the bulk writes bypassed (signals)."""
+        if not self._imported_slugs:
+            return
+        bump_catalog_version()
+        for start in range(0, len(self._imported_slugs), 1000):
+            slugs = self._imported_slugs[start:start + 1000]
+            invalidate_product_details(slugs)
+            # bulk_create skipped the post_save signal that schedules the thumbnails
+            images.schedule_pending(ProductImage.objects.filter(product__slug__in=slugs))
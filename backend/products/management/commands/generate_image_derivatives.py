@@ -0,0 +1,39 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from products.images import generate_derivatives, needs_derivatives
+from products.models import ProductImage
+
+
+class Command(BaseCommand):
+    help = "Renders the thumbnail/WebP/AVIF derivatives of existing product images in parallel."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: one per CPU).")
+        parser.add_argument('--batch-size', type=int, default=200, help="Images read and rendered per batch.")
+        parser.add_argument('--force', action='store_true', help="Regenerate images that already have derivatives.")
+
+    def handle(self, *args, **options):
+        generated = failed = 0
+        last_id = 0
+        workers = options['workers'] or os.cpu_count() or 1
+        # One pool for the whole run; two originals per worker keep it busy without piling up in memory
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            while True:
+                batch = list(
+                    ProductImage.objects.filter(pk__gt=last_id).order_by('pk')
+                    .only('id', 'image', 'derivatives')[:options['batch_size']]
+                )
+                if not batch:
+                    break
+                last_id = batch[-1].pk
+                pending = [image for image in batch if image.image and (options['force'] or needs_derivatives(image))]
+                if pending:
+                    batch_generated, batch_failed = generate_derivatives(pending, pool, in_flight=2 * workers)
+                    generated += batch_generated
+                    failed += batch_failed
+                    self.stdout.write(f"Processed images up to id {last_id}: {generated} generated, {failed} failed.")
+
+        self.stdout.write(self.style.SUCCESS(f"Generated derivatives for {generated} images ({failed} failed)."))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from products.importer import ProductImporter, detect_format, read_rows
+
+
+class Command(BaseCommand):
+    help = "Imports (creates or updates) products with their features and images from a CSV or JSONL file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSONL file with one product per row.")
+        parser.add_argument('--format', dest='file_format', choices=['csv', 'jsonl'], help="Defaults to the file extension.")
+        parser.add_argument('--chunk-size', type=int, default=ProductImporter.CHUNK_SIZE, help="Products written per transaction.")
+        parser.add_argument('--rejects', help="Where to write rejected rows (JSONL). Defaults to <path>.rejects.jsonl.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['file_format'] or detect_format(path)
+        if file_format is None:
+            raise CommandError("Cannot tell the file format from its extension; pass --format csv|jsonl.")
+        rejects_path = options['rejects'] or f"{path}.rejects.jsonl"
+
+        try:
+            with open(path, encoding='utf-8-sig', newline='') as stream, \
+                    open(rejects_path, 'w', encoding='utf-8') as reject_file:
+                importer = ProductImporter(chunk_size=options['chunk_size'], reject_file=reject_file)
+                stats = importer.run(read_rows(stream, file_format))
+        except OSError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Read {stats['rows']} rows: {stats['created']} products created, {stats['updated']} updated, "
+            f"{stats['rejected']} rejected."
+        ))
+        if stats['rejected']:
+            self.stdout.write(self.style.WARNING(f"Rejected rows written to {rejects_path}."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from products.cache import bump_catalog_version
+from products.facets import rebuild_facet_summary
+
+
+class Command(BaseCommand):
+    help = "Recomputes the product facet summary (run after bulk loads or to repair drifted counts)."
+
+    def handle(self, *args, **options):
+        rows = rebuild_facet_summary()
+        # Cached facet responses were computed from the old summary
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} facet summary rows."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from products.read_model import rebuild_documents
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the pre-rendered product documents (run before enabling PRODUCT_READ_MODEL and after bulk loads)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help="Products rendered per batch.")
+
+    def handle(self, *args, **options):
+        written = rebuild_documents(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rendered {written} product documents."))
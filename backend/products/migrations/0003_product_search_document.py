@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+FULLTEXT_INDEXES = {
+    'product_search_title_ft': '(title)',
+    'product_search_title_body_ft': '(title, body)',
+}
+
+
+def add_fulltext_indexes(apps, schema_editor):
+    """MySQL only: the search backend MATCHes against exactly these column lists."""
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    for name, columns in FULLTEXT_INDEXES.items():
+        schema_editor.execute(f"ALTER TABLE products_productsearchdocument ADD FULLTEXT INDEX {name} {columns}")
+
+
+def drop_fulltext_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    for name in FULLTEXT_INDEXES:
+        schema_editor.execute(f"ALTER TABLE products_productsearchdocument DROP INDEX {name}")
+
+
+def populate_documents(apps, schema_editor):
+    """Builds a search document for every existing product."""
+    Product = apps.get_model('products', 'Product')
+    ProductSearchDocument = apps.get_model('products', 'ProductSearchDocument')
+
+    documents = []
+    for product in Product.objects.prefetch_related('features').iterator(chunk_size=1000):
+        body = '\n'.join(
+            [product.short_description or '', product.long_description or '']
+            + [f"{f.feature_name} {f.feature_value}" for f in product.features.all()]
+        )
+        documents.append(ProductSearchDocument(product_id=product.pk, title=product.name, body=body))
+        if len(documents) >= 1000:
+            ProductSearchDocument.objects.bulk_create(documents)
+            documents = []
+    ProductSearchDocument.objects.bulk_create(documents)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchDocument',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='products.product')),
+                ('title', models.CharField(max_length=255)),
+                ('body', models.TextField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(add_fulltext_indexes, drop_fulltext_indexes),
+        migrations.RunPython(populate_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:16
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def populate_facet_summary(apps, schema_editor):
+    """Counts the existing products per facet combination (same buckets as products.facets)."""
+    Product = apps.get_model('products', 'Product')
+    ProductFacetSummary = apps.get_model('products', 'ProductFacetSummary')
+    price_buckets = (Decimal('0'), Decimal('25'), Decimal('50'), Decimal('100'), Decimal('250'), Decimal('500'))
+
+    counts = {}
+    rows = Product.objects.values_list('brand', 'theme', 'genre', 'price', 'discount_percent')
+    for brand, theme, genre, price, discount_percent in rows.iterator(chunk_size=2000):
+        final_price = price - price * (discount_percent / 100)
+        bucket = max(index for index, lower in enumerate(price_buckets) if final_price >= lower or index == 0)
+        key = (brand or '', theme or '', genre or '', bucket)
+        counts[key] = counts.get(key, 0) + 1
+
+    ProductFacetSummary.objects.bulk_create(
+        [
+            ProductFacetSummary(brand=brand, theme=theme, genre=genre, price_bucket=bucket, product_count=count)
+            for (brand, theme, genre, bucket), count in counts.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_product_search_document'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFacetSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('brand', models.CharField(max_length=100)),
+                ('theme', models.CharField(blank=True, default='', max_length=100)),
+                ('genre', models.CharField(blank=True, default='', max_length=100)),
+                ('price_bucket', models.PositiveSmallIntegerField(help_text='Index into products.facets.PRICE_BUCKETS (final price).')),
+                ('product_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('brand', 'theme', 'genre', 'price_bucket')},
+            },
+        ),
+        migrations.RunPython(populate_facet_summary, migrations.RunPython.noop),
+    ]
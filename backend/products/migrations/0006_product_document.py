@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_product_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductDocument',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='document', serialize=False, to='products.product')),
+                ('name', models.CharField(max_length=255)),
+                ('slug', models.SlugField(max_length=255, unique=True)),
+                ('brand', models.CharField(max_length=100)),
+                ('theme', models.CharField(blank=True, max_length=100, null=True)),
+                ('genre', models.CharField(blank=True, max_length=100, null=True)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('discount_percent', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('data', models.JSONField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['name', 'product'], name='product_doc_name_idx'), models.Index(fields=['price', 'product'], name='product_doc_price_idx'), models.Index(fields=['created_at', 'product'], name='product_doc_created_idx'), models.Index(fields=['updated_at', 'product'], name='product_doc_updated_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,55 @@
+from decimal import Decimal
+
+import django.db.models.functions.math
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_final_prices(apps, schema_editor):
+    """Fills the new read model column from the generated product column."""
+    Product = apps.get_model('products', 'Product')
+    ProductDocument = apps.get_model('products', 'ProductDocument')
+    ProductDocument.objects.update(
+        final_price=Subquery(Product.objects.filter(pk=OuterRef('product')).values('final_price')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_product_document'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='final_price',
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.db.models.functions.math.Round(
+                    models.ExpressionWrapper(
+                        models.F('price') - models.F('price') * models.F('discount_percent') / models.Value(Decimal('100')),
+                        output_field=models.DecimalField(decimal_places=2, max_digits=10),
+                    ),
+                    2,
+                ),
+                output_field=models.DecimalField(decimal_places=2, max_digits=10),
+                verbose_name='Final Price',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['final_price', 'id'], name='product_final_price_id_idx'),
+        ),
+        migrations.AddField(
+            model_name='productdocument',
+            name='final_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+            preserve_default=False,
+        ),
+        migrations.RunPython(copy_final_prices, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='productdocument',
+            index=models.Index(fields=['final_price', 'product'], name='product_doc_final_price_idx'),
+        ),
+    ]
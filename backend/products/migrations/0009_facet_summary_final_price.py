@@ -0,0 +1,72 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:40
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def recount_facet_summary(apps, schema_editor):
+    """Recounts the summary per facet combination and final price (same buckets as products.facets)."""
+    Product = apps.get_model('products', 'Product')
+    ProductFacetSummary = apps.get_model('products', 'ProductFacetSummary')
+    price_buckets = (Decimal('0'), Decimal('25'), Decimal('50'), Decimal('100'), Decimal('250'), Decimal('500'))
+
+    counts = {}
+    rows = Product.objects.values('brand', 'theme', 'genre', 'final_price').annotate(total=Count('id')).order_by()
+    for row in rows:
+        key = (row['brand'] or '', row['theme'] or '', row['genre'] or '', row['final_price'])
+        counts[key] = counts.get(key, 0) + row['total']
+
+    ProductFacetSummary.objects.all().delete()
+    ProductFacetSummary.objects.bulk_create(
+        [
+            ProductFacetSummary(
+                brand=brand, theme=theme, genre=genre, final_price=final_price, product_count=count,
+                price_bucket=max(index for index, lower in enumerate(price_buckets) if final_price >= lower or index == 0),
+            )
+            for (brand, theme, genre, final_price), count in counts.items()
+        ],
+        batch_size=1000,
+    )
+
+
+def recount_facet_summary_by_bucket(apps, schema_editor):
+    ProductFacetSummary = apps.get_model('products', 'ProductFacetSummary')
+    counts = {}
+    for row in ProductFacetSummary.objects.values('brand', 'theme', 'genre', 'price_bucket', 'product_count'):
+        key = (row['brand'], row['theme'], row['genre'], row['price_bucket'])
+        counts[key] = counts.get(key, 0) + row['product_count']
+    ProductFacetSummary.objects.all().delete()
+    ProductFacetSummary.objects.bulk_create(
+        [
+            ProductFacetSummary(brand=brand, theme=theme, genre=genre, price_bucket=bucket, final_price=0, product_count=count)
+            for (brand, theme, genre, bucket), count in counts.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_product_reserved_quantity'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='productfacetsummary',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='productfacetsummary',
+            name='final_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+            preserve_default=False,
+        ),
+        migrations.RunPython(recount_facet_summary, recount_facet_summary_by_bucket),
+        migrations.AlterUniqueTogether(
+            name='productfacetsummary',
+            unique_together={('brand', 'theme', 'genre', 'final_price')},
+        ),
+    ]
@@ -1,4 +1,11 @@
-from django.db import models
+import threading
+from contextlib import contextmanager
+from django.db import models, transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .cache import bump_catalog_version, bump_product_version
+from . import search, images, read_model
+from .facets import product_facet_key, facet_key, adjust_facet_count, discounted_price, discounted_price_expression
 
 class Product(models.Model):
     name = models.CharField(max_length=255, unique=True, verbose_name="Product Name")
@@ -11,16 +18,49 @@ class Product(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2, help_text="Retail Price")
     discount_percent = models.DecimalField(max_digits=5, decimal_places=2, default=0.00, verbose_name="Discount %")
     stock_quantity = models.IntegerField(default=0, verbose_name="Available Stock")
+    # Units held by shopping carts, moved only by cart/reservations.py; stock_quantity stays what staff and imports set
+    reserved_quantity = models.PositiveIntegerField(default=0, editable=False, verbose_name="Reserved Stock")
+    # What the customer pays, computed and stored by the database so it can be sorted, filtered and indexed.
+    # Not refreshed on save(); use get_discounted_price() on instances that were just written.
+    final_price = models.GeneratedField(
+        expression=discounted_price_expression(),
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+        db_persist=True,
+        verbose_name="Final Price",
+    )
     
     # Status
     is_available = models.BooleanField(default=True, verbose_name="Is Available Online")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        # Composite indexes backing the keyset (cursor) pagination sort keys
+        indexes = [
+            models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+            models.Index(fields=['final_price', 'id'], name='product_final_price_id_idx'),
+            models.Index(fields=['created_at', 'id'], name='product_created_id_idx'),
+            models.Index(fields=['updated_at', 'id'], name='product_updated_id_idx'),
+        ]
+
     def get_discounted_price(self):
-        """Calculates the final price after applying the discount."""
-        discount_amount = self.price * (self.discount_percent / 100)
-        return self.price - discount_amount
+        """Calculates the final price after applying the discount (same rounding as `final_price`)."""
+        return discounted_price(self.price, self.discount_percent)
+
+    @property
+    def available_quantity(self):
+        """Units that can still be added to a cart: the stock not held by any cart."""
+        return self.stock_quantity - self.reserved_quantity
+
+    def save(self, *args, **kwargs):
+        # Holds move reserved_quantity with UPDATEs of their own, so saving an instance loaded
+        # before a hold changed must not write its stale copy back
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and not field.generated and field.name != 'reserved_quantity'
+            ]
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
@@ -34,6 +74,9 @@ class ProductImage(models.Model):
     alt_text = models.CharField(max_length=255, blank=True, null=True)
     is_main = models.BooleanField(default=False, verbose_name="Main Display Image")
     order = models.PositiveIntegerField(default=0, help_text="Order in which image is displayed.")
+    # Resized WebP/AVIF/JPEG variants of `image`, filled in off the request path (see products/images.py):
+    # {"source": <image name>, "variants": {"webp": {"320": <storage name>, ...}, ...}}
+    derivatives = models.JSONField(default=dict, blank=True, editable=False)
 
     class Meta:
         ordering = ['order']
@@ -52,3 +95,212 @@ class ProductFeature(models.Model):
     
     def __str__(self):
         return f"{self.product.name} - {self.feature_name}"
+
+class ProductSearchDocument(models.Model):
+    """
+    Denormalized searchable text of a product (name, descriptions and feature values).
+    Backed by FULLTEXT indexes on MySQL and by the in-process index elsewhere (see products/search.py).
+    """
+    product = models.OneToOneField(Product, primary_key=True, related_name='search_document', on_delete=models.CASCADE)
+    title = models.CharField(max_length=255)
+    body = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Search document for {self.title}"
+
+class ProductFacetSummary(models.Model):
+    """
+    Number of products per combination of facet values (brand, theme, genre) and final price.
+    The exact price lets any price range be counted from the summary; its size grows with the
+    distinct price points per brand/theme/genre, not with the number of products.
+    Maintained incrementally by the product signals below so facet counts never scan the
+    product table; rebuild with `manage.py rebuild_facet_summary` after bulk loads.
+    Missing theme/genre values are stored as ''.
+    """
+    brand = models.CharField(max_length=100)
+    theme = models.CharField(max_length=100, blank=True, default='')
+    genre = models.CharField(max_length=100, blank=True, default='')
+    final_price = models.DecimalField(max_digits=10, decimal_places=2)
+    price_bucket = models.PositiveSmallIntegerField(help_text="Index into products.facets.PRICE_BUCKETS (final price).")
+    product_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('brand', 'theme', 'genre', 'final_price')
+
+    def __str__(self):
+        return f"{self.brand}/{self.theme}/{self.genre}/{self.final_price}: {self.product_count}"
+
+class ProductDocument(models.Model):
+    """
+    Denormalized read model: the API representation of a product (images and features included)
+    pre-rendered as one JSON document, next to copies of the columns listings filter and sort on,
+    so list and detail reads never join or serialize the product tables.
+    Rebuilt by the signals below in the writing transaction (see products/read_model.py); rebuild
+    everything with `manage.py rebuild_product_documents`.
+    """
+    product = models.OneToOneField(Product, primary_key=True, related_name='document', on_delete=models.CASCADE)
+    name = models.CharField(max_length=255)
+    slug = models.SlugField(max_length=255, unique=True)
+    brand = models.CharField(max_length=100)
+    theme = models.CharField(max_length=100, blank=True, null=True)
+    genre = models.CharField(max_length=100, blank=True, null=True)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    discount_percent = models.DecimalField(max_digits=5, decimal_places=2)
+    final_price = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    # ProductSerializer output with media URLs relative to the site (made absolute per request)
+    data = models.JSONField()
+
+    class Meta:
+        # Same keyset pagination indexes as Product, so every listing is one index range scan
+        indexes = [
+            models.Index(fields=['name', 'product'], name='product_doc_name_idx'),
+            models.Index(fields=['price', 'product'], name='product_doc_price_idx'),
+            models.Index(fields=['final_price', 'product'], name='product_doc_final_price_idx'),
+            models.Index(fields=['created_at', 'product'], name='product_doc_created_idx'),
+            models.Index(fields=['updated_at', 'product'], name='product_doc_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f"Document for {self.name}"
+
+# --- Signals to keep cached catalog data in sync with product writes ---
+_bulk_load = threading.local()
+
+@contextmanager
+def suspended_related_signals():
+    """
+    Suspends the per-row image/feature signal work while a bulk catalog load runs in this
+    thread. The loader must refresh the search index and cached details itself.
+    """
+    _bulk_load.active = True
+    try:
+        yield
+    finally:
+        _bulk_load.active = False
+
+def is_product_cascade(origin):
+    """True when a post_delete was triggered by deleting a Product (or a Product queryset)."""
+    return isinstance(origin, Product) or getattr(origin, 'model', None) is Product
+
+def skip_related_signal(kwargs):
+    """Image/feature receivers have nothing to do during bulk loads or a product's own delete."""
+    return getattr(_bulk_load, 'active', False) or is_product_cascade(kwargs.get('origin'))
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_catalog_counts(sender, instance, **kwargs):
+    """
+    Signal receiver to invalidate the cached listing counts whenever a product is
+    created, updated or deleted.
+    """
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=Product)
+def index_saved_product(sender, instance, **kwargs):
+    """Signal receiver to refresh the search document of a created or updated product."""
+    search.index_product(instance)
+
+@receiver(post_delete, sender=Product)
+def unindex_deleted_product(sender, instance, **kwargs):
+    """Signal receiver to drop a deleted product from the in-memory search index."""
+    search.unindex_product(instance.pk)
+
+@receiver(post_save, sender=ProductFeature)
+@receiver(post_delete, sender=ProductFeature)
+def reindex_feature_product(sender, instance, **kwargs):
+    """Signal receiver to refresh the search document when a product's features change."""
+    if skip_related_signal(kwargs):
+        # Bulk load, or the product itself is being deleted
+        return
+    search.index_product(instance.product)
+
+def invalidate_product_detail(*slugs):
+    """
+    Drops the cached detail responses of the given products now and again once the
+    surrounding transaction commits, so a read racing the write cannot cache the old state.
+    """
+    bump_product_version(*slugs)
+    transaction.on_commit(lambda: bump_product_version(*slugs))
+
+@receiver(pre_save, sender=Product)
+def remember_previous_facets(sender, instance, **kwargs):
+    """Signal receiver to capture the facet values and slug a product had before it is updated."""
+    instance._previous_facet_key = None
+    instance._previous_slug = None
+    if instance.pk is not None:
+        previous = Product.objects.filter(pk=instance.pk).values_list(
+            'brand', 'theme', 'genre', 'price', 'discount_percent', 'slug'
+        ).first()
+        if previous is not None:
+            instance._previous_facet_key = facet_key(*previous[:5])
+            instance._previous_slug = previous[5]
+
+@receiver(post_save, sender=Product)
+def update_facet_summary(sender, instance, **kwargs):
+    """Signal receiver to move a saved product between facet summary rows."""
+    previous_key = getattr(instance, '_previous_facet_key', None)
+    current_key = product_facet_key(instance)
+    if previous_key == current_key:
+        return
+    if previous_key is not None:
+        adjust_facet_count(previous_key, -1)
+    adjust_facet_count(current_key, 1)
+
+@receiver(post_delete, sender=Product)
+def remove_from_facet_summary(sender, instance, **kwargs):
+    """Signal receiver to decrement the facet summary row of a deleted product."""
+    adjust_facet_count(product_facet_key(instance), -1)
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_saved_product_detail(sender, instance, **kwargs):
+    """Signal receiver to drop the cached detail of a product (under its old and new slug)."""
+    invalidate_product_detail(instance.slug, getattr(instance, '_previous_slug', None))
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=ProductFeature)
+@receiver(post_delete, sender=ProductFeature)
+def invalidate_related_product_detail(sender, instance, **kwargs):
+    """Signal receiver to drop the cached detail of a product whose images or features changed."""
+    if skip_related_signal(kwargs):
+        # Bulk load, or handled by the product's own delete signal
+        return
+    invalidate_product_detail(instance.product.slug)
+
+@receiver(post_save, sender=ProductImage)
+def schedule_image_derivatives(sender, instance, raw=False, **kwargs):
+    """Signal receiver to render the thumbnails of a new or replaced image once the upload commits."""
+    if raw or not images.needs_derivatives(instance):
+        return
+    transaction.on_commit(lambda: images.schedule_derivatives(instance.pk))
+
+@receiver(post_delete, sender=ProductImage)
+def delete_image_derivatives(sender, instance, **kwargs):
+    """Signal receiver to delete the rendered variants of a deleted (or importer-replaced) image once the delete commits."""
+    variants = (instance.derivatives or {}).get('variants')
+    if variants:
+        transaction.on_commit(lambda: images.delete_variants(variants))
+
+
+@receiver(post_save, sender=Product)
+def refresh_saved_product_document(sender, instance, raw=False, **kwargs):
+    """Signal receiver to re-render the read model document of a created or updated product."""
+    if raw:
+        return
+    read_model.refresh_documents([instance.pk])
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=ProductFeature)
+@receiver(post_delete, sender=ProductFeature)
+def refresh_related_product_document(sender, instance, **kwargs):
+    """Signal receiver to re-render the document of a product whose images or features changed."""
+    if skip_related_signal(kwargs):
+        # Bulk load (the loader refreshes documents itself), or the document cascades away
+        return
+    read_model.refresh_documents([instance.product_id])
@@ -0,0 +1,141 @@
+import base64
+import binascii
+import json
+
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    """Raised when a client sends a cursor we did not issue (or that no longer applies)."""
+
+
+class KeysetPaginator:
+    """
+    Keyset (a.k.a. cursor / seek) pagination over a product queryset.
+
+    Instead of OFFSET, every page continues from the last row of the previous one with
+    WHERE (sort_key, id) > (last_value, last_id), so page N costs the same as page 1 and
+    no COUNT is needed. Cursors are opaque, url-safe base64 strings that remember the
+    sort key, the boundary row and the direction.
+    """
+    # Public sort keys -> model field. The primary key is always appended as a unique tie-breaker.
+    SORT_KEYS = {
+        'name': 'name',
+        'price': 'price',
+        'final_price': 'final_price',
+        'created_at': 'created_at',
+        'updated_at': 'updated_at',
+    }
+    DEFAULT_SORT = 'name'
+
+    def __init__(self, queryset, sort=None, page_size=10):
+        self.queryset = queryset
+        self.sort = sort or self.DEFAULT_SORT
+        self.page_size = page_size
+
+        if self.sort.lstrip('-') not in self.SORT_KEYS:
+            raise ValueError(self.sort)
+
+    @classmethod
+    def sort_field(cls, sort):
+        """Returns the model field backing a public sort key, e.g. '-price' -> 'price'."""
+        return cls.SORT_KEYS[(sort or cls.DEFAULT_SORT).lstrip('-')]
+
+    @classmethod
+    def ordering(cls, sort):
+        """Returns the order_by() arguments for a public sort key."""
+        field = cls.sort_field(sort)
+        if (sort or cls.DEFAULT_SORT).startswith('-'):
+            return (f'-{field}', '-pk')
+        return (field, 'pk')
+
+    # --- Cursor encoding ---
+
+    def encode_cursor(self, obj, direction):
+        field = self.sort_field(self.sort)
+        value = getattr(obj, field)
+        payload = {
+            's': self.sort,
+            'v': value.isoformat() if hasattr(value, 'isoformat') else str(value),
+            'id': obj.pk,
+            'd': direction,
+        }
+        raw = json.dumps(payload, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            sort, raw_value, pk, direction = payload['s'], payload['v'], int(payload['id']), payload['d']
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            raise InvalidCursor("The cursor is malformed.")
+
+        if not isinstance(sort, str) or sort.lstrip('-') not in self.SORT_KEYS or direction not in ('n', 'p'):
+            raise InvalidCursor("The cursor is malformed.")
+
+        # The cursor remembers the sort key it was issued for
+        self.sort = sort
+        model_field = self.queryset.model._meta.get_field(self.sort_field(sort))
+        if model_field.generated:
+            model_field = model_field.output_field
+        try:
+            value = model_field.to_python(raw_value)
+        except Exception:
+            raise InvalidCursor("The cursor is malformed.")
+        return value, pk, direction
+
+    # --- Paging ---
+
+    def get_page(self, cursor=None):
+        """
+        Returns (objects, next_cursor, previous_cursor) for the page after/before `cursor`.
+        Without a cursor the first page is returned.
+        """
+        queryset, backwards = self._page_queryset(cursor)
+        return self._build_page(list(queryset), cursor, backwards)
+
+    async def aget_page(self, cursor=None):
+        """Async variant of get_page() for the async views (same query, async ORM)."""
+        queryset, backwards = self._page_queryset(cursor)
+        return self._build_page([obj async for obj in queryset], cursor, backwards)
+
+    def _page_queryset(self, cursor):
+        """Returns (queryset of the page plus one look-ahead row, walking backwards?)."""
+        if cursor:
+            value, pk, direction = self.decode_cursor(cursor)
+        else:
+            value, pk, direction = None, None, 'n'
+
+        field = self.sort_field(self.sort)
+        descending = self.sort.startswith('-')
+        ordering = self.ordering(self.sort)
+
+        # Walking backwards is the same query with the ordering flipped
+        backwards = direction == 'p'
+        if backwards:
+            ordering = tuple(o[1:] if o.startswith('-') else f'-{o}' for o in ordering)
+
+        queryset = self.queryset.order_by(*ordering)
+        if cursor:
+            op = 'lt' if descending != backwards else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'{field}__{op}': value}) | Q(**{field: value, f'pk__{op}': pk})
+            )
+
+        # Fetch one extra row to find out whether another page exists
+        return queryset[:self.page_size + 1], backwards
+
+    def _build_page(self, objects, cursor, backwards):
+        has_more = len(objects) > self.page_size
+        objects = objects[:self.page_size]
+
+        if backwards:
+            objects.reverse()
+            next_cursor = self.encode_cursor(objects[-1], 'n') if objects else None
+            previous_cursor = self.encode_cursor(objects[0], 'p') if objects and has_more else None
+        else:
+            next_cursor = self.encode_cursor(objects[-1], 'n') if objects and has_more else None
+            previous_cursor = self.encode_cursor(objects[0], 'p') if objects and cursor else None
+
+        return objects, next_cursor, previous_cursor
@@ -0,0 +1,121 @@
+import json
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Prefetch
+from rest_framework.utils.encoders import JSONEncoder
+
+# Product columns copied onto the document for filtering, sorting and slug lookups
+DOCUMENT_COLUMNS = (
+    'name', 'slug', 'brand', 'theme', 'genre', 'price', 'discount_percent', 'final_price', 'created_at', 'updated_at',
+)
+
+
+def read_model_enabled():
+    """True when list and detail reads are served from ProductDocument (PRODUCT_READ_MODEL)."""
+    return getattr(settings, 'PRODUCT_READ_MODEL', False)
+
+
+def _source_queryset():
+    from .models import Product, ProductImage
+    from .serializers import ProductImageSerializer
+
+    return Product.objects.prefetch_related(
+        'features', Prefetch('images', queryset=ProductImage.objects.only(*ProductImageSerializer.COLUMNS)),
+    )
+
+
+def render_products(products):
+    """
+    The full ProductSerializer representations of `products` as plain JSON values. Rendered
+    without a request, so media URLs stay relative; see present_document().
+    """
+    from .serializers import ProductSerializer
+
+    # One list serializer builds the (nested) fields once for the whole batch
+    return json.loads(json.dumps(ProductSerializer(products, many=True).data, cls=JSONEncoder))
+
+
+def _write_documents(products):
+    """Upserts the documents of `products` (images and features prefetched) in one statement."""
+    from .models import ProductDocument
+
+    products = list(products)
+    documents = [
+        ProductDocument(
+            product_id=product.pk, data=data,
+            **{column: getattr(product, column) for column in DOCUMENT_COLUMNS},
+        )
+        for product, data in zip(products, render_products(products))
+    ]
+    upsert = {'update_conflicts': True, 'update_fields': [*DOCUMENT_COLUMNS, 'data']}
+    if connection.features.supports_update_conflicts_with_target:
+        # MySQL upserts on any unique key and rejects an explicit conflict target
+        upsert['unique_fields'] = ['product']
+    ProductDocument.objects.bulk_create(documents, **upsert)
+    return len(documents)
+
+
+def refresh_documents(product_ids):
+    """
+    Re-renders the documents of the given products with a fixed number of queries.
+    Called from the write signals, so the document commits (or rolls back) with the write;
+    ids of deleted products are ignored (their documents cascade away).
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return 0
+    return _write_documents(_source_queryset().filter(pk__in=product_ids))
+
+
+def rebuild_documents(chunk_size=500):
+    """
+    Re-renders every document in keyset chunks, for use after bulk loads that bypass signals
+    and when enabling the read model. Returns the number of documents written.
+    """
+    from .models import Product, ProductDocument
+
+    written = 0
+    last_id = 0
+    while True:
+        products = list(_source_queryset().filter(pk__gt=last_id).order_by('pk')[:chunk_size])
+        if not products:
+            break
+        written += _write_documents(products)
+        last_id = products[-1].pk
+
+    # Documents whose product went away without the delete cascade (e.g. raw SQL)
+    ProductDocument.objects.exclude(product__in=Product.objects.values('pk')).delete()
+    return written
+
+
+def _absolute_srcset(srcset, build_url):
+    # Storage URLs are percent-encoded, so neither ', ' nor ' ' occurs inside a URL
+    if not srcset:
+        return srcset
+    return ', '.join(
+        f"{build_url(url)} {width}" for url, width in (entry.rsplit(' ', 1) for entry in srcset.split(', '))
+    )
+
+
+def present_document(data, fields=None, request=None):
+    """
+    Turns a stored document into the response ProductSerializer would render for `fields`
+    (None for the full representation): the requested keys in serializer order, with media
+    URLs made absolute for `request`.
+    """
+    from .serializers import ProductSerializer, ProductImageSerializer
+
+    # JSON columns do not keep key order on every backend (MySQL, PostgreSQL jsonb)
+    result = {name: data[name] for name in (ProductSerializer.Meta.fields if fields is None else fields)}
+    if 'images' in result:
+        build_url = request.build_absolute_uri if request is not None else (lambda url: url)
+        images = []
+        for image in result['images']:
+            image = {name: image[name] for name in ProductImageSerializer.Meta.fields}
+            if image['image']:
+                image['image'] = build_url(image['image'])
+            image['srcset'] = {name: _absolute_srcset(srcset, build_url) for name, srcset in image['srcset'].items()}
+            images.append(image)
+        result['images'] = images
+    return result
@@ -0,0 +1,222 @@
+import math
+import re
+import threading
+from collections import defaultdict
+
+from django.db import connection
+
+# Words too common to help ranking; kept short on purpose
+STOPWORDS = frozenset("""
+    a an and are as at be by for from has in is it its of on or that the this to with
+""".split())
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Matches in the product name count this many times more than matches in the body
+TITLE_WEIGHT = 3
+
+
+def tokenize(text):
+    """Lowercases `text` and splits it into index terms, dropping stopwords and 1-letter tokens."""
+    return [t for t in TOKEN_RE.findall((text or '').lower()) if len(t) > 1 and t not in STOPWORDS]
+
+
+def build_document(product, features):
+    """Returns the (title, body) text indexed for a product and its features."""
+    body = '\n'.join(
+        [product.short_description or '', product.long_description or '']
+        + [f"{feature.feature_name} {feature.feature_value}" for feature in features]
+    )
+    return product.name, body
+
+
+class InvertedIndex:
+    """
+    In-process inverted index used when the database has no full-text engine (SQLite, tests).
+
+    Maps every term to the products containing it with a field-weighted term frequency and
+    ranks matches with BM25. The index lives in process memory: it is loaded from the
+    ProductSearchDocument table on first use and kept current by the product signals of this
+    process, so it is meant for single-process development and test setups.
+    """
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.postings = defaultdict(dict)  # term -> {product_id: weighted tf}
+        self.doc_terms = {}  # product_id -> set of terms (for removal)
+        self.doc_lengths = {}  # product_id -> weighted document length
+
+    def add(self, product_id, title, body):
+        frequencies = defaultdict(int)
+        for term in tokenize(title):
+            frequencies[term] += TITLE_WEIGHT
+        for term in tokenize(body):
+            frequencies[term] += 1
+
+        with self._lock:
+            self.remove(product_id)
+            for term, tf in frequencies.items():
+                self.postings[term][product_id] = tf
+            self.doc_terms[product_id] = set(frequencies)
+            self.doc_lengths[product_id] = sum(frequencies.values())
+
+    def remove(self, product_id):
+        with self._lock:
+            for term in self.doc_terms.pop(product_id, ()):
+                postings = self.postings.get(term)
+                if postings is not None:
+                    postings.pop(product_id, None)
+                    if not postings:
+                        del self.postings[term]
+            self.doc_lengths.pop(product_id, None)
+
+    def search(self, query):
+        """Returns [(product_id, score)] for products matching any query term, best first."""
+        terms = set(tokenize(query))
+        with self._lock:
+            total_docs = len(self.doc_lengths)
+            if not total_docs or not terms:
+                return []
+            average_length = sum(self.doc_lengths.values()) / total_docs
+
+            scores = defaultdict(float)
+            for term in terms:
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for product_id, tf in postings.items():
+                    norm = self.K1 * (1 - self.B + self.B * self.doc_lengths[product_id] / average_length)
+                    scores[product_id] += idf * tf * (self.K1 + 1) / (tf + norm)
+
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def uses_database_fulltext():
+    """MySQL has FULLTEXT indexes on the search document table (see migration 0003)."""
+    return connection.vendor == 'mysql'
+
+
+def get_memory_index():
+    """Returns the process-wide in-memory index, loading it from the document table on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                from .models import ProductSearchDocument
+
+                index = InvertedIndex()
+                for product_id, title, body in ProductSearchDocument.objects.values_list(
+                    'product_id', 'title', 'body'
+                ).iterator(chunk_size=2000):
+                    index.add(product_id, title, body)
+                _index = index
+    return _index
+
+
+def reset_memory_index():
+    """Drops the in-memory index; it is reloaded from the database on the next search."""
+    global _index
+    with _index_lock:
+        _index = None
+
+
+def index_product(product):
+    """Rebuilds the search document for one product (called from the save signals)."""
+    from .models import ProductSearchDocument
+
+    title, body = build_document(product, product.features.all())
+    ProductSearchDocument.objects.update_or_create(product_id=product.pk, defaults={'title': title, 'body': body})
+    if _index is not None:
+        _index.add(product.pk, title, body)
+
+
+def unindex_product(product_id):
+    """Removes a deleted product from the in-memory index (the table row cascades)."""
+    if _index is not None:
+        _index.remove(product_id)
+
+
+def _write_documents(products):
+    """Upserts the search documents of `products` (features prefetched) in one statement."""
+    from .models import ProductSearchDocument
+
+    documents = []
+    for product in products:
+        title, body = build_document(product, product.features.all())
+        documents.append(ProductSearchDocument(product_id=product.pk, title=title, body=body))
+    upsert = {'update_conflicts': True, 'update_fields': ['title', 'body']}
+    if connection.features.supports_update_conflicts_with_target:
+        # MySQL upserts on any unique key and rejects an explicit conflict target
+        upsert['unique_fields'] = ['product']
+    ProductSearchDocument.objects.bulk_create(documents, **upsert)
+    return documents
+
+
+def _document_queryset():
+    from .models import Product
+
+    return Product.objects.only('id', 'name', 'short_description', 'long_description').prefetch_related('features')
+
+
+def index_products(product_ids):
+    """Rebuilds the search documents of many products with a fixed number of queries (bulk loads)."""
+    documents = _write_documents(_document_queryset().filter(pk__in=product_ids))
+    if _index is not None:
+        for document in documents:
+            _index.add(document.product_id, document.title, document.body)
+    return len(documents)
+
+
+def rebuild_index(chunk_size=1000):
+    """
+    Rebuilds every search document in chunks, for use after bulk loads that bypass signals.
+    Returns the number of indexed products.
+    """
+    indexed = 0
+    last_id = 0
+    while True:
+        products = list(_document_queryset().filter(pk__gt=last_id).order_by('pk')[:chunk_size])
+        if not products:
+            break
+        indexed += len(_write_documents(products))
+        last_id = products[-1].pk
+
+    reset_memory_index()
+    return indexed
+
+
+def search_products(query, limit=10, offset=0):
+    """
+    Runs a relevance-ranked search.
+    Returns (total_matches, [(product_id, score), ...]) for the requested window.
+    """
+    if uses_database_fulltext():
+        return _search_mysql(query, limit, offset)
+
+    matches = get_memory_index().search(query)
+    return len(matches), matches[offset:offset + limit]
+
+
+def _search_mysql(query, limit, offset):
+    from .models import ProductSearchDocument
+
+    table = ProductSearchDocument._meta.db_table
+    match_title = "MATCH(title) AGAINST (%s IN NATURAL LANGUAGE MODE)"
+    match_all = "MATCH(title, body) AGAINST (%s IN NATURAL LANGUAGE MODE)"
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE {match_all}", [query])
+        total = cursor.fetchone()[0]
+        cursor.execute(
+            f"SELECT product_id, {match_title} * {TITLE_WEIGHT} + {match_all} AS score "
+            f"FROM {table} WHERE {match_all} "
+            f"ORDER BY score DESC, product_id LIMIT %s OFFSET %s",
+            [query, query, query, limit, offset],
+        )
+        return total, [(row[0], float(row[1])) for row in cursor.fetchall()]
@@ -1,11 +1,35 @@
+from django.core.files.storage import default_storage
 from rest_framework import serializers
+from backend.metrics import TimedSerializerMixin
 from .models import Product, ProductImage, ProductFeature
 
 class ProductImageSerializer(serializers.ModelSerializer):
-    """Serializer for product images."""
+    """
+    Serializer for product images.
+    `srcset` maps each derivative format to a srcset string ("<url> 320w, <url> 640w"); it is
+    empty until the thumbnails have been generated, so clients fall back to `image`.
+    """
+    srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = ProductImage
-        fields = ['id', 'image', 'alt_text', 'is_main', 'order']
+        fields = ['id', 'image', 'alt_text', 'is_main', 'order', 'srcset']
+
+    # ProductImage columns needed to render this serializer (for .only() on prefetches)
+    COLUMNS = ('id', 'product_id', 'image', 'alt_text', 'is_main', 'order', 'derivatives')
+
+    def get_srcset(self, image):
+        request = self.context.get('request')
+
+        def url(name):
+            url = default_storage.url(name)
+            return request.build_absolute_uri(url) if request is not None else url
+
+        variants = (image.derivatives or {}).get('variants', {})
+        return {
+            name: ', '.join(f"{url(path)} {width}w" for width, path in sorted(sizes.items(), key=lambda size: int(size[0])))
+            for name, sizes in variants.items()
+        }
 
 class ProductFeatureSerializer(serializers.ModelSerializer):
     """Serializer for product features (key-value pairs)."""
@@ -13,9 +37,12 @@ class ProductFeatureSerializer(serializers.ModelSerializer):
         model = ProductFeature
         fields = ['id', 'feature_name', 'feature_value']
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Main serializer for the Product model, including nested images and features.
+
+    Accepts an optional ``fields`` keyword (an iterable of field names) to render
+    a sparse fieldset, e.g. ``ProductSerializer(qs, many=True, fields=['id', 'name'])``.
     """
     # Nested serializers for read-only display
     images = ProductImageSerializer(many=True, read_only=True)
@@ -29,12 +56,164 @@ class ProductSerializer(serializers.ModelSerializer):
         read_only=True
     )
 
+    # Stock not held by shopping carts (stock_quantity is the on-hand stock)
+    available_quantity = serializers.IntegerField(read_only=True)
+
     class Meta:
         model = Product
         fields = [
             'id', 'name', 'slug', 'brand', 'short_description', 'long_description', 
             'theme', 'genre', 'price', 'discount_percent', 'final_price',
-            'stock_quantity', 'is_available', 'created_at', 'updated_at', 
+            'stock_quantity', 'available_quantity', 'is_available', 'created_at', 'updated_at', 
             'images', 'features'
         ]
         read_only_fields = ('created_at', 'updated_at', 'slug')
+
+    # Expensive fields (large text column / extra queries) that listing pages
+    # usually do not need. They are only rendered on request via ?expand=.
+    HEAVY_FIELDS = ('long_description', 'images', 'features')
+
+    # Model columns each serializer field needs to be loaded from the database.
+    # Fields not listed here map 1:1 onto a column of the same name.
+    FIELD_COLUMNS = {
+        'final_price': ('price', 'discount_percent'),
+        'available_quantity': ('stock_quantity', 'reserved_quantity'),
+        'images': (),
+        'features': (),
+    }
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+
+        if fields is not None:
+            # Drop every field that was not explicitly requested
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
+    @classmethod
+    def resolve_fieldset(cls, fields=None, expand=None):
+        """
+        Turns the raw ``fields``/``expand`` request values into the list of field names
+        to render, or None when the full representation was requested.
+
+        - Neither given: full representation (legacy behaviour).
+        - ``fields`` given: only those fields (heavy fields included if listed).
+        - ``expand`` given: the requested (or all light) fields plus the expanded heavy ones.
+
+        Raises ValueError listing any unknown field names.
+        """
+        if fields is None and expand is None:
+            return None
+
+        requested = [name for name in (fields or []) if name]
+        expanded = [name for name in (expand or []) if name]
+
+        unknown = sorted(set(requested) - set(cls.Meta.fields))
+        unknown += sorted(set(expanded) - set(cls.HEAVY_FIELDS))
+        if unknown:
+            raise ValueError(unknown)
+
+        if not requested:
+            requested = [name for name in cls.Meta.fields if name not in cls.HEAVY_FIELDS]
+
+        # Keep the declared field order in the output
+        selected = set(requested) | set(expanded)
+        return [name for name in cls.Meta.fields if name in selected]
+
+    @classmethod
+    def columns_for(cls, fields):
+        """Returns the Product columns required to render the given fieldset."""
+        columns = {'id'}
+        for field_name in fields:
+            columns.update(cls.FIELD_COLUMNS.get(field_name, (field_name,)))
+        return sorted(columns)
+
+
+class ProductSummarySerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """
+    Compact product representation for cart lines: just what a cart UI renders.
+    Expects `images` to be prefetched (see cart.views.CartViewSet.get_cart_with_items and session_cart_response).
+    """
+    main_image = serializers.SerializerMethodField()
+    final_price = serializers.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        source='get_discounted_price',
+        read_only=True
+    )
+
+    class Meta:
+        model = Product
+        fields = ['id', 'name', 'slug', 'main_image', 'final_price']
+
+    # Product columns needed to render this serializer (for .only() on related lookups)
+    COLUMNS = ('id', 'name', 'slug', 'price', 'discount_percent')
+
+    def get_main_image(self, product):
+        """Returns the image flagged as main, falling back to the first image by display order."""
+        images = list(product.images.all())
+        if not images:
+            return None
+        main = next((image for image in images if image.is_main), images[0])
+        return ProductImageSerializer(main, context=self.context).data
+
+
+class ProductImportRowSerializer(serializers.Serializer):
+    """
+    Validates one row of a bulk product import (see products/importer.py).
+
+    A plain Serializer on purpose: ModelSerializer would add a uniqueness query per row,
+    while the importer resolves slugs and names for the whole file in memory.
+    `features` is a {name: value} object or a list of {"name", "value"} objects; `images`
+    is a list of storage paths or {"image", "alt_text", "is_main", "order"} objects.
+    Omitted relations are left untouched on existing products; given ones replace them.
+    """
+    name = serializers.CharField(max_length=255)
+    slug = serializers.SlugField(max_length=255, required=False)
+    brand = serializers.CharField(max_length=100, required=False)
+    short_description = serializers.CharField(max_length=500)
+    long_description = serializers.CharField()
+    theme = serializers.CharField(max_length=100, required=False, allow_null=True)
+    genre = serializers.CharField(max_length=100, required=False, allow_null=True)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0)
+    discount_percent = serializers.DecimalField(max_digits=5, decimal_places=2, min_value=0, max_value=100, required=False)
+    stock_quantity = serializers.IntegerField(required=False)
+    is_available = serializers.BooleanField(required=False)
+    features = serializers.JSONField(required=False)
+    images = serializers.JSONField(required=False)
+
+    def validate_features(self, value):
+        """Normalizes features to a list of (name, value) pairs."""
+        if isinstance(value, dict):
+            value = [{"name": name, "value": feature_value} for name, feature_value in value.items()]
+        if not isinstance(value, list) or not all(isinstance(item, dict) and item.get('name') for item in value):
+            raise serializers.ValidationError('Expected an object or a list of {"name", "value"} objects.')
+        for item in value:
+            if len(str(item['name'])) > 100:
+                raise serializers.ValidationError("Feature names are limited to 100 characters.")
+        return [(str(item['name']), str(item.get('value', ''))) for item in value]
+
+    def validate_images(self, value):
+        """Normalizes images to a list of ProductImage field dicts, defaulting the first to main."""
+        if not isinstance(value, list):
+            raise serializers.ValidationError("Expected a list of image paths or objects.")
+        images = []
+        for order, item in enumerate(value):
+            if isinstance(item, str):
+                item = {"image": item}
+            if not isinstance(item, dict) or not item.get('image'):
+                raise serializers.ValidationError('Every image needs an "image" path.')
+            try:
+                order = int(item.get('order', order))
+            except (TypeError, ValueError):
+                raise serializers.ValidationError("Image 'order' must be an integer.")
+            images.append({
+                'image': str(item['image']),
+                'alt_text': item.get('alt_text'),
+                'is_main': bool(item.get('is_main', False)),
+                'order': order,
+            })
+        if images and not any(image['is_main'] for image in images):
+            images[0]['is_main'] = True
+        return images
@@ -1,3 +1,1003 @@
+import base64
+import csv
+import json
+import os
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, connection, transaction
+from django.test import override_settings
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .facets import rebuild_facet_summary
+from .models import Product, ProductImage, ProductFeature, ProductDocument, ProductFacetSummary
+from .importer import ProductImporter
+from .read_model import rebuild_documents
+from .search import reset_memory_index, rebuild_index
+
+
+def create_catalog(num_products, images_per_product=2, features_per_product=3):
+    """Creates a small catalog with images and features for endpoint tests."""
+    products = Product.objects.bulk_create([
+        Product(
+            name=f"Wooden Toy {i:04d}",
+            slug=f"wooden-toy-{i:04d}",
+            brand='Acme' if i % 2 else 'Woodcraft',
+            short_description="A short summary.",
+            long_description="A much longer description. " * 20,
+            theme='Classic',
+            genre='Puzzle',
+            price=Decimal('100.00') + i,
+            discount_percent=Decimal('10.00'),
+            stock_quantity=50,
+        )
+        for i in range(num_products)
+    ])
+    products = list(Product.objects.order_by('name'))
+    ProductImage.objects.bulk_create([
+        ProductImage(product=product, image=f"product_images/{product.slug}-{order}.jpg", is_main=order == 0, order=order)
+        for product in products
+        for order in range(images_per_product)
+    ])
+    ProductFeature.objects.bulk_create([
+        ProductFeature(product=product, feature_name=f"Feature {n}", feature_value=f"Value {n}")
+        for product in products
+        for n in range(features_per_product)
+    ])
+    return products
+
+
+class ProductAPITestCase(TestCase):
+    """Base class for product endpoint tests: every test starts with a cold cache."""
+
+    def setUp(self):
+        cache.clear()
+        # The in-memory search index outlives test transactions; reload it from the database
+        reset_memory_index()
+        self.client = APIClient()
+
+
+class ProductQueryBudgetTests(ProductAPITestCase):
+    """
+    Every product read endpoint has a fixed (cold cache) query budget that must not depend
+    on the number of products rendered. Raising a budget here should be a deliberate decision.
+    """
+    QUERY_BUDGETS = {
+        # COUNT + products + images + features
+        'list_products': 4,
+        # COUNT + products (no relations requested)
+        'list_products_sparse': 2,
+        # products + images + features
+        'list': 3,
+        # product + images + features
+        'retrieve': 3,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = create_catalog(120)
+
+    def test_list_products_query_budget(self):
+        with self.assertNumQueries(self.QUERY_BUDGETS['list_products']):
+            response = self.client.get('/api/v1/products/list/', {'page': 1, 'size': 100})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 100)
+        self.assertEqual(len(response.data['results'][0]['images']), 2)
+        self.assertEqual(len(response.data['results'][0]['features']), 3)
+
+    def test_list_products_post_query_budget(self):
+        with self.assertNumQueries(self.QUERY_BUDGETS['list_products']):
+            response = self.client.post('/api/v1/products/list/', {'page': 2, 'size': 100}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 20)
+
+    def test_sparse_list_query_budget(self):
+        with self.assertNumQueries(self.QUERY_BUDGETS['list_products_sparse']):
+            response = self.client.get('/api/v1/products/list/', {'size': 100, 'fields': 'id,name,slug,final_price'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'name', 'slug', 'final_price'})
+        self.assertEqual(response.data['results'][0]['final_price'], '90.00')
+
+    def test_default_list_query_budget(self):
+        with self.assertNumQueries(self.QUERY_BUDGETS['list']):
+            response = self.client.get('/api/v1/products/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 120)
+
+    def test_retrieve_query_budget(self):
+        with self.assertNumQueries(self.QUERY_BUDGETS['retrieve']):
+            response = self.client.get(f'/api/v1/products/{self.products[0].slug}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['features']), 3)
+
+
+class ProductSparseFieldsetTests(ProductAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(3)
+
+    def test_full_representation_by_default(self):
+        response = self.client.get('/api/v1/products/list/')
+        self.assertIn('long_description', response.data['results'][0])
+        self.assertIn('features', response.data['results'][0])
+
+    def test_expand_adds_heavy_fields_to_light_representation(self):
+        response = self.client.get('/api/v1/products/list/', {'expand': 'images'})
+        result = response.data['results'][0]
+        self.assertIn('images', result)
+        self.assertIn('short_description', result)
+        self.assertNotIn('long_description', result)
+        self.assertNotIn('features', result)
+
+    def test_fields_and_expand_in_post_body(self):
+        response = self.client.post(
+            '/api/v1/products/list/', {'fields': ['id', 'name'], 'expand': ['features']}, format='json'
+        )
+        self.assertEqual(set(response.data['results'][0]), {'id', 'name', 'features'})
+
+    def test_unknown_field_is_rejected(self):
+        response = self.client.get('/api/v1/products/list/', {'fields': 'id,colour'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_only_heavy_fields_are_expandable(self):
+        response = self.client.get('/api/v1/products/list/', {'expand': 'name'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_malformed_fields_in_post_body_are_rejected(self):
+        for body in ({'fields': {'id': 1}}, {'fields': 5}, {'expand': [['images']]}):
+            response = self.client.post('/api/v1/products/list/', body, format='json')
+            self.assertEqual(response.status_code, 400, body)
+
+
+class ProductCursorPaginationTests(ProductAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = create_catalog(25, images_per_product=1, features_per_product=1)
+
+    def walk(self, params):
+        """Follows 'next' cursors from the first page and returns all slugs seen."""
+        slugs, cursor = [], ''
+        while cursor is not None:
+            response = self.client.get('/api/v1/products/list/', {**params, 'cursor': cursor})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            slugs += [item['slug'] for item in response.data['results']]
+            cursor = response.data['next']
+        return slugs
+
+    def test_walks_whole_catalog_in_name_order(self):
+        slugs = self.walk({'size': 10})
+        self.assertEqual(slugs, [p.slug for p in self.products])
+
+    def test_descending_price_sort(self):
+        slugs = self.walk({'size': 7, 'sort': '-price', 'fields': 'slug'})
+        self.assertEqual(slugs, [p.slug for p in sorted(self.products, key=lambda p: p.price, reverse=True)])
+
+    def test_previous_cursor_returns_preceding_page(self):
+        first = self.client.get('/api/v1/products/list/', {'size': 10, 'pagination': 'cursor'}).data
+        self.assertIsNone(first['previous'])
+        second = self.client.get('/api/v1/products/list/', {'size': 10, 'cursor': first['next']}).data
+        back = self.client.get('/api/v1/products/list/', {'size': 10, 'cursor': second['previous']}).data
+        self.assertEqual([r['slug'] for r in back['results']], [r['slug'] for r in first['results']])
+        self.assertIsNone(back['previous'])
+
+    def test_deep_page_costs_the_same_as_first_page(self):
+        first = self.client.get('/api/v1/products/list/', {'size': 5, 'cursor': ''}).data
+        with self.assertNumQueries(3):
+            self.client.get('/api/v1/products/list/', {'size': 5, 'cursor': first['next']})
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get('/api/v1/products/list/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+        forged = base64.urlsafe_b64encode(json.dumps({'s': 5, 'v': 'a', 'id': 1, 'd': 'n'}).encode()).decode()
+        response = self.client.get('/api/v1/products/list/', {'cursor': forged})
+        self.assertEqual(response.status_code, 400)
+
+    def test_non_string_sort_is_rejected(self):
+        for sort in (5, ['name'], {'name': 1}):
+            response = self.client.post('/api/v1/products/list/', {'sort': sort}, format='json')
+            self.assertEqual(response.status_code, 400, sort)
+
+    def test_page_mode_is_unchanged(self):
+        response = self.client.post('/api/v1/products/list/', {'page': 3, 'size': 10}, format='json')
+        self.assertEqual(response.data['count'], 25)
+        self.assertEqual(response.data['current_page'], 3)
+        self.assertEqual(len(response.data['results']), 5)
+
+
+
+class ProductFinalPriceTests(ProductAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        # Retail price order differs from what the customer pays
+        for slug, price, discount in (('birch-blocks', '100.00', '60.00'), ('oak-blocks', '60.00', '0.00'),
+                                      ('pine-blocks', '80.00', '12.50'), ('beech-blocks', '33.33', '33.33')):
+            Product.objects.create(
+                name=slug.replace('-', ' ').title(), slug=slug, price=Decimal(price), discount_percent=Decimal(discount),
+                short_description="s", long_description="l",
+            )
+
+    def test_database_value_matches_python(self):
+        for product in Product.objects.all():
+            self.assertEqual(product.final_price, product.get_discounted_price())
+        self.assertEqual(Product.objects.get(slug='beech-blocks').final_price, Decimal('22.22'))
+
+    def test_updates_recompute_the_column(self):
+        Product.objects.filter(slug='oak-blocks').update(discount_percent=Decimal('50.00'))
+        self.assertEqual(Product.objects.get(slug='oak-blocks').final_price, Decimal('30.00'))
+
+    def test_sort_and_range_filter(self):
+        response = self.client.get('/api/v1/products/list/', {'sort': 'final_price', 'fields': 'slug'})
+        self.assertEqual(
+            [r['slug'] for r in response.data['results']], ['beech-blocks', 'birch-blocks', 'oak-blocks', 'pine-blocks']
+        )
+        response = self.client.get('/api/v1/products/list/', {
+            'sort': '-final_price', 'min_price': '40.01', 'max_price': '70', 'fields': 'slug,final_price',
+        })
+        self.assertEqual(response.data['results'], [
+            {'slug': 'pine-blocks', 'final_price': '70.00'}, {'slug': 'oak-blocks', 'final_price': '60.00'},
+        ])
+
+    def test_cursor_walk_by_final_price(self):
+        slugs, cursor = [], ''
+        while cursor is not None:
+            data = self.client.get('/api/v1/products/list/', {'sort': '-final_price', 'size': 3, 'cursor': cursor}).data
+            slugs += [r['slug'] for r in data['results']]
+            cursor = data['next']
+        self.assertEqual(slugs, ['pine-blocks', 'oak-blocks', 'birch-blocks', 'beech-blocks'])
+
+    @override_settings(PRODUCT_READ_MODEL=True)
+    def test_read_model_sorts_and_filters_the_same(self):
+        response = self.client.get('/api/v1/products/list/', {'sort': 'final_price', 'max_price': '40', 'fields': 'slug'})
+        self.assertEqual([r['slug'] for r in response.data['results']], ['beech-blocks', 'birch-blocks'])
+
+
+class ProductCountCacheTests(ProductAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = create_catalog(5, images_per_product=0, features_per_product=0)
+
+    def test_count_is_cached_between_requests(self):
+        self.client.get('/api/v1/products/list/', {'fields': 'id'})
+        # The second request only loads the page
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/products/list/', {'fields': 'id', 'page': 2, 'size': 2})
+        self.assertEqual(response.data['count'], 5)
+        self.assertTrue(response.data['count_exact'])
+
+    def test_product_writes_invalidate_cached_count(self):
+        self.client.get('/api/v1/products/list/')
+        self.products[0].delete()
+        response = self.client.get('/api/v1/products/list/')
+        self.assertEqual(response.data['count'], 4)
+
+        Product.objects.create(
+            name="Rocking Horse", slug="rocking-horse", short_description="s", long_description="l", price=Decimal('50.00')
+        )
+        response = self.client.get('/api/v1/products/list/')
+        self.assertEqual(response.data['count'], 5)
+
+    def test_approximate_count_falls_back_to_exact_without_statistics(self):
+        # SQLite keeps no row statistics, so the exact (cached) count is returned
+        response = self.client.get('/api/v1/products/list/', {'count': 'approximate'})
+        self.assertEqual(response.data['count'], 5)
+        self.assertTrue(response.data['count_exact'])
+
+
+class ProductDetailCacheTests(ProductAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = create_catalog(2, images_per_product=1, features_per_product=1)
+
+    def setUp(self):
+        super().setUp()
+        self.product = Product.objects.get(pk=self.products[0].pk)
+        self.url = f'/api/v1/products/{self.product.slug}/'
+
+    def test_repeat_reads_and_revalidation_skip_the_database(self):
+        first = self.client.get(self.url)
+        etag = first['ETag']
+        self.assertTrue(etag.startswith('"'))
+
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual((second.data, second['ETag']), (first.data, etag))
+
+        with self.assertNumQueries(0):
+            not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], etag)
+
+    def test_fieldsets_are_cached_separately(self):
+        self.client.get(self.url)
+        response = self.client.get(self.url, {'fields': 'id,name'})
+        self.assertEqual(set(response.data), {'id', 'name'})
+
+    def test_product_writes_invalidate_detail(self):
+        etag = self.client.get(self.url)['ETag']
+        self.product.price = Decimal('1.00')
+        self.product.save()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['price'], '1.00')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_image_and_feature_writes_invalidate_detail(self):
+        self.client.get(self.url)
+        ProductFeature.objects.create(product=self.product, feature_name="Material", feature_value="Beech")
+        self.assertEqual(len(self.client.get(self.url).data['features']), 2)
+
+        self.product.images.all().delete()
+        self.assertEqual(self.client.get(self.url).data['images'], [])
+
+    def test_renamed_slug_is_invalidated(self):
+        self.client.get(self.url)
+        self.product.slug = 'renamed-toy'
+        self.product.save()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertEqual(self.client.get('/api/v1/products/renamed-toy/').status_code, 200)
+
+    def test_deleted_product_is_gone(self):
+        self.client.get(self.url)
+        self.product.delete()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class ProductSearchTests(ProductAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(3, images_per_product=0, features_per_product=0)
+        cls.puzzle = Product.objects.create(
+            name="Oak Jigsaw Puzzle", slug="oak-jigsaw-puzzle", price=Decimal('30.00'),
+            short_description="A 500 piece puzzle.", long_description="Cut from solid oak.",
+        )
+        cls.train = Product.objects.create(
+            name="Toy Train", slug="toy-train", price=Decimal('45.00'),
+            short_description="Pull-along train.", long_description="Comes with a tiny oak puzzle inside.",
+        )
+        ProductFeature.objects.create(product=cls.train, feature_name="Material", feature_value="Beech")
+
+    def search(self, **params):
+        response = self.client.get('/api/v1/products/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_name_matches_rank_above_description_matches(self):
+        data = self.search(q='oak puzzle')
+        self.assertEqual([r['slug'] for r in data['results']], ['oak-jigsaw-puzzle', 'toy-train'])
+        self.assertGreater(data['results'][0]['relevance'], data['results'][1]['relevance'])
+
+    def test_feature_values_are_searchable_and_kept_current(self):
+        self.assertEqual([r['slug'] for r in self.search(q='beech')['results']], ['toy-train'])
+        ProductFeature.objects.filter(product=self.train).first().delete()
+        self.assertEqual(self.search(q='beech')['count'], 0)
+
+    def test_deleting_product_with_features(self):
+        ProductFeature.objects.create(product=self.train, feature_name="Colour", feature_value="Red")
+        self.train.delete()
+        self.assertEqual(self.search(q='train')['count'], 0)
+        self.assertFalse(Product.objects.filter(slug='toy-train').exists())
+
+    def test_updates_and_deletes_reach_the_index(self):
+        self.puzzle.name = "Walnut Jigsaw"
+        self.puzzle.save()
+        self.assertEqual([r['slug'] for r in self.search(q='walnut')['results']], ['oak-jigsaw-puzzle'])
+        self.puzzle.delete()
+        self.assertEqual(self.search(q='walnut')['count'], 0)
+
+    def test_rebuild_indexes_bulk_loaded_products(self):
+        self.assertEqual(self.search(q='wooden')['count'], 0)
+        rebuild_index()
+        data = self.search(q='wooden', size=2, fields='slug')
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(set(data['results'][0]), {'slug', 'relevance'})
+
+    def test_query_is_required(self):
+        self.assertEqual(self.client.get('/api/v1/products/search/').status_code, 400)
+
+
+class ProductFacetTests(ProductAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        def make(name, brand, theme, price, discount='0'):
+            return Product.objects.create(
+                name=name, slug=name.lower().replace(' ', '-'), brand=brand, theme=theme, genre='Puzzle',
+                short_description="s", long_description="l", price=Decimal(price), discount_percent=Decimal(discount),
+            )
+        cls.cube = make("Cube", 'Acme', 'Classic', '20.00')
+        cls.maze = make("Maze", 'Acme', 'Modern', '60.00', discount='50')  # final 30.00
+        cls.ark = make("Ark", 'Woodcraft', 'Classic', '120.00')
+
+    def facet(self, data, name):
+        return {(row.get('value', row.get('bucket'))): row['count'] for row in data[name]}
+
+    def test_filters_use_final_price(self):
+        response = self.client.get('/api/v1/products/list/', {'min_price': '25', 'max_price': '50'})
+        self.assertEqual([r['slug'] for r in response.data['results']], ['maze'])
+        response = self.client.get('/api/v1/products/list/', {'price_bucket': '1'})
+        self.assertEqual([r['slug'] for r in response.data['results']], ['maze'])
+
+    def test_brand_and_theme_filters(self):
+        response = self.client.get('/api/v1/products/list/', {'brand': 'Acme', 'theme': 'Classic,Modern'})
+        self.assertEqual(response.data['count'], 2)
+
+    def test_filters_in_post_body(self):
+        response = self.client.post('/api/v1/products/list/', {'brand': ['Acme'], 'price_bucket': [1]}, format='json')
+        self.assertEqual([r['slug'] for r in response.data['results']], ['maze'])
+
+    def test_malformed_filters_in_post_body_are_rejected(self):
+        for body in ({'brand': 5}, {'theme': {'Classic': 1}}, {'genre': [['Puzzle']]}, {'price_bucket': True},
+                     {'min_price': [25]}, {'max_price': {'value': 50}}, {'min_price': 'NaN'}):
+            response = self.client.post('/api/v1/products/list/', body, format='json')
+            self.assertEqual(response.status_code, 400, body)
+
+    def test_facet_counts_ignore_own_dimension(self):
+        data = self.client.get('/api/v1/products/facets/', {'brand': 'Acme'}).data
+        self.assertEqual(self.facet(data, 'brand'), {'Acme': 2, 'Woodcraft': 1})
+        self.assertEqual(self.facet(data, 'theme'), {'Classic': 1, 'Modern': 1})
+        self.assertEqual(self.facet(data, 'price'), {0: 1, 1: 1})
+
+    def test_facets_follow_product_writes(self):
+        self.maze.discount_percent = Decimal('0')
+        self.maze.save()
+        self.ark.delete()
+        data = self.client.get('/api/v1/products/list/', {'facets': 'true'}).data['facets']
+        self.assertEqual(self.facet(data, 'price'), {0: 1, 2: 1})
+        self.assertEqual(self.facet(data, 'brand'), {'Acme': 2})
+
+    def test_edits_are_not_filtered_by_their_body(self):
+        self.client.force_authenticate(User.objects.create_user(username='editor', password='pw', is_staff=True))
+        response = self.client.patch(f'/api/v1/products/{self.cube.slug}/', {'brand': 'Other'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.patch(f'/api/v1/products/{self.cube.slug}/', {'theme': 'Space'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.cube.refresh_from_db()
+        self.assertEqual((self.cube.brand, self.cube.theme), ('Other', 'Space'))
+
+    def test_price_ranges_inside_a_bucket_count_matching_products(self):
+        # Only Maze (30.00) is in range; by whole buckets Ark (120.00, bucket 100-250) would count too
+        params = {'min_price': '28', 'max_price': '100', 'facets': 'true'}
+        response = self.client.get('/api/v1/products/list/', params)
+        self.assertEqual(response.data['count'], 1)
+        data = response.data['facets']
+        self.assertEqual(self.facet(data, 'brand'), {'Acme': 1})
+        self.assertEqual(self.facet(data, 'theme'), {'Modern': 1})
+        # The price dimension ignores the price range, like every dimension ignores its own filter
+        self.assertEqual(self.facet(data, 'price'), {0: 1, 1: 1, 3: 1})
+
+        data = self.client.get('/api/v1/products/facets/', {'min_price': '31'}).data
+        self.assertEqual(self.facet(data, 'brand'), {'Woodcraft': 1})
+
+    def test_facet_counts_do_not_touch_product_table(self):
+        with self.assertNumQueries(4):
+            data = self.client.get('/api/v1/products/facets/').data
+        self.assertEqual(self.facet(data, 'genre'), {'Puzzle': 3})
+        with self.assertNumQueries(0):
+            self.client.get('/api/v1/products/facets/')
+
+        # Price ranges inside a bucket are counted from the summary too
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get('/api/v1/products/facets/', {'min_price': '28', 'max_price': '100'}).data
+        self.assertEqual(self.facet(data, 'brand'), {'Acme': 1})
+        self.assertFalse([query['sql'] for query in queries if 'FROM "products_product"' in query['sql']])
+
+
+class ProductImportTests(ProductAPITestCase):
+
+    CSV = (
+        "name,slug,brand,short_description,long_description,theme,genre,price,discount_percent,stock_quantity,features,images\n"
+        "Stacking Rings,,Acme,Rings,Beech stacking rings,Classic,Stacker,12.50,,30,Material=Beech;Age=1+,product_images/rings.jpg\n"
+        "Puzzle Box,puzzle-box,Acme,Box,A tricky box,,Puzzle,40.00,10,5,,\n"
+        "Broken Row,,Acme,Bad,Bad price,,,not-a-price,,,,\n"
+        "Stacking Rings,,Acme,Dup,Duplicate name,,,9.00,,,,\n"
+    )
+
+    def run_import(self, content, suffix='.csv', **options):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, f'catalog{suffix}')
+        with open(path, 'w') as f:
+            f.write(content)
+        out = StringIO()
+        call_command('import_products', path, stdout=out, **options)
+        with open(f'{path}.rejects.jsonl') as f:
+            rejects = [json.loads(line) for line in f]
+        return out.getvalue(), rejects
+
+    def test_csv_import_with_relations_and_rejects(self):
+        output, rejects = self.run_import(self.CSV)
+        self.assertIn("2 products created, 0 updated, 2 rejected", output)
+        self.assertEqual([reject['line'] for reject in rejects], [4, 5])
+        self.assertIn('price', rejects[0]['errors'])
+
+        rings = Product.objects.get(slug='stacking-rings')
+        self.assertEqual(rings.stock_quantity, 30)
+        self.assertEqual(
+            dict(rings.features.values_list('feature_name', 'feature_value')), {'Material': 'Beech', 'Age': '1+'}
+        )
+        self.assertTrue(rings.images.get().is_main)
+
+        # Search, facets and counts were refreshed for the bulk-loaded rows
+        self.assertEqual(self.client.get('/api/v1/products/search/', {'q': 'beech'}).data['count'], 1)
+        brands = self.client.get('/api/v1/products/facets/').data['brand']
+        self.assertEqual(brands, [{'value': 'Acme', 'count': 2}])
+
+    def test_imports_move_facet_counts_without_a_rebuild(self):
+        self.run_import(self.CSV)
+        rows = [
+            {'slug': 'puzzle-box', 'brand': 'Woodcraft', 'price': '19.99'},
+            {'name': 'Peg Board', 'short_description': 's', 'long_description': 'l', 'price': '40.00', 'brand': 'Acme'},
+        ]
+        with mock.patch('products.facets.rebuild_facet_summary') as rebuild:
+            self.run_import(''.join(json.dumps(row) + '\n' for row in rows), suffix='.jsonl')
+        rebuild.assert_not_called()
+
+        def summary():
+            return sorted(
+                ProductFacetSummary.objects.filter(product_count__gt=0)
+                .values_list('brand', 'theme', 'genre', 'final_price', 'price_bucket', 'product_count')
+            )
+        incremental = summary()
+        rebuild_facet_summary()
+        self.assertEqual(incremental, summary())
+        self.assertEqual(
+            self.client.get('/api/v1/products/facets/').data['brand'],
+            [{'value': 'Acme', 'count': 2}, {'value': 'Woodcraft', 'count': 1}],
+        )
+
+    def test_rows_update_existing_products(self):
+        create_catalog(1, images_per_product=1, features_per_product=2)
+        existing = Product.objects.get()
+        url = f'/api/v1/products/{existing.slug}/'
+        self.client.get(url)
+
+        row = {
+            'name': existing.name, 'short_description': 's', 'long_description': 'l', 'price': '5.00',
+            'features': {'Finish': 'Oiled'},
+        }
+        output, rejects = self.run_import(json.dumps(row) + '\n', suffix='.jsonl', chunk_size=1)
+        self.assertIn("0 products created, 1 updated", output)
+        self.assertEqual(rejects, [])
+
+        detail = self.client.get(url).data
+        self.assertEqual(detail['price'], '5.00')
+        self.assertEqual([feature['feature_name'] for feature in detail['features']], ['Finish'])
+        # Images were not part of the row, so they are kept
+        self.assertEqual(len(detail['images']), 1)
+
+    def test_partial_rows_keep_the_columns_they_leave_out(self):
+        product = Product.objects.create(
+            name="Marble Run", slug="marble-run", brand="Acme", theme="Classic", short_description="s",
+            long_description="l", price=Decimal('30.00'), discount_percent=10, stock_quantity=12,
+        )
+        rows = [
+            {'slug': 'marble-run', 'price': '25.00'},
+            {'slug': 'missing', 'price': '1.00'},
+        ]
+        output, rejects = self.run_import(''.join(json.dumps(row) + '\n' for row in rows), suffix='.jsonl')
+        self.assertIn("0 products created, 1 updated, 1 rejected", output)
+        # A new product still needs every required column
+        self.assertIn('name', rejects[0]['errors'])
+
+        product.refresh_from_db()
+        self.assertEqual(product.price, Decimal('25.00'))
+        self.assertEqual(
+            (product.name, product.brand, product.theme, product.discount_percent, product.stock_quantity),
+            ("Marble Run", "Acme", "Classic", 10, 12),
+        )
+
+    def test_imported_images_get_derivatives_and_replaced_ones_lose_them(self):
+        from django.core.files.storage import default_storage
+
+        with self.settings(PRODUCT_IMAGE_DERIVATIVES='inline', MEDIA_ROOT=tempfile.mkdtemp()):
+            name = default_storage.save('product_images/imported.png', make_image_file())
+            row = {'name': 'Imported Toy', 'short_description': 's', 'long_description': 'l', 'price': '5.00', 'images': [name]}
+            self.run_import(json.dumps(row) + '\n', suffix='.jsonl')
+            derivatives = ProductImage.objects.get().derivatives
+            self.assertEqual(derivatives['source'], name)
+
+            # Replacing the images deletes the variants of the old ones
+            row['images'] = [default_storage.save('product_images/replacement.png', make_image_file())]
+            with self.captureOnCommitCallbacks(execute=True):
+                self.run_import(json.dumps(row) + '\n', suffix='.jsonl')
+            self.assertIn('replacement', ProductImage.objects.get().derivatives['source'])
+            for path in derivatives['variants']['jpeg'].values():
+                self.assertFalse(default_storage.exists(path))
+
+    @override_settings(PRODUCT_IMPORT_MAX_UPLOAD_SIZE=100)
+    def test_upload_endpoint_refuses_large_files(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass12345')
+        self.client.force_authenticate(admin)
+        upload = SimpleUploadedFile('catalog.csv', self.CSV.encode())
+        response = self.client.post('/api/v1/products/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(Product.objects.exists())
+
+    def test_generated_slugs_are_deduplicated(self):
+        Product.objects.create(name="Toy Box Deluxe", slug="toy-box", short_description="s", long_description="l", price=Decimal('1.00'))
+        rows = [
+            {'name': 'Toy Box', 'short_description': 's', 'long_description': 'l', 'price': '2.00'},
+            {'name': 'Toy-Box', 'short_description': 's', 'long_description': 'l', 'price': '3.00'},
+        ]
+        self.run_import(''.join(json.dumps(row) + '\n' for row in rows), suffix='.jsonl')
+        self.assertEqual(
+            dict(Product.objects.values_list('name', 'slug')),
+            {'Toy Box Deluxe': 'toy-box', 'Toy Box': 'toy-box-2', 'Toy-Box': 'toy-box-3'},
+        )
+
+    def test_upload_endpoint_is_admin_only(self):
+        upload = lambda: SimpleUploadedFile('catalog.csv', self.CSV.encode())
+        response = self.client.post('/api/v1/products/import/', {'file': upload()}, format='multipart')
+        self.assertIn(response.status_code, (401, 403))
+
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass12345')
+        self.client.force_authenticate(admin)
+        response = self.client.post('/api/v1/products/import/', {'file': upload()}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['rejected']), (2, 2))
+        self.assertEqual([reject['line'] for reject in response.data['rejects']], [4, 5])
+
+
+class ProductExportTests(ProductAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = create_catalog(7, images_per_product=2, features_per_product=2)
+        cls.admin = User.objects.create_superuser('exporter', 'exporter@example.com', 'pass12345')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.admin)
+
+    def export(self, **params):
+        response = self.client.get('/api/v1/products/export/', params)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_ndjson_export(self):
+        response, body = self.export()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        records = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([record['slug'] for record in records], [product.slug for product in sorted(self.products, key=lambda p: p.pk)])
+        first = records[0]
+        self.assertEqual(first['features'], {'Feature 0': 'Value 0', 'Feature 1': 'Value 1'})
+        self.assertTrue(first['main_image'].startswith('http://testserver/'))
+        self.assertTrue(first['main_image'].endswith('-0.jpg'))
+        self.assertEqual(first['final_price'], '90.00')
+
+    def test_csv_export(self):
+        response, body = self.export(output='csv', brand='Acme')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(StringIO(body)))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(json.loads(rows[0]['features'])['Feature 1'], 'Value 1')
+
+    @mock.patch('products.export.CHUNK_SIZE', 3)
+    def test_queries_grow_per_chunk_not_per_product(self):
+        response = self.client.get('/api/v1/products/export/')
+        # 3 chunks (3 + 3 + 1 products) x (products + features + images)
+        with self.assertNumQueries(9):
+            lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(len(lines), 7)
+
+    def test_incremental_export(self):
+        response, _ = self.export()
+        since = response['X-Export-Started-At']
+        changed = Product.objects.get(pk=self.products[3].pk)
+        changed.stock_quantity = 1
+        changed.save()
+
+        _, body = self.export(updated_since=since)
+        self.assertEqual([json.loads(line)['slug'] for line in body.splitlines()], [changed.slug])
+        self.assertEqual(self.client.get('/api/v1/products/export/', {'updated_since': 'yesterday'}).status_code, 400)
+
+    def test_incremental_export_includes_stock_reservations(self):
+        from cart.models import Cart
+        from cart.reservations import release_expired_reservations, reserve
+
+        cart = Cart.objects.create(user=self.admin)
+        product = self.products[2]
+        for move in (
+            lambda: reserve(cart, product.pk, 2),
+            lambda: reserve(cart, product.pk, 1),
+            lambda: release_expired_reservations(now=timezone.now() + timedelta(days=1)),
+        ):
+            since = self.export()[0]['X-Export-Started-At']
+            move()
+            _, body = self.export(updated_since=since)
+            self.assertEqual([json.loads(line)['slug'] for line in body.splitlines()], [product.slug])
+
+    def test_export_is_admin_only(self):
+        self.client.force_authenticate(None)
+        self.assertIn(self.client.get('/api/v1/products/export/').status_code, (401, 403))
+
+
+def make_image_file(name='toy.png', size=(800, 600)):
+    from PIL import Image
+
+    buffer = BytesIO()
+    Image.new('RGBA', size, (180, 120, 60, 255)).save(buffer, format='PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(PRODUCT_IMAGE_DERIVATIVES='inline')
+class ProductImageDerivativeTests(ProductAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = create_catalog(1, images_per_product=0, features_per_product=0)[0]
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.media_root = media_root
+
+    def upload(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ProductImage.objects.create(product=self.product, image=make_image_file(**kwargs), is_main=True)
+
+    def test_upload_renders_derivatives_after_commit(self):
+        image = self.upload()
+        image.refresh_from_db()
+        self.assertEqual(image.derivatives['source'], image.image.name)
+        variants = image.derivatives['variants']
+        self.assertEqual(set(variants['webp']), {'160', '320', '640'})
+        self.assertEqual(set(variants['jpeg']), {'160', '320', '640'})
+        for path in variants['webp'].values():
+            self.assertTrue(os.path.exists(os.path.join(self.media_root, path)))
+
+        srcset = self.client.get(f'/api/v1/products/{self.product.slug}/').data['images'][0]['srcset']
+        self.assertRegex(srcset['webp'], r'^http://testserver/media/\S+-160w\.webp 160w, .+ 320w, .+ 640w$')
+
+    def test_small_images_are_not_upscaled(self):
+        image = self.upload(size=(100, 80))
+        image.refresh_from_db()
+        self.assertEqual(set(image.derivatives['variants']['jpeg']), {'100'})
+
+    def test_replacing_image_drops_old_variants(self):
+        image = self.upload()
+        image.refresh_from_db()
+        old_paths = list(image.derivatives['variants']['webp'].values())
+
+        image.image = make_image_file('replacement.png')
+        with self.captureOnCommitCallbacks(execute=True):
+            image.save()
+        image.refresh_from_db()
+        self.assertIn('replacement', image.derivatives['source'])
+        for path in old_paths:
+            self.assertFalse(os.path.exists(os.path.join(self.media_root, path)))
+
+    def test_deleting_an_image_deletes_its_variants(self):
+        image = self.upload()
+        image.refresh_from_db()
+        paths = list(image.derivatives['variants']['jpeg'].values())
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        for path in paths:
+            self.assertFalse(os.path.exists(os.path.join(self.media_root, path)))
+
+    @override_settings(PRODUCT_IMAGE_DERIVATIVES='command')
+    def test_uploads_are_left_to_the_command_by_default(self):
+        image = self.upload()
+        image.refresh_from_db()
+        self.assertEqual(image.derivatives, {})
+
+        call_command('generate_image_derivatives', workers=1, stdout=StringIO())
+        image.refresh_from_db()
+        self.assertEqual(image.derivatives['source'], image.image.name)
+
+    def test_backfill_command_processes_existing_images(self):
+        from django.core.files.storage import default_storage
+
+        names = [default_storage.save(f'product_images/old-{n}.png', make_image_file()) for n in range(3)]
+        # bulk_create: no signals, like images loaded before the pipeline existed
+        ProductImage.objects.bulk_create([
+            ProductImage(product=self.product, image=name, order=n) for n, name in enumerate(names)
+        ])
+        ProductImage.objects.create(product=self.product, image='product_images/missing.png', order=9)
+
+        out = StringIO()
+        with self.assertLogs('products.images', level='ERROR'):
+            call_command('generate_image_derivatives', workers=2, stdout=out)
+        self.assertIn("Generated derivatives for 3 images (1 failed)", out.getvalue())
+        self.assertEqual(ProductImage.objects.exclude(derivatives={}).count(), 3)
+
+    def test_backfill_keeps_one_pool_and_few_originals_in_memory(self):
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+        from django.core.files.storage import default_storage
+        from . import images
+
+        names = [default_storage.save(f'product_images/old-{n}.png', make_image_file()) for n in range(4)]
+        ProductImage.objects.bulk_create([
+            ProductImage(product=self.product, image=name, order=n) for n, name in enumerate(names)
+        ])
+        with mock.patch(
+            'products.management.commands.generate_image_derivatives.ProcessPoolExecutor', wraps=ProcessPoolExecutor,
+        ) as pool_class:
+            call_command('generate_image_derivatives', workers=2, batch_size=1, stdout=StringIO())
+        pool_class.assert_called_once_with(max_workers=2)
+
+        # Originals are read only as renderings finish
+        held = {'now': 0, 'peak': 0}
+        read_source, store_derivatives = images._read_source, images.store_derivatives
+
+        def read(product_image):
+            held['now'] += 1
+            held['peak'] = max(held['peak'], held['now'])
+            return read_source(product_image)
+
+        def store(*args):
+            held['now'] -= 1
+            return store_derivatives(*args)
+
+        with mock.patch.object(images, '_read_source', read), mock.patch.object(images, 'store_derivatives', store), \
+                ThreadPoolExecutor(max_workers=1) as pool:
+            generated, failed = images.generate_derivatives(ProductImage.objects.all(), pool, in_flight=1)
+        self.assertEqual((generated, failed, held['peak']), (4, 0, 1))
+
+
+
+
+class ProductReadModelTests(ProductAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = create_catalog(6, images_per_product=2, features_per_product=2)
+        # create_catalog() bulk-inserts, which bypasses the document signals
+        rebuild_documents()
+
+    def get_both(self, url, params=None):
+        """Returns the response data without and with the read model."""
+        legacy = self.client.get(url, params).data
+        cache.clear()
+        with self.settings(PRODUCT_READ_MODEL=True):
+            return legacy, self.client.get(url, params).data
+
+    def test_rebuild_command_renders_every_product(self):
+        ProductDocument.objects.all().delete()
+        call_command('rebuild_product_documents', stdout=StringIO())
+        self.assertEqual(ProductDocument.objects.count(), 6)
+
+    def test_listings_match_the_serializer(self):
+        for params in ({}, {'expand': 'images,features', 'sort': '-price'}, {'fields': 'slug,final_price', 'brand': 'Acme'}):
+            legacy, served = self.get_both('/api/v1/products/list/', params)
+            self.assertEqual(served, legacy, params)
+        legacy, served = self.get_both('/api/v1/products/', {'fields': 'id,name'})
+        self.assertEqual(served, legacy)
+
+    def test_detail_matches_the_serializer(self):
+        legacy, served = self.get_both(f'/api/v1/products/{self.products[0].slug}/')
+        self.assertEqual(served, legacy)
+        self.assertTrue(served['images'][0]['image'].startswith('http://testserver/media/'))
+
+    @override_settings(PRODUCT_READ_MODEL=True)
+    def test_reads_touch_one_table(self):
+        # COUNT and page, both on the document table
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/v1/products/list/', {'expand': 'images,features'})
+        self.assertEqual(len(response.data['results']), 6)
+        with self.assertNumQueries(1):
+            self.client.get('/api/v1/products/list/', {'cursor': '', 'size': 2, 'expand': 'images'})
+        with self.assertNumQueries(1):
+            self.client.get(f'/api/v1/products/{self.products[1].slug}/')
+
+    @override_settings(PRODUCT_READ_MODEL=True)
+    def test_writes_rebuild_documents(self):
+        product = self.products[0]
+        url = f'/api/v1/products/{product.slug}/'
+        product.price = Decimal('5.00')
+        product.save()
+        ProductFeature.objects.create(product=product, feature_name="Material", feature_value="Beech")
+        product.images.filter(order=1).delete()
+
+        data = self.client.get(url).data
+        self.assertEqual(data['price'], '5.00')
+        self.assertEqual(len(data['features']), 3)
+        self.assertEqual(len(data['images']), 1)
+
+        product.delete()
+        self.assertFalse(ProductDocument.objects.filter(pk=product.pk).exists())
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_failed_write_rolls_back_the_document(self):
+        product = self.products[0]
+        try:
+            with transaction.atomic():
+                ProductFeature.objects.create(product=product, feature_name="Material", feature_value="Beech")
+                raise DatabaseError
+        except DatabaseError:
+            pass
+        self.assertEqual(len(ProductDocument.objects.get(pk=product.pk).data['features']), 2)
+
+    def test_imports_refresh_documents(self):
+        rows = [{'name': 'Balance Board', 'short_description': 's', 'long_description': 'l', 'price': '40.00',
+                 'features': {'Material': 'Birch'}}]
+        ProductImporter().run((n, row, None) for n, row in enumerate(rows, start=1))
+        document = ProductDocument.objects.get(slug='balance-board')
+        self.assertEqual(document.data['features'][0]['feature_value'], 'Birch')
+
+
+class ProductAsyncViewTests(ProductAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = create_catalog(12, images_per_product=1, features_per_product=1)
+
+    async def test_list_matches_sync_endpoint(self):
+        params = {'page': 2, 'size': 5, 'sort': '-price', 'brand': 'Acme'}
+        response = await self.async_client.get('/api/v1/async/products/', params)
+        self.assertEqual(response.status_code, 200)
+        expected = await sync_to_async(self.client.get)('/api/v1/products/list/', params)
+        self.assertEqual(response.json(), json.loads(expected.content))
+
+    async def test_count_and_facet_options_match_sync_endpoint(self):
+        for params in ({'count': 'approximate', 'facets': 'true'}, {'cursor': '', 'facets': '1', 'brand': 'Acme'}):
+            response = await self.async_client.get('/api/v1/async/products/', params)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('facets', response.json())
+            expected = await sync_to_async(self.client.get)('/api/v1/products/list/', params)
+            self.assertEqual(response.json(), json.loads(expected.content), params)
+
+    async def test_cursor_mode_walks_whole_catalog(self):
+        slugs, cursor = [], ''
+        while cursor is not None:
+            response = await self.async_client.get('/api/v1/async/products/', {'size': 5, 'cursor': cursor, 'fields': 'slug'})
+            data = response.json()
+            slugs += [item['slug'] for item in data['results']]
+            cursor = data['next']
+        self.assertEqual(slugs, [p.slug for p in self.products])
+
+    async def test_invalid_parameters_are_rejected(self):
+        for params in ({'fields': 'nope'}, {'sort': 'nope'}, {'size': 0}, {'cursor': 'not-a-cursor'}):
+            response = await self.async_client.get('/api/v1/async/products/', params)
+            self.assertEqual(response.status_code, 400, params)
+
+    async def test_detail_shares_cache_and_etag_with_sync_endpoint(self):
+        slug = self.products[0].slug
+        sync_response = await sync_to_async(self.client.get)(f'/api/v1/products/{slug}/')
+        etag = sync_response['ETag']
+
+        response = await self.async_client.get(f'/api/v1/async/products/{slug}/')
+        self.assertEqual(response.json(), json.loads(sync_response.content))
+        self.assertEqual(response['ETag'], etag)
+
+        not_modified = await self.async_client.get(f'/api/v1/async/products/{slug}/', headers={'If-None-Match': etag})
+        self.assertEqual(not_modified.status_code, 304)
+
+        missing = await self.async_client.get('/api/v1/async/products/no-such-toy/')
+        self.assertEqual(missing.status_code, 404)
+
+    async def test_search_ranks_matches(self):
+        # create_catalog() bulk-inserts, which bypasses the index signals
+        await sync_to_async(rebuild_index)()
+        response = await self.async_client.get('/api/v1/async/products/search/', {'q': 'wooden toy 0003'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['slug'], 'wooden-toy-0003')
+
+        response = await self.async_client.get('/api/v1/async/products/search/')
+        self.assertEqual(response.status_code, 400)
 
-# Create your tests here.
+    async def test_writes_are_not_allowed(self):
+        response = await self.async_client.post('/api/v1/async/products/')
+        self.assertEqual(response.status_code, 405)
@@ -0,0 +1,11 @@
+from django.urls import path
+
+from . import async_views
+
+# Async (ASGI) catalog read endpoints, mounted under /api/v1/async/products/
+urlpatterns = [
+    path('', async_views.product_list, name='async-product-list'),
+    # Before the slug route, which would otherwise match 'search'
+    path('search/', async_views.product_search, name='async-product-search'),
+    path('<slug:slug>/', async_views.product_detail, name='async-product-detail'),
+]
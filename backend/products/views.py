@@ -1,25 +1,187 @@
+import io
+
 from rest_framework import viewsets, status
+from rest_framework.permissions import IsAdminUser
+from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from .models import Product
+from rest_framework.exceptions import ValidationError
+from .models import Product, ProductDocument
 from .serializers import ProductSerializer 
+from .pagination import KeysetPaginator, InvalidCursor
+from .cache import (
+    get_cached_count, estimate_table_count, get_product_version, detail_variant, detail_cache_key, make_etag, etag_matches,
+)
+from .search import search_products
+from .filters import ProductFilterBackend, parse_product_filters
+from .facets import get_facet_counts
+from .importer import ProductImporter, detect_format, read_rows
+from .export import iter_products, STREAMERS, CONTENT_TYPES
+from .read_model import read_model_enabled, present_document
 import rest_framework
+from django.conf import settings
+from django.core.cache import cache
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 # Import necessary utilities for slug generation and database error handling
 from django.utils.text import slugify 
 from django.db import IntegrityError
 from django.core.exceptions import ValidationError as DjangoValidationError
 
 
+def requested_fieldset(source):
+    """
+    Reads ?fields= / ?expand= (comma separated strings, or lists in a JSON body) and returns the
+    fieldset to render, or None for the full representation. Raises ValidationError on unknown fields.
+    """
+    def parse(key):
+        value = source.get(key)
+        if value is None:
+            return None
+        if isinstance(value, str):
+            value = value.split(',')
+        elif not isinstance(value, list) or not all(isinstance(name, str) for name in value):
+            raise ValidationError({"detail": f"'{key}' must be a comma separated string or a list of field names."})
+        return [name.strip() for name in value]
+
+    try:
+        return ProductSerializer.resolve_fieldset(parse('fields'), parse('expand'))
+    except ValueError as e:
+        raise ValidationError({"detail": f"Unknown or non-expandable fields requested: {', '.join(e.args[0])}."})
+
+
+def load_for_fieldset(queryset, fields, extra_columns=()):
+    """
+    Restricts a product queryset to the columns and relations a (sparse) fieldset renders.
+    Images and features are fetched with one query each, whatever the page size.
+    """
+    if fields is None:
+        return queryset.prefetch_related('images', 'features')
+
+    queryset = queryset.only(*ProductSerializer.columns_for(fields), *extra_columns)
+    relations = [name for name in ('images', 'features') if name in fields]
+    if relations:
+        queryset = queryset.prefetch_related(*relations)
+    return queryset
+
+
 class ProductViewSet(viewsets.ModelViewSet):
     """
     A ViewSet for viewing and editing Product instances.
     Provides standard CRUD operations (Create, Read, Update, Delete) via API,
     plus a custom 'list_products' endpoint for POST-based pagination.
+
+    Read actions accept sparse fieldsets: ?fields=id,name,slug renders only those
+    fields and ?expand=images,features adds the heavy nested relations on top.
+    Listings accept the storefront filters brand/theme/genre/price_bucket/min_price/max_price.
+    Related rows are always prefetched, so the number of queries does not grow
+    with the page size.
+
+    Product detail responses are cached per slug and carry a strong ETag; a matching
+    If-None-Match is answered with 304 Not Modified straight from the cache.
+
+    With PRODUCT_READ_MODEL enabled, list, list_products and retrieve read the pre-rendered
+    ProductDocument rows instead (one table, no joins, no nested serializers).
     """
     # Only show available products by default, unless the user is an admin
     queryset = Product.objects.all().order_by('name') 
     serializer_class = ProductSerializer
     lookup_field = 'slug'
+    filter_backends = [ProductFilterBackend]
+
+    # Listings narrowed by the storefront filters (detail reads and writes look products up by slug only)
+    product_filter_actions = ('list', 'list_products', 'export')
+
+    # Actions that render products and therefore honour ?fields= / ?expand=
+    sparse_fieldset_actions = ('list', 'retrieve', 'list_products', 'search')
+
+    # Actions served from ProductDocument when PRODUCT_READ_MODEL is enabled
+    read_model_actions = ('list', 'retrieve', 'list_products')
+
+    def serves_documents(self):
+        """True when the current action reads pre-rendered documents instead of the product tables."""
+        return self.action in self.read_model_actions and read_model_enabled()
+
+    def get_requested_fields(self):
+        """
+        Returns the sparse fieldset requested by the client, or None for the full representation.
+        Values may be comma separated strings (query params) or lists (JSON body).
+        """
+        if self.action not in self.sparse_fieldset_actions:
+            return None
+
+        if not hasattr(self, '_requested_fields'):
+            source = self.request.query_params if self.request.method == 'GET' else self.request.data
+            self._requested_fields = requested_fieldset(source)
+        return self._requested_fields
+
+    def get_queryset(self):
+        """
+        Loads only the columns and relations the response needs.
+        Images and features are fetched with one query each, whatever the page size.
+        """
+        if self.serves_documents():
+            # Same filter and sort columns as Product, so the filter backend and paginator apply unchanged
+            return ProductDocument.objects.order_by('name')
+        # Keyset cursors are built from the sort column, so list_products loads the sortable columns too
+        extra_columns = KeysetPaginator.SORT_KEYS.values() if self.action == 'list_products' else ()
+        return load_for_fieldset(super().get_queryset(), self.get_requested_fields(), extra_columns)
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_requested_fields()
+        if fields is not None:
+            kwargs.setdefault('fields', fields)
+        return super().get_serializer(*args, **kwargs)
+
+    def render_products(self, products):
+        """Representation of a page of products, or of product documents for the read model actions."""
+        if self.serves_documents():
+            fields = self.get_requested_fields()
+            return [present_document(document.data, fields, self.request) for document in products]
+        return self.get_serializer(products, many=True).data
+
+    def list(self, request, *args, **kwargs):
+        if not self.serves_documents():
+            return super().list(request, *args, **kwargs)
+        return Response(self.render_products(self.filter_queryset(self.get_queryset())), status=status.HTTP_200_OK)
+
+    def get_sort(self):
+        """Returns the validated ?sort= key for list_products (e.g. 'name', '-final_price')."""
+        source = self.request.query_params if self.request.method == 'GET' else self.request.data
+        sort = source.get('sort') or KeysetPaginator.DEFAULT_SORT
+        if not isinstance(sort, str) or sort.lstrip('-') not in KeysetPaginator.SORT_KEYS:
+            raise ValidationError({
+                "detail": f"'sort' must be one of: {', '.join(KeysetPaginator.SORT_KEYS)} (prefix with '-' for descending)."
+            })
+        return sort
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Product detail, served from the cache until the product, its images or its features change.
+        Cache hits (200 or 304) do not touch the database.
+        """
+        slug = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        # Read the version before loading the product: a write landing in between bumps it,
+        # so what we render below can never be stored under the new version
+        key = detail_cache_key(slug, get_product_version(slug), detail_variant(request, self.get_requested_fields()))
+
+        cached = cache.get(key)
+        if cached is None:
+            if self.serves_documents():
+                data = present_document(self.get_object().data, self.get_requested_fields(), request)
+            else:
+                data = super().retrieve(request, *args, **kwargs).data
+            cached = {'etag': make_etag(data), 'data': data}
+            cache.set(key, cached, getattr(settings, 'PRODUCT_DETAIL_CACHE_TIMEOUT', 3600))
+
+        if etag_matches(request.headers.get('If-None-Match'), cached['etag']):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(cached['data'], status=status.HTTP_200_OK)
+        response['ETag'] = cached['etag']
+        return response
+
     # Override the main 'create' method to catch validation errors explicitly
     # and return 400 Bad Request, preventing a hidden exception leading to 500.
     def create(self, request, *args, **kwargs):
@@ -65,6 +227,18 @@ class ProductViewSet(viewsets.ModelViewSet):
         - For POST: accept JSON body {"page": <int>, "size": <int>}.
         - For GET: accept query params ?page=<int>&size=<int>.
         Defaults: page=1, size=10. Both must be integers >= 1.
+
+        Optional 'sort' (name, price, final_price, created_at, updated_at; '-' prefix for descending).
+
+        Cursor mode: send 'cursor' (empty for the first page) or 'pagination=cursor'.
+        Pages are then fetched by keyset instead of OFFSET and COUNT is skipped; the response
+        carries opaque 'next'/'previous' cursors to send back as 'cursor'.
+
+        Counts are cached per filter set until the next product write. Send 'count=approximate'
+        to use the database's table statistics for unfiltered listings; 'count_exact' in the
+        response tells whether the count is exact or estimated.
+
+        Send 'facets=true' to include the sidebar facet counts for the current filters.
         """
         try:
             # Use query params for GET, request.data for POST
@@ -85,9 +259,17 @@ class ProductViewSet(viewsets.ModelViewSet):
             # Handles cases where 'page' or 'size' are not valid integers
             return Response({"detail": "Both 'page' and 'size' must be valid integers."}, status=status.HTTP_400_BAD_REQUEST)
 
+        sort = self.get_sort()
+
         # Get the base queryset and apply filters if any (e.g., is_available=True)
         queryset = self.filter_queryset(self.get_queryset())
-        total_count = queryset.count()
+
+        if 'cursor' in source or source.get('pagination') == 'cursor':
+            response = self._list_products_by_cursor(queryset, source.get('cursor'), sort, page_size)
+            return self._with_facets(response, source)
+
+        queryset = queryset.order_by(*KeysetPaginator.ordering(sort))
+        total_count, count_exact = self.get_total_count(queryset, source.get('count') == 'approximate')
 
         # Calculate slicing indices for manual pagination
         start = (page_number - 1) * page_size
@@ -96,15 +278,173 @@ class ProductViewSet(viewsets.ModelViewSet):
         # Apply slicing
         paged_queryset = queryset[start:end]
 
-        # Serialize the paginated data
-        serializer = self.get_serializer(paged_queryset, many=True)
-
         # Build a standard paginated response structure
         response_data = {
             "count": total_count,
+            "count_exact": count_exact,
             "current_page": page_number,
             "page_size": page_size,
-            "results": serializer.data
+            "results": self.render_products(paged_queryset)
         }
 
+        return self._with_facets(Response(response_data, status=status.HTTP_200_OK), source)
+
+    def _with_facets(self, response, source):
+        """Adds the facet counts section to a listing response when 'facets' was requested."""
+        if response.status_code == status.HTTP_200_OK and str(source.get('facets', '')).lower() in ('1', 'true'):
+            response.data['facets'] = get_facet_counts(parse_product_filters(source))
+        return response
+
+    def get_total_count(self, queryset, approximate=False):
+        """
+        Returns (count, is_exact) for a listing queryset.
+        The approximate mode only applies to unfiltered listings; otherwise the cached exact count is used.
+        """
+        if approximate and not queryset.query.where:
+            estimate = estimate_table_count(queryset.model)
+            if estimate is not None:
+                return estimate, False
+        return get_cached_count(queryset), True
+
+    def _list_products_by_cursor(self, queryset, cursor, sort, page_size):
+        """Keyset-paginated variant of list_products (no OFFSET, no COUNT)."""
+        paginator = KeysetPaginator(queryset, sort=sort, page_size=page_size)
+        try:
+            products, next_cursor, previous_cursor = paginator.get_page(cursor)
+        except InvalidCursor as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        response_data = {
+            "next": next_cursor,
+            "previous": previous_cursor,
+            "page_size": page_size,
+            "sort": paginator.sort,
+            "results": self.render_products(products)
+        }
+        return Response(response_data, status=status.HTTP_200_OK)
+
+    # Custom Action for full-text search: GET /api/v1/products/search/?q=<text>
+    @action(detail=False, methods=['get'], url_path='search')
+    def search(self, request):
+        """
+        Relevance-ranked search over product names, descriptions and feature values.
+
+        Query params: q (required), page (default 1), size (default 10, max 100),
+        plus the usual ?fields= / ?expand= sparse fieldsets.
+        Every result carries its 'relevance' score; results are ordered best first.
+        """
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({"detail": "The 'q' parameter is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            page_number = int(request.query_params.get('page', 1))
+            page_size = int(request.query_params.get('size', 10))
+        except (ValueError, TypeError):
+            return Response({"detail": "Both 'page' and 'size' must be valid integers."}, status=status.HTTP_400_BAD_REQUEST)
+        if page_number < 1 or not 1 <= page_size <= 100:
+            return Response(
+                {"detail": "'page' must be >= 1 and 'size' between 1 and 100."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        total_count, matches = search_products(query, limit=page_size, offset=(page_number - 1) * page_size)
+        scores = dict(matches)
+
+        # Load the matched products in one query (plus prefetches) and restore the ranking order
+        products = {product.pk: product for product in self.get_queryset().filter(pk__in=scores)}
+        ranked = [products[product_id] for product_id, _ in matches if product_id in products]
+
+        results = self.get_serializer(ranked, many=True).data
+        for product, result in zip(ranked, results):
+            result['relevance'] = round(scores[product.pk], 4)
+
+        response_data = {
+            "query": query,
+            "count": total_count,
+            "current_page": page_number,
+            "page_size": page_size,
+            "results": results
+        }
         return Response(response_data, status=status.HTTP_200_OK)
+
+    # Custom Action for the storefront sidebar: GET /api/v1/products/facets/
+    @action(detail=False, methods=['get'], url_path='facets')
+    def facets(self, request):
+        """
+        Facet counts per brand, theme, genre and final-price bucket for the filters in the query
+        string. Served from the precomputed facet summary, whatever the price range.
+        """
+        return Response(get_facet_counts(parse_product_filters(request.query_params)), status=status.HTTP_200_OK)
+
+    # Admin bulk upload: POST /api/v1/products/import/ (multipart, field 'file')
+    @action(
+        detail=False, methods=['post'], url_path='import',
+        permission_classes=[IsAdminUser], parser_classes=[MultiPartParser, FormParser],
+    )
+    def import_products(self, request):
+        """
+        Creates or updates products (with features and images) from an uploaded CSV or JSONL file.
+        The format follows the file extension unless 'file_format' (csv/jsonl) is sent.
+        Invalid rows are skipped; the response reports the counts and the first rejected rows.
+        The import runs within the request, so files above PRODUCT_IMPORT_MAX_UPLOAD_SIZE are
+        refused (413); import those with `manage.py import_products`, which writes a full reject file.
+        """
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"detail": "Upload the catalog as the 'file' field."}, status=status.HTTP_400_BAD_REQUEST)
+        max_size = getattr(settings, 'PRODUCT_IMPORT_MAX_UPLOAD_SIZE', 5 * 1024 * 1024)
+        if upload.size > max_size:
+            return Response(
+                {"detail": f"Files over {max_size} bytes cannot be imported within a request; use `manage.py import_products`."},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+        file_format = request.data.get('file_format') or detect_format(upload.name)
+        if file_format not in ('csv', 'jsonl'):
+            return Response({"detail": "'file_format' must be 'csv' or 'jsonl'."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Decode the upload as a stream: large uploads stay in their temporary file
+        stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+        importer = ProductImporter()
+        stats = importer.run(read_rows(stream, file_format))
+        return Response({**stats, "rejects": importer.rejects}, status=status.HTTP_200_OK)
+
+    # Full catalog feed: GET /api/v1/products/export/?output=ndjson|csv&updated_since=<ISO 8601>
+    @action(detail=False, methods=['get'], url_path='export', permission_classes=[IsAdminUser])
+    def export(self, request):
+        """
+        Streams the whole catalog (or the storefront filters' subset) with features and the main
+        image as NDJSON (default) or CSV. Products are read in keyset chunks and written out as
+        they are read, so memory stays flat and there is no COUNT or OFFSET scan.
+
+        'updated_since' (date or datetime) limits the export to products changed since then.
+        The 'X-Export-Started-At' header is the value to send as 'updated_since' on the next pull.
+        """
+        # Not ?format=, which DRF reserves for renderer selection
+        output = request.query_params.get('output', 'ndjson')
+        if output not in STREAMERS:
+            return Response({"detail": f"'output' must be one of: {', '.join(STREAMERS)}."}, status=status.HTTP_400_BAD_REQUEST)
+
+        started_at = timezone.now()
+        queryset = self.filter_queryset(Product.objects.all())
+        updated_since = request.query_params.get('updated_since')
+        if updated_since:
+            try:
+                # Also accepts plain dates (midnight)
+                since = parse_datetime(updated_since)
+            except ValueError:
+                since = None
+            if since is None:
+                return Response({"detail": "'updated_since' must be an ISO 8601 date or datetime."}, status=status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+            queryset = queryset.filter(updated_at__gte=since)
+
+        response = StreamingHttpResponse(
+            STREAMERS[output](iter_products(queryset), request.build_absolute_uri),
+            content_type=CONTENT_TYPES[output],
+        )
+        response['Content-Disposition'] = f'attachment; filename="products.{output}"'
+        response['X-Export-Started-At'] = started_at.isoformat()
+        return response
+
@@ -0,0 +1,48 @@
+from django.conf import settings
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .cache import get_cached_user
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that resolves the token's user through users.cache instead of loading
+    the User row on every request. The user also carries the id of their cart
+    (`cached_cart_id`), so cart writes need not look it up.
+
+    With AUTH_TRUST_TOKEN_CLAIMS on, read requests to views that set
+    `token_claims_suffice = True` get a TokenUser built from the token alone: no lookup at all,
+    but a deactivated user keeps access to those views until the token expires.
+    """
+
+    def authenticate(self, request):
+        view = request.parser_context.get('view') if request.parser_context else None
+        self.trust_claims = (
+            getattr(settings, 'AUTH_TRUST_TOKEN_CLAIMS', False)
+            and request.method in SAFE_METHODS
+            and getattr(view, 'token_claims_suffice', False)
+        )
+        return super().authenticate(request)
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+
+        if self.trust_claims:
+            return api_settings.TOKEN_USER_CLASS(validated_token)
+
+        # Same checks as JWTAuthentication.get_user, against the cached row
+        user = get_cached_user(user_id)
+        if user is None:
+            raise AuthenticationFailed("User not found", code="user_not_found")
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        # The cached user has no password hash, only its digest
+        if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != user.cached_password_digest:
+            raise AuthenticationFailed("The user's password has been changed.", code="password_changed")
+        return user
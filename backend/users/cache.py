@@ -0,0 +1,92 @@
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import router, transaction
+from django.db.models import F
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+# The columns authentication and permission checks read (plus the id of the user's cart and a
+# digest of the password hash) of an authenticated user, shared by all workers through the
+# default cache. Deleted by the User and Cart signals in users/models.py.
+AUTH_USER_KEY = 'users:auth-user:{user_id}'
+
+# Cached User columns; the others are deferred and loaded on first access. Never the password
+# hash: the cache is not a place for credentials, only its digest (the revoke-token claim) is kept.
+AUTH_USER_FIELDS = ('id', 'username', 'is_active', 'is_staff', 'is_superuser')
+
+# Per-process layer in front of the shared cache: {str(user_id): (expires_at, entry)}. Other processes
+# cannot invalidate it, so its timeout bounds how long they may see a changed user.
+_local = {}
+_local_lock = threading.Lock()
+
+
+def _load_entry(user_id):
+    """Reads the user's cached columns and cart id in one query; None if there is no such user."""
+    user = User.objects.only(*AUTH_USER_FIELDS, 'password').annotate(auth_cart_id=F('cart__id')).filter(pk=user_id).first()
+    if user is None:
+        return None
+    return {
+        # In model order, which User.from_db() expects of a partial row
+        'fields': {field.attname: getattr(user, field.attname) for field in User._meta.concrete_fields if field.attname in AUTH_USER_FIELDS},
+        'cart_id': user.auth_cart_id,
+        'password_digest': get_md5_hash_password(user.password),
+    }
+
+
+def _remember_locally(user_id, entry):
+    timeout = getattr(settings, 'AUTH_USER_LOCAL_CACHE_TIMEOUT', 5)
+    if not timeout:
+        return
+    with _local_lock:
+        if len(_local) >= getattr(settings, 'AUTH_USER_LOCAL_CACHE_SIZE', 10000):
+            # Bounded memory: dropping everything is cheaper than tracking recency per hit
+            _local.clear()
+        _local[user_id] = (time.monotonic() + timeout, entry)
+
+
+def get_cached_user(user_id):
+    """
+    Returns the User with this id from the per-process layer, the shared cache or (on a miss)
+    the database, or None if it does not exist. Only AUTH_USER_FIELDS are loaded. The instance
+    carries `cached_cart_id`, the id of the user's cart (None if they have none), and
+    `cached_password_digest`, get_md5_hash_password() of its password hash.
+    """
+    # Token claims carry the id as a string, signals as an int
+    user_id = str(user_id)
+    local = _local.get(user_id)
+    if local is not None and local[0] > time.monotonic():
+        entry = local[1]
+    else:
+        key = AUTH_USER_KEY.format(user_id=user_id)
+        entry = cache.get(key)
+        if entry is None:
+            entry = _load_entry(user_id)
+            if entry is None:
+                return None
+            cache.set(key, entry, getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 60))
+        _remember_locally(user_id, entry)
+
+    fields = entry['fields']
+    user = User.from_db(router.db_for_read(User), list(fields), list(fields.values()))
+    user.cached_cart_id = entry['cart_id']
+    user.cached_password_digest = entry['password_digest']
+    return user
+
+
+def _forget(user_id):
+    user_id = str(user_id)
+    cache.delete(AUTH_USER_KEY.format(user_id=user_id))
+    with _local_lock:
+        _local.pop(user_id, None)
+
+
+def invalidate_cached_user(user_id):
+    """
+    Drops the cached user now and again once the surrounding transaction commits, so a request
+    racing the write cannot cache the old row. Called from the User and Cart signals.
+    """
+    _forget(user_id)
+    transaction.on_commit(lambda: _forget(user_id))
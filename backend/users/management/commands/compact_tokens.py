@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from users.tokens import compact_tokens
+
+
+class Command(BaseCommand):
+    help = "Deletes expired outstanding and blacklisted JWT refresh tokens in batches (schedule this hourly or daily)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Outstanding tokens examined per batch.")
+
+    def handle(self, *args, **options):
+        outstanding, blacklisted = compact_tokens(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {outstanding} expired outstanding tokens ({blacklisted} of them blacklisted)."
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from users.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the customer search entries and tokens (run after bulk loads that bypass signals)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Customers indexed per batch.")
+
+    def handle(self, *args, **options):
+        indexed = rebuild_index(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} customers."))
@@ -0,0 +1,33 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.registration import register_users
+
+
+class Command(BaseCommand):
+    help = (
+        "Registers users (with profiles) from a JSON file holding a list of registration "
+        "payloads, hashing passwords in parallel processes. Failed rows are reported by index."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="JSON file: a list of {username, email, password, ...} objects.")
+        parser.add_argument('--workers', type=int, default=None, help="Password hashing processes (default: one per CPU).")
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Users inserted per transaction.")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], encoding='utf-8') as f:
+                rows = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Cannot read {options['path']}: {e}")
+        if not isinstance(rows, list):
+            raise CommandError("The file must hold a JSON list of users.")
+
+        result = register_users(rows, chunk_size=options['chunk_size'], workers=options['workers'])
+        for row, errors in result['failed'].items():
+            self.stderr.write(f"Row {row}: {json.dumps(errors)}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Registered {len(result['created'])} users; {len(result['failed'])} rows failed."
+        ))
@@ -0,0 +1,58 @@
+from django.contrib.auth.hashers import get_hashers_by_algorithm, make_password
+from django.core.management.base import BaseCommand, CommandError
+
+from products.cache import bump_catalog_version
+from users import seeding
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates a deterministic dataset of users (with profiles and filled carts) and products "
+        "(with images and features) using bulk inserts in parallel worker processes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--images', type=int, default=2, help="Images per product.")
+        parser.add_argument('--features', type=int, default=3, help="Features per product (at most 3).")
+        parser.add_argument('--cart-items', type=int, default=3, help="Maximum items in each seeded cart.")
+        parser.add_argument('--seed', type=int, default=42, help="Random seed; the same seed gives the same data.")
+        parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: one per CPU).")
+        parser.add_argument('--chunk-size', type=int, default=10000, help="Rows inserted per worker task and transaction.")
+        parser.add_argument('--password', default='password123', help="Password of every seeded user.")
+        parser.add_argument(
+            '--hasher', default=None,
+            help="Password hasher algorithm (e.g. md5 in test settings); default is the first of PASSWORD_HASHERS.",
+        )
+        parser.add_argument('--clear', action='store_true', help="Delete previously seeded users and products first.")
+        parser.add_argument('--skip-derived', action='store_true', help="Do not rebuild the search index, facets and product documents.")
+
+    def handle(self, *args, **options):
+        hashers = get_hashers_by_algorithm()
+        if options['hasher'] and options['hasher'] not in hashers:
+            raise CommandError(f"Unknown hasher {options['hasher']!r}; PASSWORD_HASHERS provides: {', '.join(hashers)}")
+        if options['features'] > 3:
+            raise CommandError("At most 3 features per product are generated.")
+        if options['clear']:
+            seeding.clear_seed_data()
+        elif seeding.seed_exists():
+            raise CommandError("Seeded rows already exist; pass --clear to replace them.")
+
+        workers = seeding.default_workers(options['workers'])
+        # Hashed once and shared: per-user hashing would dominate the run
+        password = make_password(options['password'], hasher=options['hasher'] or 'default')
+        products, users, items = seeding.seed_dataset(
+            options['products'], options['users'], password,
+            images=options['images'], features=options['features'], cart_items=options['cart_items'],
+            seed=options['seed'], workers=workers, chunk_size=options['chunk_size'],
+            progress=lambda kind, done, total: self.stdout.write(f"{kind}: {done}/{total}"),
+        )
+
+        if not options['skip_derived']:
+            # Bulk inserts bypass the signals that keep these up to date
+            seeding.rebuild_derived()
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {products} products and {users} users with {items} cart items using {workers} worker(s)."
+        ))
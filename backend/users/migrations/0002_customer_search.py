@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_entries(apps, schema_editor):
+    """Indexes every existing customer."""
+    from users.search import ENTRY_FIELDS, entry_tokens, entry_values
+
+    Customer = apps.get_model('users', 'Customer')
+    CustomerSearchEntry = apps.get_model('users', 'CustomerSearchEntry')
+    CustomerSearchToken = apps.get_model('users', 'CustomerSearchToken')
+
+    entries, tokens = [], []
+    for customer in Customer.objects.select_related('user').iterator(chunk_size=1000):
+        entry = CustomerSearchEntry(customer_id=customer.pk, **entry_values(customer))
+        entries.append(entry)
+        tokens.extend(
+            CustomerSearchToken(token=token, entry_id=customer.pk)
+            for token in entry_tokens({field: getattr(entry, field) for field in ENTRY_FIELDS})
+        )
+        if len(entries) >= 1000:
+            CustomerSearchEntry.objects.bulk_create(entries)
+            CustomerSearchToken.objects.bulk_create(tokens, batch_size=5000, ignore_conflicts=True)
+            entries, tokens = [], []
+    CustomerSearchEntry.objects.bulk_create(entries)
+    CustomerSearchToken.objects.bulk_create(tokens, batch_size=5000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerSearchEntry',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_entry', serialize=False, to='users.customer')),
+                ('email', models.CharField(blank=True, max_length=254)),
+                ('username', models.CharField(blank=True, max_length=150)),
+                ('name', models.CharField(blank=True, max_length=301)),
+                ('phone', models.CharField(blank=True, max_length=15)),
+                ('city', models.CharField(blank=True, max_length=100)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CustomerSearchToken',
+            fields=[
+                ('pk', models.CompositePrimaryKey('token', 'entry', blank=True, editable=False, primary_key=True, serialize=False)),
+                ('token', models.CharField(max_length=3)),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tokens', to='users.customersearchentry')),
+            ],
+        ),
+        migrations.RunPython(populate_entries, migrations.RunPython.noop),
+    ]
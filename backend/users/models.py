@@ -1,5 +1,12 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from cart.models import Cart
+from . import search
+from .cache import invalidate_cached_user
+from .tokens import record_revoked
 
 class Customer(models.Model):
     """
@@ -26,3 +33,79 @@ class Customer(models.Model):
 
     def __str__(self):
         return f"Profile for {self.user.username}"
+
+class CustomerSearchEntry(models.Model):
+    """
+    Normalized (lowercase) searchable values of a customer and their user, kept current by the
+    signals below. Substring matches found through CustomerSearchToken are verified here.
+    """
+    customer = models.OneToOneField(Customer, primary_key=True, related_name='search_entry', on_delete=models.CASCADE)
+    email = models.CharField(max_length=254, blank=True)
+    username = models.CharField(max_length=150, blank=True)
+    name = models.CharField(max_length=301, blank=True)
+    # Digits only, so '+91 98765-43210' and '9876543210' find each other
+    phone = models.CharField(max_length=15, blank=True)
+    city = models.CharField(max_length=100, blank=True)
+
+    def __str__(self):
+        return f"Search entry for {self.username}"
+
+class CustomerSearchToken(models.Model):
+    """
+    Posting list of the customer search (see users/search.py): one row per distinct trigram of
+    the entry's values, plus '^'-anchored one- and two-letter prefixes. The primary key
+    (token, entry) keeps every token's customers adjacent and in id order.
+    """
+    pk = models.CompositePrimaryKey('token', 'entry')
+    token = models.CharField(max_length=3)
+    entry = models.ForeignKey(CustomerSearchEntry, related_name='tokens', on_delete=models.CASCADE)
+
+# --- Signals to drop the cached authentication user (see users/cache.py) ---
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_auth_user(sender, instance, **kwargs):
+    """
+    Signal receiver to drop the cached user whenever the user is saved (profile edits,
+    deactivation, password changes, logins) or deleted.
+    """
+    invalidate_cached_user(instance.pk)
+
+@receiver(post_save, sender=Cart)
+@receiver(post_delete, sender=Cart)
+def invalidate_cached_auth_cart(sender, instance, signal, created=False, **kwargs):
+    """Signal receiver to drop the cart id cached with the user when their cart is created or deleted."""
+    if created or signal is post_delete:
+        invalidate_cached_user(instance.user_id)
+
+# --- Signal to publish blacklisted tokens to the revoked-token filters (see users/tokens.py) ---
+@receiver(post_save, sender=BlacklistedToken)
+def publish_revoked_token(sender, instance, created, **kwargs):
+    """Signal receiver to make a newly blacklisted refresh token visible to every process at once."""
+    if created:
+        record_revoked(instance.token.jti)
+
+# --- Signals to keep the customer search index current (see users/search.py) ---
+@receiver(post_save, sender=Customer)
+def index_saved_customer(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """Signal receiver to refresh the search entry of a created customer or one whose searchable columns changed."""
+    if raw or (update_fields is not None and not set(update_fields) & set(search.CUSTOMER_FIELDS)):
+        return
+    search.index_customer(instance, created=created)
+
+@receiver(post_save, sender=User)
+def index_saved_customer_user(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """Signal receiver to refresh the search entry when the searchable columns of a customer's user change."""
+    if created:
+        # A new user has no profile yet; it is indexed when the profile is created
+        return
+    if raw or (update_fields is not None and not set(update_fields) & set(search.USER_FIELDS)):
+        # e.g. the last_login update of every sign-in
+        return
+    try:
+        # Already loaded when the user was read with select_related('customer_profile')
+        customer = instance.customer_profile
+    except Customer.DoesNotExist:
+        return
+    if customer.pk is not None:
+        customer.user = instance
+        search.index_customer(customer)
@@ -0,0 +1,116 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+
+from . import search
+from .models import Customer
+
+
+def hash_passwords(passwords, workers=None):
+    """
+    Hashes `passwords` (in order) with the default hasher, in `workers` processes
+    (BULK_REGISTRATION_WORKERS, default one per CPU; inline when 1). Hashing is CPU-bound and
+    deliberately slow, so it is what bulk registration spends nearly all its time on.
+    """
+    workers = workers or getattr(settings, 'BULK_REGISTRATION_WORKERS', None) or os.cpu_count() or 1
+    if workers == 1 or len(passwords) < 2:
+        return [make_password(password) for password in passwords]
+    # The workers never touch the database; spawned ones only need the settings
+    with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+        return list(pool.map(make_password, passwords, chunksize=max(1, len(passwords) // (workers * 4))))
+
+
+def _taken_usernames(usernames):
+    taken = set()
+    usernames = list(usernames)
+    for start in range(0, len(usernames), 1000):
+        taken.update(User.objects.filter(username__in=usernames[start:start + 1000]).values_list('username', flat=True))
+    return taken
+
+
+def _insert(rows):
+    """
+    Inserts validated `rows` (username, email, hashed password, names, profile data) with
+    their profiles and search entries in one transaction.
+    """
+    with transaction.atomic():
+        User.objects.bulk_create([
+            User(username=row['username'], email=row['email'], password=row['password'],
+                 first_name=row['first_name'], last_name=row['last_name'])
+            for row in rows
+        ])
+        # Not every backend returns the ids of bulk-inserted rows
+        users = User.objects.in_bulk([row['username'] for row in rows], field_name='username')
+        customers = [Customer(user=users[row['username']], **row['customer_profile']) for row in rows]
+        Customer.objects.bulk_create(customers)
+        # bulk_create skips the post_save signal that indexes every profile (carts come with the first cart write)
+        if any(customer.pk is None for customer in customers):
+            customers = list(Customer.objects.select_related('user').filter(user__in=users.values()))
+        search.index_customers(customers)
+    return {row['row']: users[row['username']].pk for row in rows}
+
+
+def register_users(rows, chunk_size=1000, workers=None):
+    """
+    Registers users in bulk. `rows` are dicts in the shape of UserRegistrationSerializer
+    (username, email, password, first/last name, optional customer_profile).
+
+    Every row is validated on its own; usernames already taken or repeated in the batch are
+    rejected with one query per thousand rows instead of one per row. The passwords of the
+    valid rows are then hashed in parallel (see hash_passwords) and the rows inserted in
+    chunks of `chunk_size`, one transaction each. A chunk that hits a uniqueness conflict is
+    retried row by row, so only the conflicting rows fail.
+
+    Returns {'created': {row index: user id}, 'failed': {row index: errors}}.
+    """
+    from .serializers import BulkRegistrationSerializer
+
+    failed = {}
+    valid = []
+    seen = set()
+    for index, data in enumerate(rows):
+        serializer = BulkRegistrationSerializer(data=data)
+        if not serializer.is_valid():
+            failed[index] = serializer.errors
+            continue
+        row = serializer.validated_data
+        row['username'] = User.normalize_username(row['username'])
+        if row['username'] in seen:
+            failed[index] = {'username': ["This username appears more than once in the batch."]}
+            continue
+        seen.add(row['username'])
+        row['row'] = index
+        row['email'] = User.objects.normalize_email(row['email'])
+        row.setdefault('first_name', '')
+        row.setdefault('last_name', '')
+        row['customer_profile'] = dict(row.get('customer_profile') or {})
+        valid.append(row)
+
+    taken = _taken_usernames(seen)
+    for row in valid:
+        if row['username'] in taken:
+            failed[row['row']] = {'username': ["A user with that username already exists."]}
+    valid = [row for row in valid if row['username'] not in taken]
+
+    for row, hashed in zip(valid, hash_passwords([row['password'] for row in valid], workers)):
+        row['password'] = hashed
+
+    created = {}
+    for start in range(0, len(valid), chunk_size):
+        chunk = valid[start:start + chunk_size]
+        try:
+            created.update(_insert(chunk))
+        except IntegrityError:
+            # A username was registered since the check above, or two rows collide under the
+            # database collation only (e.g. 'Alice' and 'alice' on MySQL): insert row by row
+            for row in chunk:
+                try:
+                    created.update(_insert([row]))
+                except IntegrityError:
+                    failed[row['row']] = {'username': ["A user with that username already exists."]}
+    return {'created': created, 'failed': dict(sorted(failed.items()))}
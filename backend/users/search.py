@@ -0,0 +1,205 @@
+import base64
+import binascii
+import json
+import re
+import unicodedata
+
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q
+
+# User columns copied onto the search entry; saving other columns (e.g. last_login) skips reindexing
+USER_FIELDS = ('email', 'username', 'first_name', 'last_name')
+
+# Customer columns copied onto the search entry
+CUSTOMER_FIELDS = ('phone_number', 'city')
+
+# Entry columns a query is matched against
+ENTRY_FIELDS = ('email', 'username', 'name', 'phone', 'city')
+
+# Marks the tokens holding the first one or two characters of a value
+PREFIX_MARK = '^'
+
+# Queries made only of these characters (and at least one digit) are phone numbers
+PHONE_QUERY_RE = re.compile(r'[\d\s+().-]*\d[\d\s+().-]*')
+
+# Token frequencies are counted up to this many postings when picking the one to walk
+FREQUENCY_CAP = 10000
+
+
+class InvalidCursor(ValueError):
+    """Raised for a cursor that was not issued by encode_cursor()."""
+
+
+def normalize(value):
+    """Lowercased, with accents dropped ('José' -> 'jose'), so queries match either spelling."""
+    decomposed = unicodedata.normalize('NFD', (value or '').strip().lower())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def digits(value):
+    return re.sub(r'\D', '', value or '')
+
+
+def entry_values(customer):
+    """The normalized searchable values of a customer (with its user loaded)."""
+    user = customer.user
+    return {
+        'email': normalize(user.email),
+        'username': normalize(user.username),
+        'name': normalize(f"{user.first_name} {user.last_name}"),
+        'phone': digits(customer.phone_number),
+        'city': normalize(customer.city),
+    }
+
+
+def value_tokens(value):
+    """Trigrams of one normalized value plus its anchored one- and two-character prefixes."""
+    if not value:
+        return set()
+    tokens = {value[i:i + 3] for i in range(len(value) - 2)}
+    tokens.add(PREFIX_MARK + value[:1])
+    if len(value) > 1:
+        tokens.add(PREFIX_MARK + value[:2])
+    return tokens
+
+
+def entry_tokens(values):
+    tokens = set()
+    for value in values.values():
+        tokens |= value_tokens(value)
+    return tokens
+
+
+def _write_entries(customers, replace=True):
+    """
+    Upserts the entries of `customers` (users loaded) and replaces their tokens (`replace`
+    False skips deleting the tokens of customers that cannot have any yet).
+    """
+    from .models import CustomerSearchEntry, CustomerSearchToken
+
+    entries = [CustomerSearchEntry(customer_id=customer.pk, **entry_values(customer)) for customer in customers]
+    upsert = {'update_conflicts': True, 'update_fields': list(ENTRY_FIELDS)}
+    if connection.features.supports_update_conflicts_with_target:
+        # MySQL upserts on any unique key and rejects an explicit conflict target
+        upsert['unique_fields'] = ['customer']
+    with transaction.atomic():
+        CustomerSearchEntry.objects.bulk_create(entries, **upsert)
+        if replace:
+            CustomerSearchToken.objects.filter(entry__in=[entry.pk for entry in entries]).delete()
+        CustomerSearchToken.objects.bulk_create([
+            CustomerSearchToken(token=token, entry_id=entry.pk)
+            for entry in entries
+            for token in entry_tokens({field: getattr(entry, field) for field in ENTRY_FIELDS})
+        # MySQL's default collations compare more strings as equal than Python does (e.g. 'ß'
+        # and 'ss'); such tokens are the same posting, so a repeat is skipped, not an error
+        ], batch_size=5000, ignore_conflicts=True)
+    return len(entries)
+
+
+def index_customers(customers):
+    """Indexes customers created in bulk (bulk_create sends no signals)."""
+    return _write_entries(customers)
+
+
+def index_customer(customer, created=False):
+    """
+    Refreshes the search entry of one customer (called from the save signals). Unchanged
+    values are detected first, so saving a profile without touching them writes nothing; a
+    `created` customer has no entry to compare with.
+    """
+    from .models import CustomerSearchEntry
+
+    if created:
+        _write_entries([customer], replace=False)
+        return
+    values = entry_values(customer)
+    current = CustomerSearchEntry.objects.filter(pk=customer.pk).values(*ENTRY_FIELDS).first()
+    if current != values:
+        _write_entries([customer])
+
+
+def rebuild_index(chunk_size=1000):
+    """
+    Rebuilds every customer search entry in keyset chunks, for use after bulk loads that bypass
+    signals. Returns the number of indexed customers.
+    """
+    from .models import Customer
+
+    indexed = 0
+    last_id = 0
+    while True:
+        customers = list(Customer.objects.select_related('user').filter(pk__gt=last_id).order_by('pk')[:chunk_size])
+        if not customers:
+            break
+        indexed += _write_entries(customers)
+        last_id = customers[-1].pk
+    return indexed
+
+
+def normalize_query(query):
+    """Lowercases a query; phone-like queries are reduced to their digits."""
+    query = normalize(query)
+    if PHONE_QUERY_RE.fullmatch(query):
+        return digits(query)
+    return query
+
+
+def query_tokens(query, prefix=False):
+    """
+    The tokens every match must contain: the anchored prefix for queries of one or two
+    characters (which only match prefixes), otherwise the query's trigrams (plus the anchored
+    prefix in prefix mode).
+    """
+    if len(query) < 3:
+        return {PREFIX_MARK + query}
+    tokens = {query[i:i + 3] for i in range(len(query) - 2)}
+    if prefix:
+        tokens.add(PREFIX_MARK + query[:2])
+    return tokens
+
+
+def search_customers(query, prefix=False, after=0, limit=20):
+    """
+    Returns the ids of up to `limit` customers after customer id `after` (in id order) whose
+    email, username, name, phone or city contains `query` (starts with it when `prefix`;
+    queries shorter than three characters always match prefixes).
+
+    The posting list of the query's rarest token is walked in id order; the other tokens are
+    probed by primary key and the candidates verified against their entry, so a page costs
+    about limit x tokens index lookups however many customers there are.
+    """
+    from .models import CustomerSearchToken
+
+    query = normalize_query(query)
+    if not query:
+        return []
+    tokens = query_tokens(query, prefix)
+    frequencies = {token: CustomerSearchToken.objects.filter(token=token)[:FREQUENCY_CAP].count() for token in tokens}
+    rarest = min(tokens, key=lambda token: (frequencies[token], token))
+    if not frequencies[rarest]:
+        return []
+
+    postings = CustomerSearchToken.objects.filter(token=rarest, entry_id__gt=after)
+    for token in tokens - {rarest}:
+        postings = postings.filter(Exists(CustomerSearchToken.objects.filter(token=token, entry_id=OuterRef('entry_id'))))
+    lookup = 'startswith' if prefix or len(query) < 3 else 'contains'
+    matches = Q()
+    for field in ENTRY_FIELDS:
+        matches |= Q(**{f'entry__{field}__{lookup}': query})
+    return list(postings.filter(matches).order_by('entry_id').values_list('entry_id', flat=True)[:limit])
+
+
+def encode_cursor(customer_id):
+    raw = json.dumps({'id': customer_id}, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Returns the customer id a cursor continues after (0 without a cursor)."""
+    if not cursor:
+        return 0
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return int(json.loads(base64.urlsafe_b64decode(padded.encode()))['id'])
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise InvalidCursor("The cursor is malformed.")
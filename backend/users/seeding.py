@@ -0,0 +1,266 @@
+import os
+import random
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+import django
+from django.contrib.auth.models import User
+from django.db import connection, connections, transaction
+from django.db.models.signals import pre_delete, post_delete, m2m_changed
+from django.utils import timezone
+
+from cart.models import Cart, CartItem
+from cart.reservations import release_cart_holds
+from products.facets import rebuild_facet_summary
+from products.models import Product, ProductImage, ProductFeature
+from products.read_model import rebuild_documents
+from products.search import rebuild_index
+from .models import Customer
+from .search import rebuild_index as rebuild_customer_index
+
+# Seeded rows are recognisable by these prefixes, so they can be replaced without touching real data
+PRODUCT_PREFIX = 'seed-product-'
+USER_PREFIX = 'seed-user-'
+
+FIRST_NAMES = ('Olivia', 'Liam', 'Emma', 'Noah', 'Ava', 'Arjun', 'Mia', 'Lucas', 'Priya', 'Ethan', 'Sofia', 'Kabir')
+LAST_NAMES = ('Smith', 'Patel', 'Garcia', 'Brown', 'Sharma', 'Müller', 'Rossi', 'Kim', 'Nguyen', 'Holve', 'Silva')
+CITIES = (('Pune', 'India'), ('Mumbai', 'India'), ('London', 'UK'), ('Berlin', 'Germany'), ('Austin', 'USA'), ('Lyon', 'France'))
+BRANDS = ('Acme', 'Woodcraft', 'Timber & Co', 'Oak Works', 'Little Hands', 'Maple Toys')
+THEMES = ('Classic', 'Nature', 'Vehicles', 'Animals', 'Space', None)
+GENRES = ('Puzzle', 'Building', 'Role Play', 'Musical', 'Educational', None)
+TOYS = ('Stacking Rings', 'Train Set', 'Shape Sorter', 'Puzzle Box', 'Xylophone', 'Rocking Horse', 'Block Tower')
+DISCOUNTS = (Decimal('0.00'), Decimal('0.00'), Decimal('5.00'), Decimal('10.00'), Decimal('25.00'))
+
+# Catalog (product ids and prices) loaded once per worker process for the cart phase
+_catalog = None
+
+
+def chunk_rng(seed, kind, start):
+    """A random stream that depends only on the seed and the chunk, not on which process runs it."""
+    return random.Random(f"{seed}:{kind}:{start}")
+
+
+def seed_products(start, stop, images, features, seed):
+    """Inserts products start..stop-1 with their images and features. Returns the product count."""
+    rng = chunk_rng(seed, 'products', start)
+    with transaction.atomic():
+        Product.objects.bulk_create([
+            Product(
+                name=f"{rng.choice(TOYS)} {i:08d}",
+                slug=f"{PRODUCT_PREFIX}{i:08d}",
+                brand=rng.choice(BRANDS),
+                short_description=f"Hand made wooden toy number {i}.",
+                long_description="Solid beech wood, sanded smooth and finished with natural oil. " * rng.randint(2, 12),
+                theme=rng.choice(THEMES),
+                genre=rng.choice(GENRES),
+                price=Decimal(rng.randrange(300, 50000)) / 100,
+                discount_percent=rng.choice(DISCOUNTS),
+                stock_quantity=rng.randrange(0, 500),
+                is_available=rng.random() > 0.05,
+            )
+            for i in range(start, stop)
+        ], batch_size=1000)
+        # Not every backend returns primary keys from bulk inserts (MySQL does not)
+        product_ids = list(
+            Product.objects.filter(slug__gte=f"{PRODUCT_PREFIX}{start:08d}", slug__lt=f"{PRODUCT_PREFIX}{stop:08d}")
+            .order_by('slug').values_list('id', flat=True)
+        )
+        ProductImage.objects.bulk_create([
+            ProductImage(
+                product_id=product_id, image=f"product_images/seed-{product_id}-{order}.jpg",
+                alt_text=f"View {order + 1}", is_main=order == 0, order=order,
+            )
+            for product_id in product_ids
+            for order in range(images)
+        ], batch_size=1000)
+        ProductFeature.objects.bulk_create([
+            ProductFeature(product_id=product_id, feature_name=name, feature_value=value)
+            for product_id in product_ids
+            for name, value in (
+                ('Material', rng.choice(('Beech', 'Maple', 'Oak', 'Birch'))),
+                ('Age', f"{rng.randint(1, 8)}+"),
+                ('Pieces', str(rng.randint(1, 120))),
+            )[:features]
+        ], batch_size=1000)
+    return len(product_ids)
+
+
+def reset_catalog():
+    """Forgets the loaded catalog (call after products changed, before seeding users)."""
+    global _catalog
+    _catalog = None
+
+
+def _load_catalog():
+    global _catalog
+    if _catalog is None:
+        ids, cents = array('q'), array('q')
+        # Ordered by slug so a cart's products depend on the seed, not on insertion order
+        catalog = Product.objects.filter(slug__startswith=PRODUCT_PREFIX).order_by('slug').values_list('id', 'final_price')
+        for product_id, price in catalog.iterator(chunk_size=10000):
+            ids.append(product_id)
+            cents.append(int(price * 100))
+        _catalog = ids, cents
+    return _catalog
+
+
+def seed_users(start, stop, password, cart_items, seed):
+    """
+    Inserts users start..stop-1 with their customer profile and a cart holding up to `cart_items`
+    seeded products. Returns (users, cart items).
+    """
+    rng = chunk_rng(seed, 'users', start)
+    now = timezone.now()
+    with transaction.atomic():
+        users = []
+        for i in range(start, stop):
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            users.append(User(
+                username=f"{USER_PREFIX}{i:08d}", email=f"{first.lower()}.{i}@example.com", password=password,
+                first_name=first, last_name=last, is_active=rng.random() > 0.02,
+                date_joined=now - timedelta(minutes=rng.randrange(0, 2 * 365 * 24 * 60)),
+            ))
+        User.objects.bulk_create(users, batch_size=1000)
+        user_ids = list(
+            User.objects.filter(username__gte=f"{USER_PREFIX}{start:08d}", username__lt=f"{USER_PREFIX}{stop:08d}")
+            .order_by('username').values_list('id', flat=True)
+        )
+
+        customers = []
+        for user_id in user_ids:
+            city, country = rng.choice(CITIES)
+            customers.append(Customer(
+                user_id=user_id, phone_number=f"+91{rng.randrange(7000000000, 9999999999)}",
+                street_address=f"{rng.randint(1, 400)} Market Road", city=city, country=country,
+                zip_code=str(rng.randrange(10000, 99999)), is_subscribed_to_newsletter=rng.random() < 0.3,
+            ))
+        Customer.objects.bulk_create(customers, batch_size=1000)
+        # Seeded shoppers start with filled carts, so their carts exist up front
+        Cart.objects.bulk_create([Cart(user_id=user_id) for user_id in user_ids], batch_size=1000)
+
+        items = []
+        ids, cents = _load_catalog()
+        if ids and cart_items:
+            cart_ids = Cart.objects.filter(user_id__in=user_ids).order_by('user_id').values_list('id', flat=True)
+            for cart_id in cart_ids:
+                for index in rng.sample(range(len(ids)), min(rng.randint(0, cart_items), len(ids))):
+                    items.append(CartItem(
+                        cart_id=cart_id, product_id=ids[index], quantity=rng.randint(1, 3),
+                        price_at_addition=Decimal(cents[index]) / 100,
+                    ))
+            CartItem.objects.bulk_create(items, batch_size=1000)
+            total_items, total_price = Cart.totals_expressions()
+            Cart.objects.filter(user_id__in=user_ids).update(total_items=total_items, total_price=total_price)
+    return len(user_ids), len(items)
+
+
+def run_chunks(function, total, chunk_size, workers, *args):
+    """
+    Calls function(start, stop, *args) for every chunk of range(total), in `workers` processes
+    (inline when workers is 1). Yields the chunk results as they complete.
+    """
+    chunks = [(start, min(start + chunk_size, total)) for start in range(0, total, chunk_size)]
+    if workers == 1:
+        for start, stop in chunks:
+            yield function(start, stop, *args)
+        return
+    # Forked workers must not share the parent's database connections; spawned ones need django.setup()
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+        futures = [pool.submit(function, start, stop, *args) for start, stop in chunks]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def default_workers(workers=None):
+    """Worker processes for seeding: `workers` or one per CPU, but one on SQLite."""
+    if connection.vendor == 'sqlite':
+        # SQLite allows a single writer: parallel inserts would only wait on each other's locks
+        return 1
+    return workers or os.cpu_count() or 1
+
+
+def seed_dataset(products, users, password, images=2, features=3, cart_items=3, seed=42, workers=1, chunk_size=10000, progress=None):
+    """
+    Seeds `products` products, then `users` users with profiles and carts (see seed_products()
+    and seed_users()), in chunks of `chunk_size` spread over `workers` processes. `password` is
+    the hashed password every seeded user shares. `progress(kind, done, total)` is called after
+    every chunk. The derived data is left to rebuild_derived(). Returns (products, users, cart items).
+    """
+    seeded_products = 0
+    for count in run_chunks(seed_products, products, chunk_size, workers, images, features, seed):
+        seeded_products += count
+        if progress:
+            progress('Products', seeded_products, products)
+
+    reset_catalog()
+    seeded_users = items = 0
+    for user_count, item_count in run_chunks(seed_users, users, chunk_size, workers, password, cart_items, seed):
+        seeded_users += user_count
+        items += item_count
+        if progress:
+            progress('Users', seeded_users, users)
+    return seeded_products, seeded_users, items
+
+
+def rebuild_derived():
+    """Rebuilds what bulk inserts bypass: search indexes, facet summary and product documents."""
+    rebuild_index()
+    rebuild_facet_summary()
+    rebuild_documents()
+    rebuild_customer_index()
+
+
+@contextmanager
+def muted_delete_signals():
+    """
+    Disconnects every delete signal receiver while the block runs, so QuerySet.delete() takes its
+    fast path (one DELETE per table, no per-row signals, which dominate at seed volumes). Receivers
+    are process-wide: only for commands that own the process; callers do what the receivers would
+    (return held stock, rebuild derived data) themselves.
+    """
+    signals = (pre_delete, post_delete, m2m_changed)
+    saved = [signal.receivers for signal in signals]
+    for signal in signals:
+        with signal.lock:
+            signal.receivers = []
+            signal.sender_receivers_cache.clear()
+    try:
+        yield
+    finally:
+        for signal, receivers in zip(signals, saved):
+            with signal.lock:
+                signal.receivers = receivers
+                signal.sender_receivers_cache.clear()
+
+
+def clear_seed_data():
+    """
+    Deletes every seeded user and product with the rows cascading from them (profiles, carts,
+    images, features, documents), then re-totals the other carts that held seeded products.
+    Seeded carts return the stock they hold first, as their pre_delete receiver is muted.
+    """
+    seeded_products = Product.objects.filter(slug__startswith=PRODUCT_PREFIX)
+    cart_ids = list(
+        CartItem.objects.filter(product__in=seeded_products)
+        .exclude(cart__user__username__startswith=USER_PREFIX)
+        .values_list('cart_id', flat=True).distinct()
+    )
+    seeded_users = User.objects.filter(username__startswith=USER_PREFIX)
+    with transaction.atomic(), muted_delete_signals():
+        release_cart_holds(Cart.objects.filter(user__in=seeded_users))
+        seeded_users.delete()
+        seeded_products.delete()
+        if cart_ids:
+            total_items, total_price = Cart.totals_expressions()
+            Cart.objects.filter(pk__in=cart_ids).update(total_items=total_items, total_price=total_price)
+
+
+def seed_exists():
+    return (
+        User.objects.filter(username__startswith=USER_PREFIX).exists()
+        or Product.objects.filter(slug__startswith=PRODUCT_PREFIX).exists()
+    )
@@ -1,27 +1,51 @@
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import (
+    TokenObtainPairSerializer as BaseTokenObtainPairSerializer,
+    TokenRefreshSerializer as BaseTokenRefreshSerializer,
+)
+from cart.session import merge_anonymous_cart, request_cart_token
+from backend.metrics import TimedSerializerMixin
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.db import transaction
 from .models import Customer
+from .tokens import RefreshToken
 # from rest_framework import serializers
 # from .models import CustomUser # Assuming your custom user model is CustomUser
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Serializer for the CustomUser model, used for listing users in the dashboard.
+    A Customer with the columns of its User (loaded with select_related('user')).
     """
+    user_id = serializers.IntegerField(source='user.id', read_only=True)
+    username = serializers.CharField(source='user.username', read_only=True)
+    email = serializers.EmailField(source='user.email', read_only=True)
+    first_name = serializers.CharField(source='user.first_name', read_only=True)
+    last_name = serializers.CharField(source='user.last_name', read_only=True)
+    is_staff = serializers.BooleanField(source='user.is_staff', read_only=True)
+    is_active = serializers.BooleanField(source='user.is_active', read_only=True)
+    date_joined = serializers.DateTimeField(source='user.date_joined', read_only=True)
+
     class Meta:
         model = Customer
         fields = (
             'id', 
+            'user_id',
+            'username',
             'email', 
             'first_name', 
             'last_name', 
             'is_staff', 
             'is_active',
-            'date_joined'
+            'date_joined',
+            'phone_number',
+            'city',
         )
         read_only_fields = fields
 
-class CustomerProfileSerializer(serializers.ModelSerializer):
+class CustomerProfileSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Serializer for the Customer profile details (address, phone, etc.).
     Used for retrieving and updating existing customer profiles.
@@ -35,7 +59,7 @@ class CustomerProfileSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['created_at', 'updated_at']
 
-class UserRegistrationSerializer(serializers.ModelSerializer):
+class UserRegistrationSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Serializer for registering a new User and their linked Customer profile.
     """
@@ -56,20 +80,110 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         """
         Custom create method to handle creating both the User and Customer profile.
+        The password is hashed before the transaction opens (hashing takes far longer than
+        the inserts); the user and their profile then commit together. The cart comes with the
+        first cart write.
         """
         # 1. Extract the nested profile data
         profile_data = validated_data.pop('customer_profile')
-        
-        # 2. Create the User object (this handles password hashing automatically)
-        user = User.objects.create_user(
-            username=validated_data['username'],
-            email=validated_data['email'],
-            password=validated_data['password'],
+
+        # 2. Hash the password (as create_user would) outside the transaction
+        user = User(
+            username=User.normalize_username(validated_data['username']),
+            email=User.objects.normalize_email(validated_data['email']),
+            password=make_password(validated_data['password']),
             first_name=validated_data.get('first_name', ''),
             last_name=validated_data.get('last_name', '')
         )
-        
-        # 3. Create the linked Customer profile
-        Customer.objects.create(user=user, **profile_data)
-        
+
+        with transaction.atomic():
+            # 3. Create the User object
+            user.save()
+            # 4. Create the linked Customer profile
+            Customer.objects.create(user=user, **profile_data)
+
         return user
+
+class BulkRegistrationSerializer(UserRegistrationSerializer):
+    """
+    Validates one row of a bulk registration (see users/registration.py). Usernames are checked
+    for uniqueness for the whole batch at once, and the profile is optional.
+    """
+    customer_profile = CustomerProfileSerializer(required=False)
+
+    class Meta(UserRegistrationSerializer.Meta):
+        extra_kwargs = {
+            'email': {'required': True},
+            'username': {'validators': [UnicodeUsernameValidator()]},
+        }
+
+def with_profile(user):
+    """
+    Gives a user loaded with select_related('customer_profile') an unsaved default profile if
+    they have none, so reading a profile never writes.
+    """
+    if not hasattr(user, 'customer_profile'):
+        user.customer_profile = Customer(user=user)
+    return user
+
+def _assign_changed(instance, data):
+    """Sets the values in `data` that differ from `instance`; returns the names of the changed fields."""
+    changed = [field for field, value in data.items() if getattr(instance, field) != value]
+    for field in changed:
+        setattr(instance, field, data[field])
+    return changed
+
+class UserProfileSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """
+    Serializer for the signed-in user's own profile (/users/me/): the User with its nested
+    Customer profile. The username is fixed; updates write only the columns that changed.
+    Expects the user loaded with select_related('customer_profile').
+    """
+    customer_profile = CustomerProfileSerializer(required=False)
+
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'email', 'first_name', 'last_name', 'customer_profile']
+        read_only_fields = ['id', 'username']
+        extra_kwargs = {'email': {'required': True}}
+
+    def update(self, instance, validated_data):
+        profile_data = validated_data.pop('customer_profile', None)
+
+        changed = _assign_changed(instance, validated_data)
+        if changed:
+            instance.save(update_fields=changed)
+
+        if profile_data:
+            profile = with_profile(instance).customer_profile
+            if profile._state.adding:
+                # A user without a profile gets one on their first profile edit
+                for field, value in profile_data.items():
+                    setattr(profile, field, value)
+                profile.save()
+            else:
+                changed = _assign_changed(profile, profile_data)
+                if changed:
+                    profile.save(update_fields=changed + ['updated_at'])
+        return instance
+
+
+class TokenRefreshSerializer(BaseTokenRefreshSerializer):
+    """simplejwt's refresh serializer, checking the blacklist through the revoked-token filter."""
+    token_class = RefreshToken
+
+
+class TokenObtainPairSerializer(BaseTokenObtainPairSerializer):
+    """
+    simplejwt's sign-in serializer that also merges the anonymous cart sent in X-Cart-Token
+    into the user's cart; the response then reports the merged and skipped product ids.
+    """
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        request = self.context.get('request')
+        token = request_cart_token(request) if request is not None else None
+        if token:
+            merged, skipped = merge_anonymous_cart(token, self.user)
+            data['cart_merge'] = {'merged': merged, 'skipped': skipped}
+        return data
@@ -1,3 +1,577 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.cache import cache
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken
+
+from cart import reservations
+from cart.models import Cart, CartItem, StockReservation
+from products.models import Product, ProductDocument, ProductImage
+from . import cache as auth_cache
+from .models import Customer, CustomerSearchEntry, CustomerSearchToken
+from .registration import register_users
+from .search import search_customers
+from .seeding import PRODUCT_PREFIX, USER_PREFIX, run_chunks
+from .tokens import BloomFilter, RefreshToken, is_token_blacklisted, revoked_filter
+
+
+def chunk_span(start, stop, label):
+    """A seeding task for RunChunksTests: fails for the chunk starting at 999."""
+    if start == 999:
+        raise ValueError("bad chunk")
+    return label, start, stop
+
+
+class RunChunksTests(SimpleTestCase):
+    """The worker process path of run_chunks, which seeding on SQLite never takes."""
+
+    def test_chunks_run_in_worker_processes(self):
+        results = list(run_chunks(chunk_span, 10, 3, 2, 'span'))
+        # Yielded as they complete, so in any order
+        self.assertEqual(sorted(results), [('span', 0, 3), ('span', 3, 6), ('span', 6, 9), ('span', 9, 10)])
+        self.assertEqual(list(run_chunks(chunk_span, 0, 3, 2, 'span')), [])
+
+    def test_worker_errors_reach_the_caller(self):
+        with self.assertRaisesMessage(ValueError, "bad chunk"):
+            list(run_chunks(chunk_span, 1000, 999, 2, 'span'))
+
+
+class SeedCommandTests(TestCase):
+
+    def seed(self, **options):
+        options = {'users': 6, 'products': 8, 'chunk_size': 4, 'cart_items': 3, **options}
+        call_command('seed', stdout=StringIO(), **options)
+
+    def snapshot(self):
+        return (
+            list(Product.objects.filter(slug__startswith=PRODUCT_PREFIX).order_by('slug').values_list('slug', 'name', 'price', 'brand')),
+            list(User.objects.filter(username__startswith=USER_PREFIX).order_by('username').values_list('username', 'first_name', 'email')),
+            list(CartItem.objects.filter(cart__user__username__startswith=USER_PREFIX)
+                 .order_by('cart__user__username', 'product__slug').values_list('cart__user__username', 'product__slug', 'quantity')),
+        )
+
+    def test_seeds_users_profiles_carts_and_catalog(self):
+        self.seed(password='seed-secret')
+
+        self.assertEqual(Product.objects.filter(slug__startswith=PRODUCT_PREFIX).count(), 8)
+        self.assertEqual(ProductImage.objects.filter(product__slug__startswith=PRODUCT_PREFIX).count(), 16)
+        self.assertEqual(ProductDocument.objects.filter(slug__startswith=PRODUCT_PREFIX).count(), 8)
+        self.assertEqual(Customer.objects.filter(user__username__startswith=USER_PREFIX).count(), 6)
+        for cart in Cart.objects.filter(user__username__startswith=USER_PREFIX).prefetch_related('items'):
+            self.assertEqual(cart.total_items, sum(item.quantity for item in cart.items.all()))
+        user = User.objects.filter(username__startswith=USER_PREFIX, is_active=True).first()
+        self.assertEqual(authenticate(username=user.username, password='seed-secret'), user)
+
+    def test_same_seed_gives_the_same_data(self):
+        self.seed(seed=7)
+        first = self.snapshot()
+        self.seed(seed=7, clear=True)
+        self.assertEqual(self.snapshot(), first)
+        self.seed(seed=8, clear=True)
+        self.assertNotEqual(self.snapshot(), first)
+
+    def test_refuses_to_seed_twice_without_clear(self):
+        self.seed()
+        with self.assertRaises(CommandError):
+            self.seed()
+
+    def test_clear_keeps_other_data_and_fixes_their_totals(self):
+        self.seed()
+        shopper = User.objects.create_user(username='shopper', password='pw')
+        own = Product.objects.create(name="Owl", slug='owl', price=Decimal('10.00'), short_description="s", long_description="l")
+        seeded = Product.objects.filter(slug__startswith=PRODUCT_PREFIX).first()
+        cart = Cart.objects.create(user=shopper)
+        CartItem.objects.create(cart=cart, product=own, quantity=1, price_at_addition=Decimal('10.00'))
+        CartItem.objects.create(cart=cart, product=seeded, quantity=2, price_at_addition=Decimal('5.00'))
+
+        self.seed(users=0, products=0, clear=True)
+
+        self.assertFalse(User.objects.filter(username__startswith=USER_PREFIX).exists())
+        self.assertFalse(Product.objects.filter(slug__startswith=PRODUCT_PREFIX).exists())
+        cart.refresh_from_db()
+        self.assertEqual((cart.total_items, cart.total_price), (1, Decimal('10.00')))
+        self.assertTrue(Product.objects.filter(slug='owl').exists())
+
+    def test_clear_returns_the_stock_held_by_seeded_carts(self):
+        self.seed()
+        own = Product.objects.create(
+            name="Owl", slug='owl', price=Decimal('10.00'), stock_quantity=5, short_description="s", long_description="l",
+        )
+        seeded_cart = Cart.objects.filter(user__username__startswith=USER_PREFIX).first()
+        reservations.reserve(seeded_cart, own.pk, 3)
+        shopper = User.objects.create_user(username='shopper', password='pw')
+        cart = Cart.objects.create(user=shopper)
+        reservations.reserve(cart, own.pk, 1)
+
+        self.seed(users=0, products=0, clear=True)
+
+        own.refresh_from_db()
+        self.assertEqual((own.stock_quantity, own.reserved_quantity), (5, 1))
+        self.assertFalse(StockReservation.objects.exclude(cart=cart).exists())
+        # The receivers are connected again once the clear is done
+        cart.delete()
+        own.refresh_from_db()
+        self.assertEqual(own.reserved_quantity, 0)
+
+
+class CachedJWTAuthenticationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='buyer', password='pass12345')
+        Cart.objects.create(user=cls.user)
+        cls.product = Product.objects.create(
+            name="Owl", slug='owl', price=Decimal('10.00'), stock_quantity=10, short_description="s", long_description="l",
+        )
+
+    def setUp(self):
+        cache.clear()
+        auth_cache._local.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+
+    def request(self, method, path, data=None):
+        """Sends a request and returns (response, user lookups, cart-by-user lookups)."""
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(path, data, format='json')
+        statements = [query['sql'] for query in queries]
+        return (
+            response,
+            [sql for sql in statements if 'FROM "auth_user"' in sql],
+            [sql for sql in statements if 'FROM "cart_cart" WHERE "cart_cart"."user_id"' in sql],
+        )
+
+    def test_user_and_cart_id_come_from_the_cache_after_the_first_request(self):
+        response, users, _ = self.request('get', '/api/v1/cart/')
+        self.assertEqual(response.status_code, 200)
+        # The user, joined with their cart id
+        self.assertEqual(len(users), 1)
+        self.assertIn('"cart_cart"."id"', users[0])
+
+        response, users, _ = self.request('get', '/api/v1/cart/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(users, [])
+
+        response, users, carts = self.request('post', '/api/v1/cart/items/add/', {'product_id': self.product.pk, 'quantity': 2})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((users, carts), ([], []))
+        self.assertEqual(Cart.objects.get(user=self.user).total_items, 2)
+
+    def test_deactivation_takes_effect_on_the_next_request(self):
+        self.assertEqual(self.client.get('/api/v1/cart/').status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/v1/cart/').status_code, 401)
+
+    def test_password_change_and_new_cart_drop_the_cached_user(self):
+        self.client.get('/api/v1/cart/')
+        key = auth_cache.AUTH_USER_KEY.format(user_id=self.user.pk)
+        self.assertIsNotNone(cache.get(key))
+        # Only the digest the revoke-token check compares, never the hash itself
+        self.assertNotIn(self.user.password, str(cache.get(key)))
+        self.user.set_password('new-pass-678')
+        self.user.save()
+        self.assertIsNone(cache.get(key))
+        self.assertNotIn(str(self.user.pk), auth_cache._local)
+
+        self.client.get('/api/v1/cart/')
+        Cart.objects.filter(user=self.user).delete()
+        self.assertIsNone(cache.get(key))
+        cart = Cart.objects.create(user=self.user)
+        self.assertEqual(auth_cache.get_cached_user(self.user.pk).cached_cart_id, cart.pk)
+
+    def test_revoke_token_check_uses_the_cached_digest(self):
+        # simplejwt modules hold on to the api_settings they imported, so patch that object
+        from rest_framework_simplejwt.tokens import api_settings
+
+        with mock.patch.object(api_settings, 'CHECK_REVOKE_TOKEN', True):
+            self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+            self.assertEqual(self.client.get('/api/v1/cart/').status_code, 200)
+            response, users, _ = self.request('get', '/api/v1/cart/')
+            self.assertEqual((response.status_code, users), (200, []))
+
+            self.user.set_password('new-pass-678')
+            self.user.save()
+            self.assertEqual(self.client.get('/api/v1/cart/').status_code, 401)
+
+    @override_settings(AUTH_TRUST_TOKEN_CLAIMS=True)
+    def test_trusted_claims_skip_the_lookup_for_reads_only(self):
+        response, users, _ = self.request('get', '/api/v1/cart/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(users, [])
+
+        response, users, _ = self.request('post', '/api/v1/cart/items/add/', {'product_id': self.product.pk, 'quantity': 1})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(users), 1)
+
+        # Profile reads need the real user, so the view does not opt in
+        self.assertEqual(self.client.get('/api/users/v1/users/me/').data['username'], 'buyer')
+
+
+@mock.patch('users.tokens.cache_is_shared', return_value=True)
+class TokenBlacklistTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='refresher', password='pass12345')
+
+    def setUp(self):
+        cache.clear()
+        revoked_filter.clear()
+        self.client = APIClient()
+
+    def refresh(self, token):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/v1/token/refresh/', {'refresh': str(token)}, format='json')
+        lookups = [
+            query['sql'] for query in queries
+            if 'FROM "token_blacklist_blacklistedtoken"' in query['sql'] and '"jti" =' in query['sql']
+        ]
+        return response, lookups
+
+    def test_bloom_filter_has_no_false_negatives(self, shared):
+        bloom = BloomFilter(1000)
+        added = [f"jti-{i}" for i in range(1000)]
+        for jti in added:
+            bloom.add(jti)
+        self.assertTrue(all(jti in bloom for jti in added))
+        false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+        self.assertLess(false_positives, 50)
+
+    def test_rotated_token_is_rejected_without_table_lookups_for_valid_ones(self, shared):
+        token = RefreshToken.for_user(self.user)
+        response, lookups = self.refresh(token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(lookups, [])
+        self.assertTrue(BlacklistedToken.objects.filter(token__jti=token['jti']).exists())
+
+        # Again with the rotated token: the filter matches, the table confirms
+        response, lookups = self.refresh(token)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(len(lookups), 1)
+
+        # The rotated-in token is valid, until it is rotated itself
+        rotated = RefreshToken(self.refresh(RefreshToken.for_user(self.user))[0].data['refresh'])
+        response, lookups = self.refresh(rotated)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(lookups, [])
+        self.assertTrue(is_token_blacklisted(rotated['jti']))
+
+    def test_tokens_blacklisted_by_other_processes_are_caught_before_the_next_rebuild(self, shared):
+        token = RefreshToken.for_user(self.user)
+        revoked_filter.rebuild()
+        stale_filter = revoked_filter._filter
+        revoked_filter._filter = BloomFilter(1024)
+        token.blacklist()
+        # This process's filter predates the blacklisting (it was built in another process)
+        revoked_filter._filter = stale_filter
+        self.assertNotIn(token['jti'], stale_filter)
+        self.assertTrue(is_token_blacklisted(token['jti']))
+        self.assertEqual(self.refresh(token)[0].status_code, 401)
+
+    def test_per_process_cache_falls_back_to_the_table(self, shared):
+        shared.return_value = False
+        token = RefreshToken.for_user(self.user)
+        revoked_filter.rebuild()
+        # Blacklisted by another process: neither this filter nor this process's cache knows it
+        with mock.patch('users.models.record_revoked'):
+            token.blacklist()
+        self.assertNotIn(token['jti'], revoked_filter._filter)
+        response, lookups = self.refresh(token)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(len(lookups), 1)
+
+    def test_per_process_cache_does_not_build_the_filter(self, shared):
+        shared.return_value = False
+        self.assertFalse(is_token_blacklisted(RefreshToken.for_user(self.user)['jti']))
+        self.assertIsNone(revoked_filter._filter)
+
+    def test_refresh_reads_only_newly_blacklisted_rows(self, shared):
+        first, second = RefreshToken.for_user(self.user), RefreshToken.for_user(self.user)
+        first.blacklist()
+        revoked_filter.rebuild()
+        bloom = revoked_filter._filter
+        with mock.patch('users.models.record_revoked'):
+            second.blacklist()
+        self.assertNotIn(second['jti'], bloom)
+
+        with CaptureQueriesContext(connection) as queries:
+            revoked_filter.refresh()
+        # Extended in place from the last row seen, without the expiry join; right after a
+        # rebuild the rows blacklisted since it started are read again as well
+        self.assertIs(revoked_filter._filter, bloom)
+        self.assertIn(second['jti'], bloom)
+        self.assertEqual(len(queries), 2)
+        self.assertIn('"token_blacklist_blacklistedtoken"."id" >', queries[0]['sql'])
+        self.assertIn('"blacklisted_at" >=', queries[1]['sql'])
+        self.assertNotIn('expires_at', queries[0]['sql'] + queries[1]['sql'])
+
+    @mock.patch('users.models.record_revoked')
+    @mock.patch('users.tokens.time.monotonic')
+    def test_row_committed_after_a_higher_one_is_read_by_the_next_refresh(self, monotonic, record_revoked, shared):
+        late, early = RefreshToken.for_user(self.user), RefreshToken.for_user(self.user)
+        monotonic.return_value = 1000
+        revoked_filter.rebuild()
+        late.blacklist()
+        early.blacklist()
+        # The row of `late` took the lower id but commits after `early` was read
+        row = BlacklistedToken.objects.get(token__jti=late['jti'])
+        row_id = row.pk
+        row.delete()
+        monotonic.return_value = 1100
+        revoked_filter.refresh()
+        self.assertIn(early['jti'], revoked_filter._filter)
+        self.assertNotIn(late['jti'], revoked_filter._filter)
+
+        BlacklistedToken.objects.create(pk=row_id, token_id=row.token_id)
+        monotonic.return_value = 1200
+        revoked_filter.refresh()
+        self.assertIn(late['jti'], revoked_filter._filter)
+
+    def test_compaction_deletes_only_expired_tokens(self, shared):
+        now = timezone.now()
+        for i in range(5):
+            expired = i < 3
+            outstanding = OutstandingToken.objects.create(
+                user=self.user, jti=f"jti-{i}", token="t", created_at=now - timedelta(days=2),
+                expires_at=now + timedelta(hours=-1 if expired else 1),
+            )
+            if i % 2 == 0:
+                BlacklistedToken.objects.create(token=outstanding)
+
+        out = StringIO()
+        call_command('compact_tokens', batch_size=2, stdout=out)
+
+        self.assertIn("Deleted 3 expired outstanding tokens (2 of them blacklisted)", out.getvalue())
+        self.assertEqual(sorted(OutstandingToken.objects.values_list('jti', flat=True)), ['jti-3', 'jti-4'])
+        self.assertEqual(list(BlacklistedToken.objects.values_list('token__jti', flat=True)), ['jti-4'])
+
+
+class CustomerSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(username='admin', password='pw', is_staff=True)
+        people = [
+            ('anna', 'anna.k@example.com', "Anna", "Kumar", '+91 98765-43210', 'Pune'),
+            ('ben', 'ben@shop.io', "Ben", "Joanna", '020 555 1234', 'Mumbai'),
+            ('chris', 'chris@example.com', "Chris", "Patil", '', 'Nashik'),
+        ]
+        for username, email, first, last, phone, city in people:
+            user = User.objects.create_user(username=username, email=email, first_name=first, last_name=last)
+            Customer.objects.create(user=user, phone_number=phone, city=city)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def search(self, **params):
+        response = self.client.get('/api/users/v1/list/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def usernames(self, **params):
+        return [customer['username'] for customer in self.search(**params)['results']]
+
+    def test_matches_substrings_of_every_searchable_column(self):
+        self.assertEqual(self.usernames(search='anna'), ['anna', 'ben'])
+        self.assertEqual(self.usernames(search='EXAMPLE.com'), ['anna', 'chris'])
+        self.assertEqual(self.usernames(search='nash'), ['chris'])
+        self.assertEqual(self.usernames(search='anna', match='prefix'), ['anna'])
+        self.assertEqual(self.usernames(search='zzz'), [])
+
+    def test_short_queries_match_prefixes_and_phones_match_digits(self):
+        self.assertEqual(self.usernames(search='pu'), ['anna'])
+        self.assertEqual(self.usernames(search='b'), ['ben'])
+        self.assertEqual(self.usernames(search='98765 43210'), ['anna'])
+        self.assertEqual(self.usernames(search='(020) 555'), ['ben'])
+
+    def test_pages_follow_the_next_cursor(self):
+        first = self.search(size=2)
+        self.assertEqual([customer['username'] for customer in first['results']], ['anna', 'ben'])
+        second = self.search(size=2, cursor=first['next'])
+        self.assertEqual([customer['username'] for customer in second['results']], ['chris'])
+        self.assertIsNone(second['next'])
+
+        page = self.search(search='example', size=1)
+        self.assertEqual(self.usernames(search='example', size=1, cursor=page['next']), ['chris'])
+
+        self.assertEqual(self.client.get('/api/users/v1/list/', {'cursor': 'not-a-cursor'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/users/v1/list/', {'size': 500}).status_code, 400)
+
+    def test_index_follows_user_changes_but_skips_sign_ins(self):
+        user = User.objects.get(username='chris')
+        user.email = 'c.patil@mail.org'
+        user.save()
+        self.assertEqual(self.usernames(search='mail.org'), ['chris'])
+        self.assertEqual(self.usernames(search='chris@'), [])
+
+        with CaptureQueriesContext(connection) as queries:
+            user.last_login = timezone.now()
+            user.save(update_fields=['last_login'])
+        self.assertFalse(any('users_customersearch' in query['sql'] for query in queries))
+
+    def test_rebuild_restores_the_index(self):
+        CustomerSearchToken.objects.all().delete()
+        CustomerSearchEntry.objects.all().delete()
+        call_command('rebuild_customer_search_index', chunk_size=2, stdout=StringIO())
+        self.assertEqual(CustomerSearchEntry.objects.count(), 3)
+        self.assertEqual(self.usernames(search='mumbai'), ['ben'])
+
+    def test_accented_values_are_indexed_and_match_plain_queries(self):
+        user = User.objects.create_user(username='jose', email='jose@example.com', first_name="José", last_name="Müller")
+        Customer.objects.create(user=user, city='São Paulo')
+        self.assertEqual(self.usernames(search='josé'), ['jose'])
+        self.assertEqual(self.usernames(search='muller'), ['jose'])
+        self.assertEqual(self.usernames(search='sao paulo'), ['jose'])
+        self.assertEqual(CustomerSearchEntry.objects.get(customer__user=user).name, "jose muller")
+
+    def test_only_admins_may_list(self):
+        self.client.force_authenticate(User.objects.get(username='anna'))
+        self.assertEqual(self.client.get('/api/users/v1/list/').status_code, 403)
+
+
+class ProfileEndpointTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='poller', password='pw', email='p@example.com', first_name="Pia")
+        cls.customer = Customer.objects.create(user=cls.user, city='Pune', phone_number='12345')
+        cls.newcomer = User.objects.create_user(username='newcomer', password='pw', email='n@example.com')
+
+    def setUp(self):
+        cache.clear()
+        auth_cache._local.clear()
+
+    def client_for(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}")
+        # Warms the authentication cache
+        client.get('/api/users/v1/users/me/')
+        return client
+
+    def request(self, client, method, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(client, method)('/api/users/v1/users/me/', data, format='json')
+        return response, [query['sql'] for query in queries]
+
+    def test_read_is_one_query_and_never_writes(self):
+        response, queries = self.request(self.client_for(self.user), 'get')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['customer_profile']['city'], 'Pune')
+        self.assertEqual(len(queries), 1)
+
+        response, queries = self.request(self.client_for(self.newcomer), 'get')
+        self.assertEqual(response.data['customer_profile']['country'], 'Unknown')
+        self.assertEqual(len(queries), 1)
+        self.assertFalse(Customer.objects.filter(user=self.newcomer).exists())
+
+    def test_updates_write_only_changed_columns(self):
+        client = self.client_for(self.user)
+        response, queries = self.request(client, 'patch', {'first_name': "Pia", 'customer_profile': {'city': 'Pune'}})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([sql for sql in queries if sql.startswith('UPDATE') or sql.startswith('INSERT')])
+
+        response, queries = self.request(client, 'patch', {'customer_profile': {'state': 'MH'}})
+        self.assertEqual(response.data['customer_profile']['state'], 'MH')
+        updates = [sql for sql in queries if sql.startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"state"', updates[0])
+        self.assertNotIn('"city"', updates[0])
+        self.assertFalse([sql for sql in queries if 'auth_user" SET' in sql])
+
+        response = client.put('/api/users/v1/users/me/', {'email': 'pia@example.com', 'first_name': "Pia", 'last_name': "Rao"}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['email'], response.data['last_name'], response.data['username']), ('pia@example.com', "Rao", 'poller'))
+        self.assertEqual(Customer.objects.get(user=self.user).state, 'MH')
+
+    def test_first_edit_creates_the_profile(self):
+        response = self.client_for(self.newcomer).patch('/api/users/v1/users/me/', {'customer_profile': {'city': 'Goa'}}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Customer.objects.get(user=self.newcomer).city, 'Goa')
+        self.assertEqual(search_customers('goa'), [Customer.objects.get(user=self.newcomer).pk])
+
+
+class RegistrationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(username='onboarder', password='pw', is_staff=True)
+        User.objects.create_user(username='taken', password='pw')
+
+    def row(self, username, **extra):
+        return {'username': username, 'email': f"{username}@partner.com", 'password': 'secret-123', **extra}
+
+    def test_signup_commits_user_and_profile_together(self):
+        payload = {**self.row('newbie'), 'customer_profile': {'city': 'Pune'}}
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().post('/api/v1/users/', payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        user = User.objects.get(username='newbie')
+        self.assertTrue(user.check_password('secret-123'))
+        # The cart comes with the first cart write
+        self.assertFalse(Cart.objects.filter(user=user).exists())
+        self.assertEqual(search_customers('pune'), [user.customer_profile.pk])
+        # No lookups of the profile or search entry that cannot exist yet
+        self.assertFalse([query for query in queries if query['sql'].startswith('SELECT') and 'users_customer' in query['sql']])
+
+        with mock.patch.object(Customer.objects, 'create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                APIClient().post('/api/v1/users/', {**self.row('halfway'), 'customer_profile': {}}, format='json')
+        self.assertFalse(User.objects.filter(username='halfway').exists())
+
+    def test_bulk_registration_reports_failures_per_row(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        rows = [
+            self.row('partner-1', customer_profile={'city': 'Lyon'}),
+            self.row('partner-2'),
+            self.row('taken'),
+            {'username': 'no-email', 'password': 'x'},
+            self.row('partner-1'),
+            self.row('partner-3', first_name="Zoe"),
+        ]
+        response = client.post('/api/v1/users/bulk/', {'users': rows}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([entry['row'] for entry in response.data['created']], [0, 1, 5])
+        self.assertEqual({entry['row']: list(entry['errors']) for entry in response.data['failed']}, {2: ['username'], 3: ['email'], 4: ['username']})
+        users = User.objects.filter(username__startswith='partner-')
+        self.assertEqual(users.count(), 3)
+        self.assertTrue(all(user.check_password('secret-123') for user in users))
+        self.assertEqual(Customer.objects.filter(user__in=users).count(), 3)
+        self.assertEqual(search_customers('lyon'), [Customer.objects.get(user__username='partner-1').pk])
+        self.assertEqual(search_customers('zoe'), [Customer.objects.get(user__username='partner-3').pk])
+
+    def test_conflicts_at_insert_time_fail_only_their_rows(self):
+        rows = [self.row('late-1'), self.row('taken'), self.row('late-2')]
+        # As if 'taken' were registered after the check, or collided with a row only under the
+        # database collation: the chunk insert fails and so would a retry of the whole chunk
+        with mock.patch('users.registration._taken_usernames', return_value=set()):
+            result = register_users(rows, workers=2)
+        self.assertEqual(sorted(result['created']), [0, 2])
+        self.assertEqual(list(result['failed']), [1])
+        self.assertTrue(User.objects.get(username='late-2').check_password('secret-123'))
+
+    def test_bulk_registration_is_staff_only_and_bounded(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.get(username='taken'))
+        self.assertEqual(client.post('/api/v1/users/bulk/', {'users': [self.row('x')]}, format='json').status_code, 403)
+
+        client.force_authenticate(self.admin)
+        with override_settings(BULK_REGISTRATION_MAX_ROWS=1):
+            response = client.post('/api/v1/users/bulk/', {'users': [self.row('x'), self.row('y')]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(client.post('/api/v1/users/bulk/', {'users': []}, format='json').status_code, 400)
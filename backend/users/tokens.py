@@ -0,0 +1,224 @@
+import hashlib
+import math
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils import timezone
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken as BaseRefreshToken
+
+# Marks a token blacklisted within the last few filter refreshes, for the processes whose filter
+# was built before it. Set for every blacklisted token (see users/models.py); only trusted when
+# the default cache is shared by every process (see cache_is_shared()).
+RECENTLY_REVOKED_KEY = 'tokens:revoked:{jti}'
+
+# Cache backends private to one process (or no cache at all)
+LOCAL_CACHE_BACKENDS = (LocMemCache, DummyCache)
+
+# Blacklist rows read per query while a filter is built or extended
+FILTER_BATCH_SIZE = 10000
+
+# Seconds a transaction blacklisting a token may take to commit after taking its primary key:
+# a row that commits after a higher one was read is caught by re-reading rows this recent
+FILTER_COMMIT_MARGIN = 60
+
+FILTER_ERROR_RATE = 0.001
+
+
+def filter_refresh_interval():
+    """Seconds between rebuilds of the revoked-token filter (TOKEN_BLACKLIST_FILTER_REFRESH)."""
+    return getattr(settings, 'TOKEN_BLACKLIST_FILTER_REFRESH', 60)
+
+
+class BloomFilter:
+    """
+    Fixed-size set of strings without false negatives: `in` is False only for strings never
+    added, and True for others with probability about `error_rate`.
+    """
+
+    def __init__(self, capacity, error_rate=FILTER_ERROR_RATE):
+        capacity = max(capacity, 1)
+        self.size = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        # Double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+def cache_is_shared():
+    """True when the default cache is shared between processes (e.g. Redis or Memcached)."""
+    return not isinstance(caches['default'], LOCAL_CACHE_BACKENDS)
+
+
+class RevokedTokenFilter:
+    """
+    Per-process Bloom filter over the jtis of blacklisted tokens. Every filter_refresh_interval()
+    seconds it is extended with the rows blacklisted since (a primary key range read); it is only
+    built from scratch on first use and once the blacklist outgrew its capacity. Expired tokens
+    stay in it until then, which only costs table lookups: `manage.py compact_tokens` prunes them.
+    While one request refreshes it, the others keep using the current filter.
+
+    Primary keys are taken before commit, so a row may become visible after a higher one was
+    read. Each refresh therefore starts again from the last id read FILTER_COMMIT_MARGIN
+    before the previous refresh, and for that long after a rebuild also re-reads the rows
+    blacklisted since the rebuild started: a late row is in the filter by the first refresh
+    after its commit, well within the lifetime of its RECENTLY_REVOKED marker.
+    """
+
+    def __init__(self):
+        self._filter = None
+        self._built_at = 0
+        self._last_id = 0
+        # (monotonic time a read started, last id read by then), oldest first
+        self._checkpoints = deque()
+        self._rebuilt_since = None
+        self._capacity = self._size = 0
+        self._lock = threading.Lock()
+
+    def _stale(self):
+        return self._filter is None or time.monotonic() - self._built_at > filter_refresh_interval()
+
+    def _read_since(self, bloom, last_id):
+        """Adds the jtis blacklisted after row `last_id` to `bloom`; returns (last id, rows added)."""
+        added = 0
+        while True:
+            batch = list(
+                BlacklistedToken.objects.filter(pk__gt=last_id).order_by('pk')
+                .values_list('pk', 'token__jti')[:FILTER_BATCH_SIZE]
+            )
+            for pk, jti in batch:
+                bloom.add(jti)
+                # Re-read rows were counted the first time
+                added += pk > self._last_id
+            if len(batch) < FILTER_BATCH_SIZE:
+                return (batch[-1][0] if batch else last_id), added
+            last_id = batch[-1][0]
+
+    def rebuild(self):
+        started, rebuilt_since = time.monotonic(), timezone.now() - timedelta(seconds=FILTER_COMMIT_MARGIN)
+        # Sized for twice the current blacklist, so the tokens added by later refreshes fit
+        capacity = 2 * BlacklistedToken.objects.count() + 1024
+        bloom = BloomFilter(capacity)
+        self._last_id = 0
+        last_id, size = self._read_since(bloom, 0)
+        self._filter, self._built_at, self._last_id = bloom, started, last_id
+        self._capacity, self._size = capacity, size
+        self._checkpoints = deque([(started, last_id)])
+        self._rebuilt_since = rebuilt_since
+
+    def refresh(self):
+        """Extends the filter with the newly blacklisted tokens, or rebuilds it when it is full."""
+        if self._filter is None or self._size > self._capacity:
+            self.rebuild()
+            return
+        started = time.monotonic()
+        # Drop the checkpoints no refresh will start from again
+        horizon = self._built_at - FILTER_COMMIT_MARGIN
+        while len(self._checkpoints) > 1 and self._checkpoints[1][0] <= horizon:
+            self._checkpoints.popleft()
+        checkpoint_at, start_id = self._checkpoints[0]
+
+        last_id, added = self._read_since(self._filter, start_id)
+        if checkpoint_at > horizon:
+            # Still within the commit margin of the rebuild, which had no earlier read to start from
+            recent = BlacklistedToken.objects.filter(pk__lte=start_id, blacklisted_at__gte=self._rebuilt_since)
+            for jti in recent.values_list('token__jti', flat=True):
+                self._filter.add(jti)
+        self._last_id = max(self._last_id, last_id)
+        self._size += added
+        self._built_at = started
+        self._checkpoints.append((started, self._last_id))
+
+    def __contains__(self, jti):
+        # Only the very first build makes requests wait
+        if self._stale() and self._lock.acquire(blocking=self._filter is None):
+            try:
+                if self._stale():
+                    self.refresh()
+            finally:
+                self._lock.release()
+        return jti in self._filter
+
+    def add(self, jti):
+        bloom = self._filter
+        if bloom is not None:
+            bloom.add(jti)
+
+    def clear(self):
+        self._filter = None
+        self._last_id = 0
+        self._checkpoints.clear()
+
+
+revoked_filter = RevokedTokenFilter()
+
+
+def record_revoked(jti):
+    """Makes a newly blacklisted token visible to every process before their filters catch up."""
+    revoked_filter.add(jti)
+    # Twice the refresh interval also covers tokens blacklisted while a filter was being built
+    cache.set(RECENTLY_REVOKED_KEY.format(jti=jti), True, 2 * filter_refresh_interval() + 60)
+
+
+def is_token_blacklisted(jti):
+    """
+    True if the token with this jti is blacklisted. Only jtis the filter may contain (blacklisted
+    ones and about 0.1% of the rest) are looked up in the table; with a shared cache, the others
+    are checked against the tokens blacklisted by any process since the filter was refreshed.
+    A per-process cache cannot see the other processes' revocations, so then every check
+    ends in the table.
+    """
+    if not cache_is_shared() or jti in revoked_filter:
+        return BlacklistedToken.objects.filter(token__jti=jti).exists()
+    return cache.get(RECENTLY_REVOKED_KEY.format(jti=jti)) is not None
+
+
+class RefreshToken(BaseRefreshToken):
+    """simplejwt's RefreshToken with the blacklist check going through the revoked-token filter."""
+
+    def check_blacklist(self):
+        if is_token_blacklisted(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError("Token is blacklisted")
+
+
+def compact_tokens(batch_size=5000, now=None):
+    """
+    Deletes expired outstanding tokens and their blacklist entries: the table is walked by
+    primary key in bounded batches, one short transaction (two DELETEs) per batch that holds
+    expired tokens. Expired tokens cannot be used, so neither row is needed any more.
+    Returns (outstanding, blacklisted) deleted counts.
+    """
+    now = now or timezone.now()
+    outstanding = blacklisted = 0
+    last_id = 0
+    while True:
+        # expires_at is not indexed; a primary key range read stays cheap at any table size
+        batch = list(OutstandingToken.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', 'expires_at')[:batch_size])
+        if not batch:
+            break
+        last_id = batch[-1][0]
+        expired = [pk for pk, expires_at in batch if expires_at <= now]
+        if expired:
+            _, deleted = OutstandingToken.objects.filter(pk__in=expired).delete()
+            outstanding += deleted.get(OutstandingToken._meta.label, 0)
+            blacklisted += deleted.get(BlacklistedToken._meta.label, 0)
+    return outstanding, blacklisted
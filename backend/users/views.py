@@ -2,15 +2,17 @@ from rest_framework import viewsets, permissions, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from django.contrib.auth.models import User
-from .serializers import UserRegistrationSerializer, CustomerProfileSerializer
+from django.conf import settings
+from django.db import transaction
+from .registration import register_users
+from .serializers import UserRegistrationSerializer, CustomerProfileSerializer, UserProfileSerializer, with_profile
 from .models import Customer
 from django.shortcuts import get_object_or_404
 from rest_framework import viewsets
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
-from rest_framework.filters import SearchFilter
-from django_filters.rest_framework import DjangoFilterBackend
 from .models import Customer # Assuming CustomUser from .models
 from .serializers import UserSerializer
+from .search import InvalidCursor, decode_cursor, encode_cursor, search_customers
 # You may need to create a pagination.py file if you haven't, or rely on a setting in settings.py
 # If you don't have a custom pagination class, Django uses the default set in settings.
 # from backend.pagination import StandardResultsSetPagination 
@@ -19,25 +21,58 @@ class UserViewSet(viewsets.ModelViewSet):
     """
     A ViewSet for viewing and managing CustomUser instances for the admin dashboard.
     """
-    # Queryset: Show all users for staff/admin to manage
-    # Customer model doesn't have 'email' directly; order by related User email
-    queryset = Customer.objects.select_related('user').all().order_by('user__email')
+    # Queryset: Show all users for staff/admin to manage, in id order (the keyset of the list)
+    queryset = Customer.objects.select_related('user').all().order_by('pk')
     serializer_class = UserSerializer
     
     # Security: Only authenticated admin/staff users should access this list
     permission_classes = [IsAuthenticated, IsAdminUser]
+
+    MAX_PAGE_SIZE = 100
+
+    def list(self, request, *args, **kwargs):
+        """
+        Keyset-paginated customer list for the dashboard, in id order.
+        Query params: search (matches email, username, name, phone and city anywhere; one or two
+        characters match the start), match=prefix (only match the start), size (default 20,
+        max 100) and cursor (the 'next' of the previous page).
+        """
+        params = request.query_params
+        try:
+            after = decode_cursor(params.get('cursor'))
+            page_size = int(params.get('size', 20))
+        except InvalidCursor as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except ValueError:
+            return Response({"detail": "'size' must be a valid integer."}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= page_size <= self.MAX_PAGE_SIZE:
+            return Response({"detail": f"'size' must be between 1 and {self.MAX_PAGE_SIZE}."}, status=status.HTTP_400_BAD_REQUEST)
+
+        query = params.get('search', '').strip()
+        queryset = self.get_queryset()
+        if query:
+            # One extra id to find out whether another page exists
+            ids = search_customers(query, prefix=params.get('match') == 'prefix', after=after, limit=page_size + 1)
+            by_id = queryset.in_bulk(ids[:page_size])
+            customers = [by_id[pk] for pk in ids[:page_size] if pk in by_id]
+            has_more = len(ids) > page_size
+        else:
+            customers = list(queryset.filter(pk__gt=after)[:page_size + 1])
+            has_more = len(customers) > page_size
+            customers = customers[:page_size]
+
+        return Response({
+            "next": encode_cursor(customers[-1].pk) if customers and has_more else None,
+            "page_size": page_size,
+            "results": self.get_serializer(customers, many=True).data,
+        })
     
-    # Enable filtering and searching
-    filter_backends = [DjangoFilterBackend, SearchFilter]
-    search_fields = ['email', 'first_name', 'last_name']
-    
-    # Note: DRF handles the default GET list method and pagination automatically.
     # We add a custom action to map to your non-standard URL pattern /users/list/
-    # This action allows /api/v1/users/list/?page=1&size=10 to work correctly.
+    # This action allows /api/v1/users/list/?search=ann&size=10 to work correctly.
     @action(detail=False, methods=['get'], url_path='list')
     def list_users(self, request, *args, **kwargs):
         """Maps /users/list/ to the standard list functionality."""
-        return self.list(request, *args, akwargs)
+        return self.list(request, *args, **kwargs)
 
 class CustomerViewSet(viewsets.ModelViewSet):
     """
@@ -62,8 +97,8 @@ class CustomerViewSet(viewsets.ModelViewSet):
         # Use a serializer that includes profile details for authenticated actions
         # When retrieving or updating, we want the nested profile data
         if self.action in ['retrieve', 'update', 'partial_update', 'me']:
-            # We use the registration serializer here since it contains the nested profile
-            return UserRegistrationSerializer 
+            # Same nested shape as registration, without the password and with change-only writes
+            return UserProfileSerializer
         
         # For listing all users (typically admin-only), stick to a basic user serializer
         return UserRegistrationSerializer
@@ -80,12 +115,18 @@ class CustomerViewSet(viewsets.ModelViewSet):
         # Standard customers can only access their own user object
         return User.objects.filter(pk=user.pk).select_related('customer_profile')
 
+    def get_object(self):
+        return with_profile(super().get_object())
+
     def get_permissions(self):
         """
         Allows unauthenticated users to POST (register).
         """
         if self.action == 'create':
             self.permission_classes = [permissions.AllowAny]
+        elif self.action == 'bulk_register':
+            # Partner onboarding is run by staff
+            self.permission_classes = [permissions.IsAdminUser]
         else:
             # All other actions (me, update, retrieve, list) require authentication
             self.permission_classes = [permissions.IsAuthenticated]
@@ -102,47 +143,56 @@ class CustomerViewSet(viewsets.ModelViewSet):
             # This case should be caught by permission_classes, but serves as a fail-safe
             return Response({"detail": "Authentication credentials were not provided."}, status=status.HTTP_401_UNAUTHORIZED)
             
-        user = request.user
-        
+        # One joined query for the user and their profile; a missing profile is only created
+        # by the first edit, so polling this endpoint never writes
+        users = User.objects.select_related('customer_profile')
+
         if request.method == 'GET':
             # Retrieve action
-            # Ensure the customer_profile exists so response isn't null
-            Customer.objects.get_or_create(user=user)
+            user = with_profile(get_object_or_404(users, pk=request.user.pk))
             serializer = self.get_serializer(user)
             return Response(serializer.data)
 
         elif request.method in ['PUT', 'PATCH']:
-            # Update action (PUT/PATCH)
-            
-            # The serializer must be initialized with the instance to update
-            # We get the user and prepare to update it with the incoming data
-            serializer = self.get_serializer(
-                user, 
-                data=request.data, 
-                partial=request.method == 'PATCH' # partial is True for PATCH
-            )
-            serializer.is_valid(raise_exception=True)
-            
-            # Since the user is updating their profile, they shouldn't be able to change
-            # the core User fields like 'id' or 'is_staff' but can change the nested fields.
-            
-            # We need a custom update logic to handle the nested profile update
-            profile_data = request.data.get('customer_profile', {})
-            
-            # Update core User fields if provided (e.g., email, first_name)
-            user.first_name = request.data.get('first_name', user.first_name)
-            user.last_name = request.data.get('last_name', user.last_name)
-            user.email = request.data.get('email', user.email)
-            user.save()
-
-            # Ensure the related Customer profile exists, then update its fields
-            customer_profile, _ = Customer.objects.get_or_create(user=user)
-            if profile_data:
-                for attr, value in profile_data.items():
-                    setattr(customer_profile, attr, value)
-                customer_profile.save()
+            # Update action (PUT/PATCH): only changed columns are written, none if nothing changed
+            with transaction.atomic():
+                # Locks the user row so concurrent edits of the same profile apply one after the other
+                user = with_profile(get_object_or_404(users.select_for_update(of=('self',)), pk=request.user.pk))
+                serializer = self.get_serializer(
+                    user,
+                    data=request.data,
+                    partial=request.method == 'PATCH' # partial is True for PATCH
+                )
+                serializer.is_valid(raise_exception=True)
+                serializer.save()
 
-            # Re-serialize and return the full updated object
-            return Response(self.get_serializer(user).data)
+            # The updated instances are serialized as they are, without reloading them
+            return Response(serializer.data)
         
         return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    # --- Custom Action for B2B (partner) batch registration ---
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk_register(self, request):
+        """
+        Registers a batch of users (with profiles) for staff.
+        Route: /api/v1/users/bulk/
+        Body: {"users": [<registration payload>, ...]} with at most BULK_REGISTRATION_MAX_ROWS rows.
+        Invalid rows are reported by their index and do not stop the others. Passwords are hashed
+        within the request (no worker processes), which is what bounds the batch size.
+        """
+        rows = request.data.get('users') if isinstance(request.data, dict) else None
+        if not isinstance(rows, list) or not rows:
+            return Response({"detail": "'users' must be a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
+        max_rows = getattr(settings, 'BULK_REGISTRATION_MAX_ROWS', 100)
+        if len(rows) > max_rows:
+            return Response(
+                {"detail": f"At most {max_rows} users per request; use `manage.py register_users` for larger imports."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        result = register_users(rows, workers=1)
+        return Response({
+            "created": [{"row": row, "id": user_id} for row, user_id in result['created'].items()],
+            "failed": [{"row": row, "errors": errors} for row, errors in result['failed'].items()],
+        }, status=status.HTTP_201_CREATED if result['created'] else status.HTTP_400_BAD_REQUEST)